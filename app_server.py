@@ -1,15 +1,37 @@
 from __future__ import annotations
+from contextlib import asynccontextmanager
 from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
+import asyncio
+import random
 import time
 import logging
-from clipnotes.api.notes import router as notes_router
+from clipnotes.api.notes import router as notes_router, get_store
 from clipnotes.mcp_server.server import mcp_app
+from clipnotes.mcp_server.api_client import close_api_client
+from clipnotes.mcp_server.notes_backend import InProcessNotesBackend, configure_notes_backend
 from clipnotes.config import settings
+from clipnotes.metrics import HTTP_LATENCY, HTTP_REQUESTS
+from clipnotes.utils import warm_up_keywords, start_keyword_pool, shutdown_keyword_pool
+from clipnotes.storage.markdown import shutdown_markdown_queue
+from clipnotes.storage.segment_store import claim_data_dir
 
 logger = logging.getLogger(__name__)
 
-app = FastAPI(title="ClipNotes", version="0.1.1")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """启动时预热 jieba 并拉起关键词进程池；关闭时写完排队的 Markdown，再回收进程池和 MCP 的 API 客户端"""
+    if settings.storage_provider == 'segment':
+        # 段存储只支持单进程：多 worker 时后启动的进程在这里失败
+        await asyncio.to_thread(claim_data_dir, settings.data_dir)
+    await asyncio.to_thread(warm_up_keywords)
+    start_keyword_pool()
+    yield
+    await close_api_client()
+    await asyncio.to_thread(shutdown_markdown_queue, 30)
+    shutdown_keyword_pool()
+
+app = FastAPI(title="ClipNotes", version="0.1.1", lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -20,20 +42,43 @@ app.add_middleware(
     expose_headers=["Mcp-Session-Id"],
 )
 
+def _route_label(request: Request) -> str:
+    """指标用的路由模板（/notes/{note_id}），避免按具体路径产生无限多的标签"""
+    route = request.scope.get("route")
+    if route is not None:
+        return getattr(route, "path", "") or "unmatched"
+    return "unmatched"
+
+def _record_request(request: Request, status_code: int, process_time: float):
+    route = _route_label(request)
+    HTTP_REQUESTS.inc(request.method, route, str(status_code))
+    HTTP_LATENCY.observe(process_time, request.method, route)
+
+def _should_log_access(status_code: int, process_time: float) -> bool:
+    """访问日志采样：错误和慢请求始终记录，其余按 ACCESS_LOG_SAMPLE_RATE 抽样"""
+    if status_code >= 400 or process_time * 1000 >= settings.access_log_slow_ms:
+        return True
+    rate = settings.access_log_sample_rate
+    return rate >= 1 or (rate > 0 and random.random() < rate)
+
 @app.middleware("http")
 async def log_requests(request: Request, call_next):
-    """请求日志中间件"""
+    """请求日志中间件（同时记录请求数与耗时指标；访问日志按采样率记录）"""
     start_time = time.time()
     try:
         response = await call_next(request)
         process_time = time.time() - start_time
-        logger.info(
-            f"{request.method} {request.url.path} - "
-            f"{response.status_code} - {process_time:.3f}s"
-        )
+        _record_request(request, response.status_code, process_time)
+        if _should_log_access(response.status_code, process_time):
+            logger.info(
+                "%s %s - %s - %.3fs", request.method, request.url.path, response.status_code, process_time,
+                extra={"method": request.method, "path": request.url.path,
+                       "status": response.status_code, "duration_ms": round(process_time * 1000, 1)},
+            )
         return response
     except Exception as e:
         process_time = time.time() - start_time
+        _record_request(request, 500, process_time)
         logger.error(
             f"{request.method} {request.url.path} - "
             f"ERROR - {process_time:.3f}s - {str(e)}",
@@ -43,3 +88,6 @@ async def log_requests(request: Request, call_next):
 
 app.include_router(notes_router)
 app.mount("/mcp", mcp_app)
+if settings.mcp_in_process:
+    # 同进程挂载：MCP 工具直接使用 API 的存储实例池，不再经回环 HTTP
+    configure_notes_backend(InProcessNotesBackend(get_store))
@@ -0,0 +1,66 @@
+from __future__ import annotations
+from typing import Iterator, List
+import random
+from clipnotes.models import NoteIn, ContextMsg
+
+LANG_ZH = 'zh'
+LANG_EN = 'en'
+LANGS = (LANG_ZH, LANG_EN)
+
+_ZH_WORDS = (
+    "异步 编程 事件 循环 协程 并发 线程 进程 缓存 索引 数据库 事务 分布式 一致性 哈希 队列 消息 存储 对象 "
+    "网络 延迟 吞吐 压缩 序列化 日志 监控 告警 部署 容器 镜像 集群 节点 副本 分片 检索 排序 相关度 分词 "
+    "向量 模型 训练 推理 提示词 上下文 摘要 笔记 标签 标题 时间 用户 租户 权限 认证 令牌 接口 路由 中间件 "
+    "性能 优化 瓶颈 内存 磁盘 文件 目录 备份 恢复 迁移 版本 发布 回滚 测试 基准 指标 直方图 采样 "
+    "苹果 香蕉 咖啡 旅行 读书 电影 音乐 健身 做饭 天气 周末 计划 会议 复盘 总结 想法 灵感 问题 答案"
+).split()
+
+_EN_WORDS = (
+    "async await event loop coroutine thread process cache index database transaction distributed "
+    "consistency hash queue message storage object network latency throughput compression serialization "
+    "logging monitoring alert deploy container image cluster node replica shard search ranking relevance "
+    "token vector model training inference prompt context summary note tag title time user tenant "
+    "permission auth route middleware performance bottleneck memory disk file directory backup restore "
+    "migration release rollback benchmark metric histogram sampling python rust golang kubernetes redis "
+    "postgres sqlite fastapi pydantic uvicorn coffee travel reading movie music workout cooking weather"
+).split()
+
+def vocabulary(lang: str) -> List[str]:
+    return list(_ZH_WORDS if lang == LANG_ZH else _EN_WORDS)
+
+def _sentence(rng: random.Random, words: List[str], lang: str, n: int) -> str:
+    picked = [rng.choice(words) for _ in range(n)]
+    if lang == LANG_ZH:
+        return ''.join(picked) + '。'
+    return ' '.join(picked).capitalize() + '.'
+
+def make_note(rng: random.Random, lang: str, seq: int, with_tags: bool = True) -> NoteIn:
+    """
+    生成一篇合成笔记：标题 + 若干句正文（长度按长尾分布，少数笔记很长）+ 0~3 条上下文
+
+    正文末尾带序号，保证内容互不相同（不会被去重）。with_tags=False 时由保存流程提取关键词。
+    """
+    words = vocabulary(lang)
+    sentences = max(1, int(rng.paretovariate(1.5) * 3))
+    body = ' '.join(_sentence(rng, words, lang, rng.randint(6, 14)) for _ in range(min(sentences, 200)))
+    title = _sentence(rng, words, lang, rng.randint(2, 5)).rstrip('。.')
+    context = [ContextMsg(role=rng.choice(["user", "assistant"]), text=_sentence(rng, words, lang, rng.randint(5, 12)))
+               for _ in range(rng.randint(0, 3))]
+    return NoteIn(
+        content=f"{title}\n{body} #{seq}",
+        tags=rng.sample(words, 3) if with_tags else [],
+        context_before=context,
+    )
+
+def generate(lang: str, count: int, seed: int = 0, with_tags: bool = True) -> Iterator[NoteIn]:
+    """按固定随机种子生成 count 篇笔记（同样的参数生成同样的数据，便于跨版本对比）"""
+    rng = random.Random(f"{lang}:{seed}")
+    for i in range(count):
+        yield make_note(rng, lang, i, with_tags)
+
+def make_queries(lang: str, count: int, seed: int = 0) -> List[str]:
+    """搜索查询：单词、两个词组合（AND）各占一半"""
+    rng = random.Random(f"q:{lang}:{seed}")
+    words = vocabulary(lang)
+    sep = '' if lang == LANG_ZH else ' '
+    return [rng.choice(words) if i % 2 == 0 else sep.join(rng.sample(words, 2)) for i in range(count)]
@@ -0,0 +1,156 @@
+from __future__ import annotations
+from bisect import bisect_right, insort
+from typing import Dict, Iterable, List, Optional, Tuple
+import hashlib
+import threading
+import time
+import oss2
+from oss2.models import SimplifiedObjectInfo
+
+class _Result:
+    def __init__(self, **kw):
+        self.__dict__.update(kw)
+
+class _Body:
+    """get_object 的返回：read() 取出全部内容"""
+
+    def __init__(self, data: bytes, etag: str):
+        self._data = data
+        self.etag = etag
+        self.status = 200
+        self.content_length = len(data)
+        self.headers = {'ETag': f'"{etag}"'}
+
+    def read(self, amt: Optional[int] = None) -> bytes:
+        data, self._data = self._data, b''
+        return data
+
+    def __iter__(self):
+        yield self.read()
+
+class MemoryBucket:
+    """
+    进程内的 OSS 桶替身（基准测试用，无需网络）
+
+    实现 AliyunOSSStorage 用到的 oss2.Bucket 接口：put/get/delete、批量删除、object_exists，
+    按前缀 + delimiter + marker 分页的 list_objects，以及条件请求头
+    （If-None-Match → NotModified，If-Match → PreconditionFailed，x-oss-forbid-overwrite → 409）。
+    与 oss2 一致，返回的 etag 不带引号，条件请求头中的 ETag 带引号。
+    latency 为每次调用附加的延迟（秒），用来近似真实 OSS 的往返时间。
+    """
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self._objects: Dict[str, Tuple[bytes, str, int]] = {}
+        self._keys: List[str] = []  # 有序 key 列表，list_objects 用二分定位 marker
+        self._lock = threading.Lock()
+        self.calls: Dict[str, int] = {}
+        self.bytes_in = 0
+        self.bytes_out = 0
+
+    def _call(self, op: str):
+        with self._lock:
+            self.calls[op] = self.calls.get(op, 0) + 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    @staticmethod
+    def _error(cls, status: int, code: str, key: str = ''):
+        return cls(status, {}, b'', {'Code': code, 'Message': key})
+
+    def put_object(self, key: str, data, headers: Optional[dict] = None, **kwargs):
+        self._call('put')
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+        elif not isinstance(data, (bytes, bytearray)):
+            data = b''.join(data)
+        headers = headers or {}
+        with self._lock:
+            cur = self._objects.get(key)
+            if 'If-Match' in headers and (cur is None or f'"{cur[1]}"' != headers['If-Match']):
+                raise self._error(oss2.exceptions.PreconditionFailed, 412, 'PreconditionFailed', key)
+            if headers.get('x-oss-forbid-overwrite') == 'true' and cur is not None:
+                raise self._error(oss2.exceptions.ServerError, 409, 'FileAlreadyExists', key)
+            etag = hashlib.md5(data).hexdigest().upper()
+            if cur is None:
+                insort(self._keys, key)
+            self._objects[key] = (bytes(data), etag, int(time.time()))
+            self.bytes_in += len(data)
+        return _Result(etag=etag, status=200)
+
+    def get_object(self, key: str, byte_range=None, headers: Optional[dict] = None, **kwargs):
+        self._call('get')
+        with self._lock:
+            obj = self._objects.get(key)
+        if obj is None:
+            raise self._error(oss2.exceptions.NoSuchKey, 404, 'NoSuchKey', key)
+        data, etag, _ = obj
+        if headers and headers.get('If-None-Match') == f'"{etag}"':
+            raise self._error(oss2.exceptions.NotModified, 304, 'NotModified', key)
+        if byte_range is not None:
+            start, end = byte_range
+            data = data[start or 0:(end + 1) if end is not None else None]
+        with self._lock:
+            self.bytes_out += len(data)
+        return _Body(data, etag)
+
+    def object_exists(self, key: str, headers: Optional[dict] = None) -> bool:
+        self._call('head')
+        with self._lock:
+            return key in self._objects
+
+    def delete_object(self, key: str, **kwargs):
+        self._call('delete')
+        self._remove([key])
+        return _Result(status=204)
+
+    def batch_delete_objects(self, keys: Iterable[str], headers: Optional[dict] = None):
+        self._call('delete')
+        keys = list(keys)
+        self._remove(keys)
+        return _Result(deleted_keys=keys)
+
+    def _remove(self, keys: List[str]):
+        with self._lock:
+            for key in keys:
+                if self._objects.pop(key, None) is not None:
+                    i = bisect_right(self._keys, key) - 1
+                    del self._keys[i]
+
+    def list_objects(self, prefix: str = '', delimiter: str = '', marker: str = '', max_keys: int = 100,
+                     headers: Optional[dict] = None):
+        self._call('list')
+        objects: List[SimplifiedObjectInfo] = []
+        prefixes: List[str] = []
+        last = ''
+        with self._lock:
+            i = bisect_right(self._keys, max(prefix, marker))
+            if prefix > marker and i > 0 and self._keys[i - 1] == prefix:
+                i -= 1
+            if delimiter and marker.endswith(delimiter):
+                # marker 是上一页最后的公共前缀：其下的 key 已经以前缀形式返回过
+                i = max(i, bisect_right(self._keys, marker + '\U0010ffff'))
+            while i < len(self._keys):
+                key = self._keys[i]
+                if not key.startswith(prefix):
+                    break
+                if len(objects) + len(prefixes) >= max_keys:
+                    return _Result(object_list=objects, prefix_list=prefixes, is_truncated=True, next_marker=last)
+                rest = key[len(prefix):]
+                if delimiter and delimiter in rest:
+                    common = prefix + rest.split(delimiter, 1)[0] + delimiter
+                    prefixes.append(common)
+                    last = common
+                    # 跳过同一公共前缀下的其余 key
+                    i = bisect_right(self._keys, common + '\U0010ffff')
+                    continue
+                data, etag, mtime = self._objects[key]
+                objects.append(SimplifiedObjectInfo(key, mtime, etag, 'Normal', len(data), 'Standard'))
+                last = key
+                i += 1
+        return _Result(object_list=objects, prefix_list=prefixes, is_truncated=False, next_marker='')
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"objects": len(self._objects), "calls": dict(self.calls),
+                    "bytes_in": self.bytes_in, "bytes_out": self.bytes_out}
@@ -0,0 +1,252 @@
+"""
+ClipNotes 存储基准测试
+
+为中文、英文两类合成租户分别生成 1k / 10k / 100k 篇笔记，测量 LocalStorage 与
+AliyunOSSStorage（进程内内存桶，无需网络）的 save / list_recent / list_paged / search / similar / delete
+延迟分位数（p50 / p95 / p99）和吞吐，结果写成 JSON，便于不同版本之间对比。
+
+用法：
+    python -m benchmarks.run                                   # 默认全部规模与后端
+    python -m benchmarks.run --sizes 1000 --backends local --op-count 100
+    python -m benchmarks.run --oss-latency-ms 5                # 给每次 OSS 调用加上模拟往返延迟
+    python -m benchmarks.run --baseline benchmarks/results/<旧结果>.json
+"""
+from __future__ import annotations
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+import argparse
+import json
+import logging
+import math
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from clipnotes.storage import LocalStorage, AliyunOSSStorage
+from clipnotes.storage.markdown import MARKDOWN_MODES, MARKDOWN_BACKGROUND, shutdown_markdown_queue
+from clipnotes.storage.note_cache import configure_note_cache, note_cache
+from clipnotes.storage.note_codec import NOTE_FORMATS, NOTE_FORMAT_PRETTY
+from clipnotes.utils import warm_up_keywords, start_keyword_pool, shutdown_keyword_pool
+from .datagen import LANGS, generate, make_queries
+from .fake_bucket import MemoryBucket
+
+BACKENDS = ('local', 'oss')
+OPS = ('save', 'list_recent', 'list_paged', 'search', 'similar', 'delete')
+DEFAULT_SIZES = (1000, 10000, 100000)
+RESULTS_DIR = Path(__file__).parent / 'results'
+
+PAGE_SIZE = 20
+SEARCH_LIMIT = 10
+
+def percentile(sorted_samples: List[float], p: float) -> float:
+    """最近秩法分位数（输入已排序）"""
+    if not sorted_samples:
+        return 0.0
+    k = max(0, min(len(sorted_samples) - 1, math.ceil(p / 100 * len(sorted_samples)) - 1))
+    return sorted_samples[k]
+
+def summarize(samples: List[float], wall: float) -> Dict[str, Any]:
+    """把单次耗时（秒）汇总为毫秒分位数和吞吐（次/秒）"""
+    s = sorted(samples)
+    ms = lambda v: round(v * 1000, 3)
+    return {
+        "count": len(s),
+        "p50_ms": ms(percentile(s, 50)), "p95_ms": ms(percentile(s, 95)), "p99_ms": ms(percentile(s, 99)),
+        "mean_ms": ms(sum(s) / len(s)) if s else 0.0, "max_ms": ms(s[-1]) if s else 0.0,
+        "ops_per_s": round(len(s) / wall, 1) if wall > 0 else 0.0,
+    }
+
+def measure(fn: Callable, items: Iterable) -> Tuple[List[float], float]:
+    """对每个参数调用一次 fn，返回 (每次耗时, 总耗时)"""
+    samples: List[float] = []
+    start = time.perf_counter()
+    for item in items:
+        t = time.perf_counter()
+        fn(item)
+        samples.append(time.perf_counter() - t)
+    return samples, time.perf_counter() - start
+
+def make_store(backend: str, data_dir: Path, tenant: str, bucket: Optional[MemoryBucket], args):
+    if backend == 'local':
+        return LocalStorage(str(data_dir), tenant, markdown_mode=args.markdown_mode, note_format=args.note_format)
+    return AliyunOSSStorage('http://oss.invalid', 'ak', 'sk', 'bench', 'clipnotes/', tenant,
+                            markdown_mode=args.markdown_mode, note_format=args.note_format, bucket=bucket)
+
+def populate(store, lang: str, size: int, seed: int, per_day: int) -> Tuple[List[str], float]:
+    """
+    按天 save_many 预填 size 篇笔记，每天 per_day 篇，从过去逐天推进到昨天
+
+    笔记分布在多天上，与真实租户的目录 / 按天清单结构一致。返回 (笔记ID, 耗时)。
+    """
+    days = math.ceil(size / per_day)
+    start_at = datetime.now(timezone.utc) - timedelta(days=days)
+    notes = generate(lang, size, seed)
+    ids: List[str] = []
+    t = time.perf_counter()
+    for d in range(days):
+        chunk = [n for _, n in zip(range(per_day), notes)]
+        result = store.save_many(chunk, start_at + timedelta(days=d))
+        ids.extend(item.note.id for item in result.items if item.status == "created")
+    return ids, time.perf_counter() - t
+
+def bench_tenant(backend: str, lang: str, size: int, data_dir: Path, args) -> Dict[str, Any]:
+    """单个 (后端, 语言, 规模) 组合：预填数据后依次测量各操作"""
+    tenant = f"bench-{lang}-{size}"
+    bucket = MemoryBucket(latency=args.oss_latency_ms / 1000) if backend == 'oss' else None
+    store = make_store(backend, data_dir, tenant, bucket, args)
+    note_cache().clear()
+
+    ids, populate_s = populate(store, lang, size, args.seed, args.notes_per_day)
+    print(f"[{backend}/{lang}/{size}] 预填 {len(ids)} 篇，用时 {populate_s:.1f}s", file=sys.stderr)
+    rng = random.Random(f"ops:{lang}:{size}:{args.seed}")
+    ops: Dict[str, Dict[str, Any]] = {}
+
+    if 'list_recent' in args.ops:
+        ops['list_recent'] = summarize(*measure(lambda _: store.list_page(PAGE_SIZE), range(args.op_count)))
+
+    if 'list_paged' in args.ops:
+        state = {"cursor": None}
+
+        def next_page(_):
+            items, state["cursor"] = store.list_page(PAGE_SIZE, cursor=state["cursor"])
+        ops['list_paged'] = summarize(*measure(next_page, range(min(args.op_count, max(1, size // PAGE_SIZE)))))
+
+    if 'search' in args.ops:
+        queries = make_queries(lang, args.op_count, args.seed)
+        ops['search'] = summarize(*measure(lambda q: store.search_scored(q, SEARCH_LIMIT), queries))
+
+    if 'similar' in args.ops:
+        queries = make_queries(lang, args.op_count, args.seed)
+        try:
+            ops['similar'] = summarize(*measure(lambda q: store.similar_scored(q, SEARCH_LIMIT), queries))
+        except NotImplementedError:
+            print(f"[{backend}/{lang}/{size}] 不支持向量检索，跳过 similar", file=sys.stderr)
+
+    if 'save' in args.ops:
+        new_notes = list(generate(lang, args.op_count, args.seed + 1, with_tags=False))
+        ops['save'] = summarize(*measure(lambda n: store.save(n, datetime.now(timezone.utc)), new_notes))
+
+    if 'delete' in args.ops:
+        victims = rng.sample(ids, min(args.op_count, len(ids)))
+        ops['delete'] = summarize(*measure(store.delete, victims))
+
+    row = {
+        "backend": backend, "lang": lang, "size": size,
+        "populate": {"notes": len(ids), "seconds": round(populate_s, 3),
+                     "notes_per_s": round(len(ids) / populate_s, 1) if populate_s else 0.0},
+        "ops": ops,
+        "note_cache": note_cache().stats(),
+    }
+    if bucket is not None:
+        row["oss"] = bucket.stats()
+        row["oss"].pop("objects", None)
+    return row
+
+def git_revision() -> str:
+    try:
+        out = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                             cwd=Path(__file__).parent, timeout=5)
+        return out.stdout.strip() or 'unknown'
+    except Exception:
+        return 'unknown'
+
+def compare(results: List[Dict[str, Any]], baseline_path: Path):
+    """与基线结果对比 p50 / p99（正数表示变慢）"""
+    baseline = json.loads(baseline_path.read_text(encoding='utf-8'))
+    old = {(r["backend"], r["lang"], r["size"], op): s
+           for r in baseline["results"] for op, s in r["ops"].items()}
+    print(f"\n对比基线 {baseline_path.name}（{baseline['meta'].get('git_rev')}）")
+    for r in results:
+        for op, s in r["ops"].items():
+            prev = old.get((r["backend"], r["lang"], r["size"], op))
+            if not prev:
+                continue
+            delta = lambda k: f"{(s[k] - prev[k]) / prev[k] * 100:+.1f}%" if prev[k] else "n/a"
+            print(f"  {r['backend']:<5} {r['lang']} {r['size']:>6} {op:<11} "
+                  f"p50 {prev['p50_ms']:.2f}→{s['p50_ms']:.2f}ms ({delta('p50_ms')})  "
+                  f"p99 {prev['p99_ms']:.2f}→{s['p99_ms']:.2f}ms ({delta('p99_ms')})")
+
+def print_table(results: List[Dict[str, Any]]):
+    print(f"\n{'backend':<7} {'lang':<4} {'size':>7} {'op':<11} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'ops/s':>9}")
+    for r in results:
+        for op, s in r["ops"].items():
+            print(f"{r['backend']:<7} {r['lang']:<4} {r['size']:>7} {op:<11} "
+                  f"{s['p50_ms']:>9.2f} {s['p95_ms']:>9.2f} {s['p99_ms']:>9.2f} {s['ops_per_s']:>9.1f}")
+
+def parse_args(argv: Optional[List[str]] = None):
+    csv = lambda v: [x.strip() for x in v.split(',') if x.strip()]
+    p = argparse.ArgumentParser(description="ClipNotes 存储基准测试")
+    p.add_argument('--sizes', type=lambda v: [int(x) for x in csv(v)], default=list(DEFAULT_SIZES),
+                   help="每个租户的笔记数，逗号分隔（默认 1000,10000,100000）")
+    p.add_argument('--backends', type=csv, default=list(BACKENDS), help="local,oss")
+    p.add_argument('--langs', type=csv, default=list(LANGS), help="zh,en")
+    p.add_argument('--ops', type=csv, default=list(OPS), help=",".join(OPS))
+    p.add_argument('--op-count', type=int, default=200, help="每种操作的测量次数")
+    p.add_argument('--seed', type=int, default=0)
+    p.add_argument('--notes-per-day', type=int, default=100, help="预填数据每天的笔记数（决定数据跨越的天数）")
+    p.add_argument('--oss-latency-ms', type=float, default=0.0, help="内存桶每次调用附加的延迟（毫秒）")
+    p.add_argument('--markdown-mode', choices=MARKDOWN_MODES, default=MARKDOWN_BACKGROUND)
+    p.add_argument('--note-format', choices=NOTE_FORMATS, default=NOTE_FORMAT_PRETTY)
+    p.add_argument('--note-cache-bytes', type=int, default=64 * 1024 * 1024, help="笔记读取缓存容量，0 表示关闭")
+    p.add_argument('--data-dir', type=Path, default=None, help="本地存储目录（默认临时目录，结束后删除）")
+    p.add_argument('--out', type=Path, default=None, help="结果 JSON 路径（默认 benchmarks/results/<时间>-<版本>.json）")
+    p.add_argument('--baseline', type=Path, default=None, help="与之前的结果 JSON 对比")
+    args = p.parse_args(argv)
+    for name, values, allowed in (('backends', args.backends, BACKENDS), ('langs', args.langs, LANGS),
+                                  ('ops', args.ops, OPS)):
+        unknown = set(values) - set(allowed)
+        if unknown:
+            p.error(f"未知的 {name}: {', '.join(sorted(unknown))}")
+    return args
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = parse_args(argv)
+    # 只保留警告以上的日志，避免逐条保存的 INFO 日志影响测量
+    logging.basicConfig(level=logging.WARNING, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    logging.getLogger().setLevel(logging.WARNING)
+    configure_note_cache(args.note_cache_bytes)
+    warm_up_keywords()
+    start_keyword_pool()
+
+    data_dir = args.data_dir or Path(tempfile.mkdtemp(prefix='clipnotes-bench-'))
+    results: List[Dict[str, Any]] = []
+    started = datetime.now(timezone.utc)
+    try:
+        for size in args.sizes:
+            for backend in args.backends:
+                for lang in args.langs:
+                    results.append(bench_tenant(backend, lang, size, data_dir, args))
+    finally:
+        shutdown_markdown_queue(60)
+        shutdown_keyword_pool()
+        if args.data_dir is None:
+            shutil.rmtree(data_dir, ignore_errors=True)
+
+    rev = git_revision()
+    report = {
+        "meta": {
+            "started_at": started.isoformat(), "git_rev": rev,
+            "python": sys.version.split()[0], "platform": platform.platform(),
+            "op_count": args.op_count, "seed": args.seed, "notes_per_day": args.notes_per_day,
+            "oss_latency_ms": args.oss_latency_ms,
+            "markdown_mode": args.markdown_mode, "note_format": args.note_format,
+            "note_cache_bytes": args.note_cache_bytes, "page_size": PAGE_SIZE, "search_limit": SEARCH_LIMIT,
+        },
+        "results": results,
+    }
+    out = args.out or RESULTS_DIR / f"{started.strftime('%Y%m%d-%H%M%S')}-{rev}.json"
+    out.parent.mkdir(parents=True, exist_ok=True)
+    out.write_text(json.dumps(report, ensure_ascii=False, indent=2), encoding='utf-8')
+
+    print_table(results)
+    print(f"\n结果已写入 {out}")
+    if args.baseline:
+        compare(results, args.baseline)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,24 +1,35 @@
 from __future__ import annotations
 from fastapi import APIRouter, Depends, Header, HTTPException, Query, status, Request
+from fastapi.responses import PlainTextResponse, StreamingResponse
 from datetime import datetime, timezone
-from typing import Optional
+from typing import Iterable, Optional, Tuple
 import time
 import logging
-from ..models import NoteIn, Note, NoteList
-from ..config import settings
-from ..storage import LocalStorage, AliyunOSSStorage
-from ..utils import sanitize_tenant
+from ..models import NoteIn, Note, NoteList, NoteBatchIn, NoteBatchResult, NearDuplicateReport, SearchHit, SearchResult
+from ..config import settings, log_queue_stats
+from ..storage import LocalStorage, AliyunOSSStorage, SegmentStorage, SQLiteStorage, StoragePool
+from ..storage.aliyun_oss import shared_session
+from ..storage.base import configure_io_executor, iterate_io
+from ..storage.export import EXPORT_NDJSON, EXPORT_MARKDOWN, export_chunks
+from ..storage.ranking import make_snippet
+from ..storage.markdown import MARKDOWN_MODES, MARKDOWN_SYNC, configure_markdown_queue, markdown_queue
+from ..storage.note_cache import configure_note_cache, note_cache
+from ..storage.note_codec import NOTE_FORMATS, NOTE_FORMAT_PRETTY
+from ..storage.near_dup import NearDuplicateError, configure_near_dup
+from ..utils import sanitize_tenant, configure_keywords
+from ..embedding import configure_embeddings, note_text
+from ..metrics import KEYWORD_CACHE, STORAGE_OP_LATENCY, gauge_callback, render_metrics
 
 logger = logging.getLogger(__name__)
 
 router = APIRouter()
 
-def get_tenant(x_user_id: Optional[str] = Header(None)) -> str:
+async def get_tenant(x_user_id: Optional[str] = Header(None)) -> str:
     """获取并清理租户ID"""
     tenant = x_user_id or settings.default_tenant
     return sanitize_tenant(tenant)
 
-def auth(authorization: Optional[str] = Header(None)):
+async def auth(authorization: Optional[str] = Header(None)):
     """认证中间件，带日志记录"""
     if not authorization or not authorization.startswith("Bearer "):
         logger.warning("认证失败: 缺少 Bearer token")
@@ -29,64 +40,319 @@ def auth(authorization: Optional[str] = Header(None)):
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="invalid token")
     return True
 
-def get_store(tenant: str):
+_markdown_mode = settings.markdown_mode.lower()
+if _markdown_mode not in MARKDOWN_MODES:
+    logger.warning(f"未知的 MARKDOWN_MODE: {settings.markdown_mode}，使用 {MARKDOWN_SYNC}")
+    _markdown_mode = MARKDOWN_SYNC
+
+_note_format = settings.note_format.lower()
+if _note_format not in NOTE_FORMATS:
+    logger.warning(f"未知的 NOTE_FORMAT: {settings.note_format}，使用 {NOTE_FORMAT_PRETTY}")
+    _note_format = NOTE_FORMAT_PRETTY
+
+def _create_store(tenant: str):
     if settings.storage_provider == 'local':
-        return LocalStorage(settings.data_dir, tenant)
+        return LocalStorage(settings.data_dir, tenant, dedup_retention_hours=settings.dedup_retention_hours,
+                            markdown_mode=_markdown_mode, note_format=_note_format)
     elif settings.storage_provider == 'aliyun_oss':
         return AliyunOSSStorage(
             settings.aliyun_oss_endpoint, settings.aliyun_oss_ak, settings.aliyun_oss_sk,
-            settings.aliyun_oss_bucket, settings.aliyun_oss_prefix, tenant
+            settings.aliyun_oss_bucket, settings.aliyun_oss_prefix, tenant,
+            session=shared_session(settings.aliyun_oss_pool_size),
+            dedup_retention_hours=settings.dedup_retention_hours,
+            markdown_mode=_markdown_mode,
+            note_format=_note_format,
         )
+    elif settings.storage_provider == 'segment':
+        return SegmentStorage(settings.data_dir, tenant, max_segment_bytes=settings.segment_max_bytes,
+                              fsync=settings.segment_fsync)
+    elif settings.storage_provider == 'sqlite':
+        return SQLiteStorage(settings.data_dir, tenant, db_path=settings.sqlite_path or None)
     else:
         raise HTTPException(status_code=500, detail=f"unknown storage provider: {settings.storage_provider}")
 
+store_pool = StoragePool(_create_store, settings.storage_pool_size)
+configure_io_executor(settings.storage_io_threads)
+configure_markdown_queue(settings.markdown_queue_size)
+configure_note_cache(settings.note_cache_bytes)
+configure_keywords(settings.keyword_pool_min_chars, settings.keyword_timeout, settings.keyword_cache_size)
+configure_embeddings(settings.embedding_mode, settings.embedding_dim)
+configure_near_dup(settings.near_dup_mode, settings.near_dup_distance)
+
+def get_store(tenant: str):
+    """从实例池获取租户的存储后端"""
+    return store_pool.get(tenant)
+
+def _timed_op(op: str):
+    """记录一次存储操作耗时（clipnotes_storage_operation_duration_seconds）"""
+    return STORAGE_OP_LATENCY.time(settings.storage_provider, op)
+
+def _ratio(hits: float, misses: float) -> float:
+    total = hits + misses
+    return hits / total if total else 0.0
+
+def _cache_samples() -> Iterable[Tuple[Tuple[str, ...], float]]:
+    nc = note_cache().stats()
+    yield ("note",), _ratio(nc["hits"], nc["misses"])
+    yield ("keyword",), _ratio(KEYWORD_CACHE.value("hit"), KEYWORD_CACHE.value("miss"))
+    sp = store_pool.stats()
+    yield ("store_pool",), _ratio(sp["hits"], sp["misses"])
+
+def _index_samples() -> Iterable[Tuple[Tuple[str, ...], float]]:
+    for tenant, store in store_pool.items():
+        try:
+            stats = store.index_stats()
+        except Exception as e:
+            logger.warning(f"采集索引大小失败: 租户 {tenant}, 错误: {e}")
+            continue
+        for name, value in stats.items():
+            yield (tenant, name), value
+
+gauge_callback("clipnotes_cache_hit_ratio", "缓存命中率（note: 笔记缓存，keyword: 关键词缓存，store_pool: 存储实例池）",
+               ("cache",), _cache_samples)
+gauge_callback("clipnotes_note_cache_bytes", "笔记缓存占用字节数", (),
+               lambda: [((), note_cache().stats()["bytes"])])
+gauge_callback("clipnotes_note_cache_evictions_total", "笔记缓存淘汰次数", (),
+               lambda: [((), note_cache().stats()["evictions"])], kind="counter")
+gauge_callback("clipnotes_store_pool_size", "存储实例池中的租户数", (),
+               lambda: [((), store_pool.stats()["size"])])
+gauge_callback("clipnotes_markdown_queue_pending", "Markdown 后台队列待处理数", (),
+               lambda: [((), markdown_queue().stats()["pending"])])
+gauge_callback("clipnotes_log_queue_pending", "日志队列中等待写入的条数", (),
+               lambda: [((), log_queue_stats()["pending"])])
+gauge_callback("clipnotes_log_dropped_total", "日志队列满时丢弃的条数", (),
+               lambda: [((), log_queue_stats()["dropped"])], kind="counter")
+gauge_callback("clipnotes_index_size", "实例池中各租户的索引大小（条目数；名称以 _bytes 结尾的为字节数）",
+               ("tenant", "index"), _index_samples)
+
 @router.get("/healthz")
-def healthz():
-    return {"ok": True, "provider": settings.storage_provider}
+async def healthz():
+    return {
+        "ok": True, "provider": settings.storage_provider, "store_pool": store_pool.stats(),
+        "markdown": {"mode": _markdown_mode, **markdown_queue().stats()},
+        "note_cache": note_cache().stats(),
+    }
+
+@router.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    """Prometheus 文本格式的指标（与 /healthz 一样无需认证）"""
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4; charset=utf-8")
 
 @router.post("/notes", response_model=Note)
-def create_note(note: NoteIn, _=Depends(auth), tenant: str = Depends(get_tenant)):
+async def create_note(note: NoteIn, _=Depends(auth), tenant: str = Depends(get_tenant)):
     """创建笔记，带错误处理和日志"""
     try:
         store = get_store(tenant)
         now = datetime.now(timezone.utc)
-        saved = store.save(note, now)
+        with _timed_op("save"):
+            saved = await store.asave(note, now)
         logger.info(f"创建笔记成功: {saved.id}, 租户: {tenant}")
         return saved
+    except NearDuplicateError as e:
+        logger.warning(f"创建笔记被拒绝: 与 {e.note_id} 近似重复（距离 {e.distance}）, 租户: {tenant}")
+        raise HTTPException(status_code=409, detail={"near_duplicate_of": e.note_id, "distance": e.distance})
     except Exception as e:
         logger.error(f"创建笔记失败: {e}", exc_info=True)
         raise HTTPException(status_code=500, detail=f"创建笔记失败: {str(e)}")
 
+@router.post("/notes/batch", response_model=NoteBatchResult)
+async def create_notes_batch(batch: NoteBatchIn, _=Depends(auth), tenant: str = Depends(get_tenant)):
+    """批量创建笔记：批内及存储去重，索引每批只提交一次，返回逐条结果"""
+    try:
+        store = get_store(tenant)
+        now = datetime.now(timezone.utc)
+        with _timed_op("save_many"):
+            result = await store.asave_many(batch.items, now)
+        logger.info(f"批量创建笔记: 租户={tenant}, 新增={result.created}, 重复={result.duplicates}, 失败={result.errors}")
+        return result
+    except Exception as e:
+        logger.error(f"批量创建笔记失败: {e}", exc_info=True)
+        raise HTTPException(status_code=500, detail=f"批量创建笔记失败: {str(e)}")
+
 @router.get("/notes", response_model=NoteList)
-def list_recent(limit: int = Query(5, ge=1, le=50), _=Depends(auth), tenant: str = Depends(get_tenant)):
-    """列出最近笔记，带错误处理"""
+async def list_recent(limit: int = Query(5, ge=1, le=50),
+                cursor: Optional[str] = Query(None, max_length=512, description="上一页返回的 next_cursor"),
+                before: Optional[datetime] = Query(None, description="只返回早于该时间的笔记"),
+                _=Depends(auth), tenant: str = Depends(get_tenant)):
+    """列出最近笔记（按时间倒序，支持游标分页），带错误处理"""
     try:
         store = get_store(tenant)
-        items = store.list_recent(limit)
-        logger.debug(f"列出笔记: 租户={tenant}, limit={limit}, 返回={len(items)}条")
-        return NoteList(items=items)
+        with _timed_op("list_page"):
+            items, next_cursor = await store.alist_page(limit, cursor=cursor, before=before)
+        logger.debug("列出笔记: 租户=%s, limit=%s, 返回=%s条", tenant, limit, len(items))
+        return NoteList(items=items, next_cursor=next_cursor)
+    except ValueError as e:
+        logger.warning(f"列出笔记失败: 无效的分页参数, {e}")
+        raise HTTPException(status_code=400, detail="invalid cursor")
     except Exception as e:
         logger.error(f"列出笔记失败: {e}", exc_info=True)
         raise HTTPException(status_code=500, detail=f"列出笔记失败: {str(e)}")
 
-@router.get("/notes/search", response_model=NoteList)
-def search(q: str = Query(..., min_length=1, max_length=200), limit: int = Query(10, ge=1, le=100), _=Depends(auth), tenant: str = Depends(get_tenant)):
-    """搜索笔记，带错误处理"""
+SEARCH_CONTENT_CHARS = 1000
+SEARCH_MODE_KEYWORD = "keyword"
+SEARCH_MODE_SEMANTIC = "semantic"
+
+def _search_result(hits, q: str, full: bool) -> SearchResult:
+    """搜索命中 -> 响应：正文默认截断，附高亮摘要"""
+    items = []
+    for note, score in hits:
+        truncated = not full and len(note.content) > SEARCH_CONTENT_CHARS
+        data = note.model_dump()
+        if truncated:
+            data['content'] = note.content[:SEARCH_CONTENT_CHARS]
+        items.append(SearchHit(**data, score=score, snippet=make_snippet(note, q), content_truncated=truncated))
+    return SearchResult(items=items)
+
+@router.get("/notes/search", response_model=SearchResult)
+async def search(q: str = Query(..., min_length=1, max_length=200), limit: int = Query(10, ge=1, le=100),
+                 full: bool = Query(False, description="返回完整正文（默认截断到前 1000 字，另附高亮摘要）"),
+                 mode: str = Query(SEARCH_MODE_KEYWORD, pattern=f"^({SEARCH_MODE_KEYWORD}|{SEARCH_MODE_SEMANTIC})$",
+                                   description="keyword：BM25 关键词检索；semantic：向量相似度检索"),
+                 _=Depends(auth), tenant: str = Depends(get_tenant)):
+    """搜索笔记（BM25 相关度排序或向量相似度，附高亮摘要），带错误处理"""
     try:
         store = get_store(tenant)
-        items = store.search(q, limit)
-        logger.debug(f"搜索笔记: 租户={tenant}, 查询='{q}', limit={limit}, 返回={len(items)}条")
-        return NoteList(items=items)
+        if mode == SEARCH_MODE_SEMANTIC:
+            with _timed_op("similar"):
+                hits = await store.asimilar_scored(q, limit)
+        else:
+            with _timed_op("search"):
+                hits = await store.asearch_scored(q, limit)
+        result = _search_result(hits, q, full)
+        logger.debug("搜索笔记: 租户=%s, 查询='%s', 模式=%s, limit=%s, 返回=%s条", tenant, q, mode, limit, len(result.items))
+        return result
+    except NotImplementedError as e:
+        logger.warning(f"搜索笔记失败: {e}")
+        raise HTTPException(status_code=501, detail=str(e))
     except Exception as e:
         logger.error(f"搜索笔记失败: {e}", exc_info=True)
         raise HTTPException(status_code=500, detail=f"搜索笔记失败: {str(e)}")
 
+@router.get("/notes/similar", response_model=SearchResult)
+async def similar(q: Optional[str] = Query(None, min_length=1, max_length=2000, description="查询文本"),
+                  id: Optional[str] = Query(None, max_length=200, description="查找与该笔记相似的笔记（不含自身）"),
+                  limit: int = Query(10, ge=1, le=100),
+                  full: bool = Query(False, description="返回完整正文（默认截断到前 1000 字）"),
+                  _=Depends(auth), tenant: str = Depends(get_tenant)):
+    """向量相似度检索：按文本（q）或已有笔记（id）查找相关笔记，score 为余弦相似度"""
+    if (q is None) == (id is None):
+        raise HTTPException(status_code=400, detail="exactly one of q or id is required")
+    try:
+        store = get_store(tenant)
+        text, snippet_q, exclude = q, q, None
+        if id is not None:
+            source = await store.aget(id)
+            if source is None:
+                logger.warning(f"相似笔记查询失败: 未找到, note_id={id}, 租户={tenant}")
+                raise HTTPException(status_code=404, detail="not found")
+            text, snippet_q, exclude = note_text(source.model_dump()), source.title, source.id
+        with _timed_op("similar"):
+            hits = await store.asimilar_scored(text, limit, exclude=exclude)
+        logger.debug("相似笔记: 租户=%s, id=%s, limit=%s, 返回=%s条", tenant, id, limit, len(hits))
+        return _search_result(hits, snippet_q, full)
+    except HTTPException:
+        raise
+    except NotImplementedError as e:
+        logger.warning(f"相似笔记查询失败: {e}")
+        raise HTTPException(status_code=501, detail=str(e))
+    except Exception as e:
+        logger.error(f"相似笔记查询失败: {e}", exc_info=True)
+        raise HTTPException(status_code=500, detail=f"相似笔记查询失败: {str(e)}")
+
+@router.get("/notes/near-duplicates", response_model=NearDuplicateReport)
+async def near_duplicates(limit: int = Query(100, ge=1, le=1000, description="最多返回的分组数（按组大小降序）"),
+                          _=Depends(auth), tenant: str = Depends(get_tenant)):
+    """把已有笔记按近似重复聚类（SimHash 指纹索引），每组第一篇为最早保存的笔记"""
+    try:
+        store = get_store(tenant)
+        with _timed_op("near_duplicates"):
+            report = await store.anear_duplicates(limit)
+        logger.debug("近似重复聚类: 租户=%s, 笔记=%s, 组=%s", tenant, report.notes, len(report.groups))
+        return report
+    except NotImplementedError as e:
+        logger.warning(f"近似重复聚类失败: {e}")
+        raise HTTPException(status_code=501, detail=str(e))
+    except Exception as e:
+        logger.error(f"近似重复聚类失败: {e}", exc_info=True)
+        raise HTTPException(status_code=500, detail=f"近似重复聚类失败: {str(e)}")
+
+@router.get("/notes/export")
+async def export_notes(format: str = Query(EXPORT_NDJSON, pattern=f"^({EXPORT_NDJSON}|{EXPORT_MARKDOWN})$",
+                                           description="ndjson：每行一篇笔记；markdown：Markdown 文件的 tar 包"),
+                       gzip: bool = Query(False, description="边导出边 gzip 压缩"),
+                       since: Optional[datetime] = Query(None, description="只导出保存时间不早于该时间的笔记（增量备份）"),
+                       _=Depends(auth), tenant: str = Depends(get_tenant)):
+    """流式导出租户全部笔记（按保存时间从旧到新），内存占用与笔记总数无关"""
+    try:
+        store = get_store(tenant)
+    except Exception as e:
+        logger.error(f"导出笔记失败: {e}", exc_info=True)
+        raise HTTPException(status_code=500, detail=f"导出笔记失败: {str(e)}")
+
+    ext = 'ndjson' if format == EXPORT_NDJSON else 'tar'
+    media_type = 'application/x-ndjson' if format == EXPORT_NDJSON else 'application/x-tar'
+    if gzip:
+        ext, media_type = ext + '.gz', 'application/gzip'
+    filename = f"clipnotes-{tenant}-{datetime.now(timezone.utc).strftime('%Y%m%d%H%M%S')}.{ext}"
+
+    async def stream():
+        started = time.perf_counter()
+        total = 0
+        try:
+            async for chunk in iterate_io(export_chunks(store.iter_notes(since), format, gzip)):
+                total += len(chunk)
+                yield chunk
+            logger.info(f"导出笔记完成: 租户={tenant}, 格式={format}, gzip={gzip}, "
+                        f"{total} 字节, 耗时 {time.perf_counter() - started:.2f}s")
+        except Exception as e:
+            logger.error(f"导出笔记中断: 租户={tenant}, 已输出 {total} 字节, 错误: {e}", exc_info=True)
+            raise
+
+    logger.info(f"开始导出笔记: 租户={tenant}, 格式={format}, gzip={gzip}, since={since}")
+    return StreamingResponse(stream(), media_type=media_type,
+                             headers={"Content-Disposition": f'attachment; filename="{filename}"'})
+
+@router.get("/notes/{note_id}.md", response_class=PlainTextResponse)
+async def get_note_markdown(note_id: str, _=Depends(auth), tenant: str = Depends(get_tenant)):
+    """读取笔记 Markdown，尚未生成时按需渲染"""
+    try:
+        store = get_store(tenant)
+        with _timed_op("get_markdown"):
+            md = await store.aget_markdown(note_id)
+        if md is None:
+            logger.warning(f"读取 Markdown 失败: 未找到, note_id={note_id}, 租户={tenant}")
+            raise HTTPException(status_code=404, detail="not found")
+        return PlainTextResponse(md, media_type="text/markdown; charset=utf-8")
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"读取 Markdown 失败: {e}", exc_info=True)
+        raise HTTPException(status_code=500, detail=f"读取 Markdown 失败: {str(e)}")
+
+@router.get("/notes/{note_id}", response_model=Note)
+async def get_note(note_id: str, _=Depends(auth), tenant: str = Depends(get_tenant)):
+    """按 ID 读取笔记，带错误处理"""
+    try:
+        store = get_store(tenant)
+        with _timed_op("get"):
+            note = await store.aget(note_id)
+        if note is None:
+            logger.warning(f"读取笔记失败: 未找到, note_id={note_id}, 租户={tenant}")
+            raise HTTPException(status_code=404, detail="not found")
+        return note
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"读取笔记失败: {e}", exc_info=True)
+        raise HTTPException(status_code=500, detail=f"读取笔记失败: {str(e)}")
+
 @router.delete("/notes/{note_id}")
-def delete_note(note_id: str, _=Depends(auth), tenant: str = Depends(get_tenant)):
+async def delete_note(note_id: str, _=Depends(auth), tenant: str = Depends(get_tenant)):
     """删除笔记，带错误处理"""
     try:
         store = get_store(tenant)
-        ok = store.delete(note_id)
+        with _timed_op("delete"):
+            ok = await store.adelete(note_id)
         if not ok:
             logger.warning(f"删除笔记失败: 未找到, note_id={note_id}, 租户={tenant}")
             raise HTTPException(status_code=404, detail="not found")
@@ -1,11 +1,80 @@
 import os
+import atexit
+import copy
+import json
+import queue
+import threading
 import logging
-from logging.handlers import RotatingFileHandler
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
 from dataclasses import dataclass
 from pathlib import Path
+from typing import Optional
 
-def setup_logging(log_level: str = "INFO", log_file: str = "clipnotes.log"):
-    """配置日志系统"""
+LOG_FORMAT_TEXT = 'text'
+LOG_FORMAT_JSON = 'json'
+
+class JSONFormatter(logging.Formatter):
+    """每条日志输出一行 JSON；通过 extra= 传入的字段（如访问日志的 status、duration_ms）作为独立字段"""
+    _RESERVED = frozenset(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime'}
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": self.formatTime(record, self.datefmt),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for key, value in record.__dict__.items():
+            if key not in self._RESERVED:
+                entry[key] = value
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry["exc_info"] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+class NonBlockingQueueHandler(QueueHandler):
+    """
+    把日志记录放入有界队列，由后台线程写文件和控制台
+
+    调用方只做一次消息格式化（参数可能在之后被修改）和入队；队列满时丢弃并计数，绝不阻塞请求。
+    异常堆栈在入队前格式化到 exc_text，文本与 JSON 格式都能原样输出。
+    """
+
+    def __init__(self, q: queue.Queue):
+        super().__init__(q)
+        self.dropped = 0
+        self._dropped_lock = threading.Lock()
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record = copy.copy(record)
+        record.message = record.getMessage()
+        record.msg, record.args = record.message, None
+        if record.exc_info:
+            record.exc_text = record.exc_text or logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            with self._dropped_lock:
+                self.dropped += 1
+
+_log_listener: Optional[QueueListener] = None
+_log_handler: Optional[NonBlockingQueueHandler] = None
+_log_lock = threading.Lock()
+
+def setup_logging(log_level: str = "INFO", log_file: str = "clipnotes.log",
+                  log_format: str = LOG_FORMAT_TEXT, queue_size: int = 10000):
+    """
+    配置日志系统
+
+    根日志器只挂一个队列处理器，文件（轮转）和控制台处理器由后台线程的 QueueListener 驱动，
+    慢磁盘不会拖慢请求。log_format=json 时每行输出一个 JSON 对象。
+    """
+    global _log_listener, _log_handler
     level = getattr(logging, log_level.upper(), logging.INFO)
     
     # 创建日志目录
@@ -14,10 +83,13 @@ def setup_logging(log_level: str = "INFO", log_file: str = "clipnotes.log"):
     log_path = log_dir / log_file
     
     # 配置日志格式
-    formatter = logging.Formatter(
-        '%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-        datefmt='%Y-%m-%d %H:%M:%S'
-    )
+    if log_format.lower() == LOG_FORMAT_JSON:
+        formatter = JSONFormatter(datefmt='%Y-%m-%dT%H:%M:%S%z')
+    else:
+        formatter = logging.Formatter(
+            '%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+            datefmt='%Y-%m-%d %H:%M:%S'
+        )
     
     # 文件处理器（轮转，最大 10MB，保留 5 个备份）
     file_handler = RotatingFileHandler(
@@ -34,11 +106,17 @@ def setup_logging(log_level: str = "INFO", log_file: str = "clipnotes.log"):
     console_handler.setFormatter(formatter)
     console_handler.setLevel(level)
     
-    # 配置根日志器
+    # 配置根日志器：只挂队列处理器，实际写入在后台线程
     root_logger = logging.getLogger()
     root_logger.setLevel(level)
-    root_logger.addHandler(file_handler)
-    root_logger.addHandler(console_handler)
+    with _log_lock:
+        if _log_listener is not None:
+            _log_listener.stop()
+            root_logger.removeHandler(_log_handler)
+        _log_handler = NonBlockingQueueHandler(queue.Queue(maxsize=max(0, queue_size)))
+        _log_listener = QueueListener(_log_handler.queue, file_handler, console_handler, respect_handler_level=True)
+        _log_listener.start()
+        root_logger.addHandler(_log_handler)
     
     # 避免重复日志
     logging.getLogger("uvicorn").propagate = False
@@ -46,11 +124,34 @@ def setup_logging(log_level: str = "INFO", log_file: str = "clipnotes.log"):
     
     return root_logger
 
+def shutdown_logging():
+    """写完队列中剩余的日志并停止后台线程（进程退出时自动调用）"""
+    global _log_listener
+    with _log_lock:
+        if _log_listener is not None:
+            _log_listener.stop()
+            _log_listener = None
+
+def log_queue_stats() -> dict:
+    """日志队列积压与因队列满丢弃的条数"""
+    handler = _log_handler
+    if handler is None:
+        return {"pending": 0, "dropped": 0}
+    return {"pending": handler.queue.qsize(), "dropped": handler.dropped}
+
+atexit.register(shutdown_logging)
+
 @dataclass
 class Settings:
     host: str = os.getenv("HOST", "0.0.0.0")
     port: int = int(os.getenv("PORT", "8000"))
     log_level: str = os.getenv("LOG_LEVEL", "info")
+    # 日志格式：text | json（每行一个 JSON 对象）；日志队列长度（满时丢弃，不阻塞请求）
+    log_format: str = os.getenv("LOG_FORMAT", LOG_FORMAT_TEXT)
+    log_queue_size: int = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+    # 访问日志采样率（0~1）；4xx/5xx 与耗时不低于 ACCESS_LOG_SLOW_MS 的请求始终记录
+    access_log_sample_rate: float = float(os.getenv("ACCESS_LOG_SAMPLE_RATE", "1"))
+    access_log_slow_ms: float = float(os.getenv("ACCESS_LOG_SLOW_MS", "1000"))
 
     api_tokens: list[str] = tuple(
         t.strip() for t in os.getenv("API_TOKENS", "dev-token-please-change").split(",") if t.strip()
@@ -61,18 +162,68 @@ class Settings:
     storage_provider: str = os.getenv("STORAGE_PROVIDER", "local")
     data_dir: str = os.getenv("DATA_DIR", "./data")
 
+    # 段存储（STORAGE_PROVIDER=segment）：单个段文件的大小上限（字节），以及写入后是否 fsync（组提交）
+    segment_max_bytes: int = int(os.getenv("SEGMENT_MAX_BYTES", str(64 * 1024 * 1024)))
+    segment_fsync: bool = os.getenv("SEGMENT_FSYNC", "true").lower() == "true"
+
+    # SQLite 存储（STORAGE_PROVIDER=sqlite）：为空时每个租户一个库 DATA_DIR/<tenant>/notes.db，否则所有租户共用该文件
+    sqlite_path: str = os.getenv("SQLITE_PATH", "")
+
     aliyun_oss_endpoint: str = os.getenv("ALIYUN_OSS_ENDPOINT", "")
     aliyun_oss_ak: str = os.getenv("ALIYUN_OSS_ACCESS_KEY_ID", "")
     aliyun_oss_sk: str = os.getenv("ALIYUN_OSS_ACCESS_KEY_SECRET", "")
     aliyun_oss_bucket: str = os.getenv("ALIYUN_OSS_BUCKET", "")
     aliyun_oss_prefix: str = os.getenv("ALIYUN_OSS_PREFIX", "clipnotes/")
+    aliyun_oss_pool_size: int = int(os.getenv("ALIYUN_OSS_POOL_SIZE", "32"))
+
+    # 存储实例池：按租户缓存的后端实例数上限
+    storage_pool_size: int = int(os.getenv("STORAGE_POOL_SIZE", "256"))
+    # 存储 I/O 线程池大小（异步路由中的阻塞文件 / OSS 调用在此执行）
+    storage_io_threads: int = int(os.getenv("STORAGE_IO_THREADS", "64"))
+
+    # 去重索引分片保留时长（小时），过期分片自动清理
+    dedup_retention_hours: int = int(os.getenv("DEDUP_RETENTION_HOURS", "48"))
+
+    # Markdown 写入模式：sync（随 JSON 同步写）| background（后台队列）| lazy（首次读取时生成）
+    markdown_mode: str = os.getenv("MARKDOWN_MODE", "background")
+    # 后台 Markdown 写入队列长度，队列满时退回在请求中直接写入
+    markdown_queue_size: int = int(os.getenv("MARKDOWN_QUEUE_SIZE", "1000"))
+
+    # 关键词提取：内容达到该字数时交给进程池，超时（秒）后回退为只提取前部；按内容哈希缓存的条数
+    keyword_pool_min_chars: int = int(os.getenv("KEYWORD_POOL_MIN_CHARS", "20000"))
+    keyword_timeout: float = float(os.getenv("KEYWORD_TIMEOUT", "10"))
+    keyword_cache_size: int = int(os.getenv("KEYWORD_CACHE_SIZE", "2048"))
+
+    # 笔记 JSON 写入格式：pretty（缩进，便于查看）| compact（紧凑，体积更小）；两种格式的文件可以混存
+    note_format: str = os.getenv("NOTE_FORMAT", "pretty")
+
+    # 已解析笔记的进程内缓存容量（字节，按笔记 JSON 大小估算；0 表示不缓存）
+    note_cache_bytes: int = int(os.getenv("NOTE_CACHE_BYTES", str(64 * 1024 * 1024)))
+
+    # 向量检索（local / segment 存储）：hash（字符 n-gram 特征哈希，离线计算，需要 numpy）| none；向量维度
+    embedding_mode: str = os.getenv("EMBEDDING_MODE", "hash")
+    embedding_dim: int = int(os.getenv("EMBEDDING_DIM", "256"))
+
+    # 近似重复检测（local / segment 存储，SimHash 指纹，需要 numpy）：
+    # flag（保存并在 near_duplicate_of 标记）| link（返回已有笔记，不保存）| reject（返回 409）| off；
+    # 判定阈值为 64 位指纹的汉明距离（0~6，越大越宽松）
+    near_dup_mode: str = os.getenv("NEAR_DUP_MODE", "flag")
+    near_dup_distance: int = int(os.getenv("NEAR_DUP_DISTANCE", "6"))
 
     mcp_server_name: str = os.getenv("MCP_SERVER_NAME", "clipnotes-mcp")
     mcp_stateless_http: bool = os.getenv("MCP_STATELESS_HTTP", "true").lower() == "true"
+    # MCP 与 API 挂载在同一进程时，工具直接调用存储层（false 则仍经 NOTES_API_URL 回环 HTTP）
+    mcp_in_process: bool = os.getenv("MCP_IN_PROCESS", "true").lower() == "true"
     
     # MCP Server API 配置
     notes_api_url: str = os.getenv("NOTES_API_URL", "http://localhost:8000")
     notes_api_token: str = os.getenv("NOTES_API_TOKEN", "")
+    # MCP 访问 Notes API 的共享客户端：超时（秒）、连接池上限、keep-alive 连接数、是否启用 HTTP/2（需安装 h2）、幂等请求重试次数
+    notes_api_timeout: float = float(os.getenv("NOTES_API_TIMEOUT", "15"))
+    notes_api_max_connections: int = int(os.getenv("NOTES_API_MAX_CONNECTIONS", "20"))
+    notes_api_max_keepalive: int = int(os.getenv("NOTES_API_MAX_KEEPALIVE", "10"))
+    notes_api_http2: bool = os.getenv("NOTES_API_HTTP2", "false").lower() == "true"
+    notes_api_retries: int = int(os.getenv("NOTES_API_RETRIES", "2"))
     
     # CORS 配置
     cors_origins: list[str] = tuple(
@@ -86,4 +237,4 @@ if not settings.notes_api_token:
     settings.notes_api_token = settings.api_tokens[0] if settings.api_tokens else "dev-token-please-change"
 
 # 初始化日志系统
-setup_logging(settings.log_level)
+setup_logging(settings.log_level, log_format=settings.log_format, queue_size=settings.log_queue_size)
@@ -0,0 +1,118 @@
+from __future__ import annotations
+from typing import Dict, Optional, Sequence
+import re
+import threading
+import logging
+
+try:
+    import numpy as np
+except ImportError:  # numpy 未安装时禁用向量检索
+    np = None
+
+logger = logging.getLogger(__name__)
+
+EMBEDDING_NONE = 'none'
+EMBEDDING_HASH = 'hash'
+EMBEDDING_MODES = (EMBEDDING_NONE, EMBEDDING_HASH)
+
+# 参与向量化的文本上限（字符），长笔记只取前部
+MAX_EMBED_CHARS = 20000
+
+_WS_RE = re.compile(r'\s+')
+
+# 64 位乘法哈希常数（splitmix64 的混合步骤）
+_PRIME = 0x100000001B3
+_MIX1 = 0xBF58476D1CE4E5B9
+_MIX2 = 0x94D049BB133111EB
+
+def normalize_text(text: str) -> str:
+    """小写、空白归一，只取前 MAX_EMBED_CHARS 个字符"""
+    return _WS_RE.sub(' ', text[:MAX_EMBED_CHARS].lower()).strip()
+
+def ngram_hashes(text: str, n: int) -> 'np.ndarray':
+    """文本中每个字符 n-gram 的 64 位哈希（uint64 数组，按出现顺序；不足 n 个字符时为空）"""
+    codes = np.frombuffer(text.encode('utf-32-le'), dtype=np.uint32).astype(np.uint64)
+    count = len(codes) - n + 1
+    if count <= 0:
+        return np.zeros(0, dtype=np.uint64)
+    with np.errstate(over='ignore'):
+        h = np.full(count, n, dtype=np.uint64)
+        for k in range(n):
+            h = h * np.uint64(_PRIME) + codes[k:k + count]
+        h ^= h >> np.uint64(30)
+        h *= np.uint64(_MIX1)
+        h ^= h >> np.uint64(27)
+        h *= np.uint64(_MIX2)
+        h ^= h >> np.uint64(31)
+    return h
+
+class HashEmbedder:
+    """
+    离线向量化：字符 n-gram 的特征哈希（无需模型和网络）
+
+    文本小写、空白归一后取 1~3 字符的 n-gram，每个 n-gram 经 64 位哈希映射到 dim 维中的一维，
+    哈希的最高位决定 +1/-1（抵消碰撞偏差），最后做 L2 归一化，余弦相似度即点积。
+    全程用 numpy 向量运算，不在 Python 层逐个 n-gram 循环。
+    中文按字/二元组、英文按字符三元组对齐，同一段回答的小改动只影响少量维度。
+    """
+    MODEL = 'hash-ngram-v1'
+    NGRAM_WEIGHTS = {1: 0.5, 2: 1.0, 3: 1.0}
+
+    def __init__(self, dim: int = 256):
+        self.dim = int(dim)
+        self.ref = {"model": self.MODEL, "dim": self.dim}
+
+    def embed(self, text: str) -> 'np.ndarray':
+        """文本 -> 归一化的 float32 向量（空文本为全零向量）"""
+        text = normalize_text(text)
+        vec = np.zeros(self.dim, dtype=np.float64)
+        for n, weight in self.NGRAM_WEIGHTS.items():
+            h = ngram_hashes(text, n)
+            if not len(h):
+                continue
+            sign = np.where(h >> np.uint64(63), -weight, weight)
+            vec += np.bincount((h % np.uint64(self.dim)).astype(np.int64), weights=sign, minlength=self.dim)
+        norm = np.linalg.norm(vec)
+        if norm > 0:
+            vec /= norm
+        return vec.astype(np.float32)
+
+    def embed_many(self, texts: Sequence[str]) -> 'np.ndarray':
+        """批量向量化，返回 (len(texts), dim) 的矩阵"""
+        out = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for i, text in enumerate(texts):
+            out[i] = self.embed(text)
+        return out
+
+def note_text(data: Dict) -> str:
+    """参与向量化的笔记文本：标题 + 标签 + 正文"""
+    return data.get('title', '') + '\n' + ' '.join(data.get('tags') or []) + '\n' + data.get('content', '')
+
+_embedder: Optional[HashEmbedder] = None
+_embedder_lock = threading.Lock()
+_embedding_mode = EMBEDDING_HASH
+_embedding_dim = 256
+
+def configure_embeddings(mode: str, dim: int):
+    """设置向量化方式与维度（须在首次使用前调用）；numpy 未安装时自动禁用"""
+    global _embedding_mode, _embedding_dim, _embedder
+    mode = mode.lower()
+    if mode not in EMBEDDING_MODES:
+        logger.warning(f"未知的 EMBEDDING_MODE: {mode}，使用 {EMBEDDING_NONE}")
+        mode = EMBEDDING_NONE
+    if mode != EMBEDDING_NONE and np is None:
+        logger.warning("未安装 numpy，向量检索已禁用（pip install numpy）")
+        mode = EMBEDDING_NONE
+    with _embedder_lock:
+        _embedding_mode, _embedding_dim, _embedder = mode, max(16, dim), None
+
+def embedder() -> Optional[HashEmbedder]:
+    """当前的向量化器；未启用时返回 None"""
+    global _embedder
+    if _embedding_mode == EMBEDDING_NONE or np is None:
+        return None
+    with _embedder_lock:
+        if _embedder is None:
+            _embedder = HashEmbedder(_embedding_dim)
+            logger.info(f"启用向量检索: {HashEmbedder.MODEL}, 维度 {_embedding_dim}")
+        return _embedder
@@ -0,0 +1,115 @@
+from __future__ import annotations
+from typing import Optional
+import asyncio
+import random
+import threading
+import logging
+import httpx
+from ..config import settings
+
+logger = logging.getLogger(__name__)
+
+class NotesAPIClient:
+    """
+    MCP 工具访问 Notes API 的共享 HTTP 客户端
+
+    整个进程复用一个 httpx.AsyncClient：keep-alive 长连接、有上限的连接池，可选 HTTP/2（需安装 h2）。
+    幂等请求（GET）在连接失败、超时和 502/503/504 时按指数退避重试；
+    非幂等请求（POST）只在连接尚未建立时重试，请求已发出后不再重发。
+    """
+    RETRY_STATUS = (502, 503, 504)
+
+    def __init__(self, base_url: str, token: str, timeout: float = 15.0, max_connections: int = 20,
+                 max_keepalive: int = 10, http2: bool = False, retries: int = 2):
+        self.base_url = base_url.rstrip('/')
+        self.token = token
+        self.timeout = timeout
+        self.limits = httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_keepalive)
+        self.http2 = http2
+        self.retries = max(0, retries)
+        self._client: Optional[httpx.AsyncClient] = None
+
+    def _get_client(self) -> httpx.AsyncClient:
+        if self._client is None or self._client.is_closed:
+            http2 = self.http2
+            if http2:
+                try:
+                    import h2  # noqa: F401
+                except ImportError:
+                    logger.warning("未安装 h2，Notes API 客户端退回 HTTP/1.1（pip install 'httpx[http2]'）")
+                    http2 = False
+            self._client = httpx.AsyncClient(
+                base_url=self.base_url,
+                timeout=self.timeout,
+                limits=self.limits,
+                http2=http2,
+                headers={"Authorization": f"Bearer {self.token}"},
+            )
+            logger.info(f"创建 Notes API 客户端: {self.base_url}, http2={http2}, "
+                        f"max_connections={self.limits.max_connections}")
+        return self._client
+
+    async def request(self, method: str, path: str, tenant: str, **kwargs) -> httpx.Response:
+        """发送请求并检查状态码（非 2xx 抛出 httpx.HTTPStatusError）"""
+        idempotent = method.upper() in ("GET", "HEAD")
+        headers = {"X-User-Id": tenant, **kwargs.pop("headers", {})}
+        client = self._get_client()
+        attempt = 0
+        while True:
+            try:
+                r = await client.request(method, path, headers=headers, **kwargs)
+            except httpx.TransportError as e:
+                # 连接未建立时请求一定没有发出，任何方法都可以重试
+                retryable = idempotent or isinstance(e, (httpx.ConnectError, httpx.ConnectTimeout))
+                if not retryable or attempt >= self.retries:
+                    logger.error(f"请求 Notes API 失败: {method} {path}, 错误: {e!r}")
+                    raise
+                reason = repr(e)
+            else:
+                if not (idempotent and r.status_code in self.RETRY_STATUS and attempt < self.retries):
+                    r.raise_for_status()
+                    return r
+                reason = f"HTTP {r.status_code}"
+            delay = 0.2 * (2 ** attempt) * (0.5 + random.random())
+            logger.warning(f"请求 Notes API 失败，{delay:.2f}s 后重试: {method} {path}, 原因: {reason}")
+            attempt += 1
+            await asyncio.sleep(delay)
+
+    async def get(self, path: str, tenant: str, **kwargs) -> httpx.Response:
+        return await self.request("GET", path, tenant, **kwargs)
+
+    async def post(self, path: str, tenant: str, **kwargs) -> httpx.Response:
+        return await self.request("POST", path, tenant, **kwargs)
+
+    async def aclose(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+_api_client: Optional[NotesAPIClient] = None
+_api_client_lock = threading.Lock()
+
+def api_client() -> NotesAPIClient:
+    """进程内共享的 Notes API 客户端（首次使用时按配置创建）"""
+    global _api_client
+    with _api_client_lock:
+        if _api_client is None:
+            _api_client = NotesAPIClient(
+                settings.notes_api_url,
+                settings.notes_api_token,
+                timeout=settings.notes_api_timeout,
+                max_connections=settings.notes_api_max_connections,
+                max_keepalive=settings.notes_api_max_keepalive,
+                http2=settings.notes_api_http2,
+                retries=settings.notes_api_retries,
+            )
+        return _api_client
+
+async def close_api_client():
+    """关闭共享客户端的连接池（应用 lifespan 结束时调用）"""
+    global _api_client
+    with _api_client_lock:
+        client, _api_client = _api_client, None
+    if client is not None:
+        await client.aclose()
+        logger.info("已关闭 Notes API 客户端")
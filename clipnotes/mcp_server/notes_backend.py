@@ -0,0 +1,73 @@
+from __future__ import annotations
+from datetime import datetime, timezone
+from typing import Any, Callable, List, Optional
+import threading
+import logging
+from ..models import Note, NoteIn, NoteList
+from ..utils import sanitize_tenant
+from ..storage.near_dup import NearDuplicateError
+from .api_client import api_client
+
+logger = logging.getLogger(__name__)
+
+class HTTPNotesBackend:
+    """独立部署：MCP 工具经 Notes API（HTTP）读写笔记"""
+
+    async def add_note(self, note: NoteIn, tenant: str) -> Note:
+        r = await api_client().post("/notes", tenant, json=note.model_dump(mode="json"))
+        return Note.model_validate_json(r.content)
+
+    async def recent_notes(self, limit: int, tenant: str) -> List[Note]:
+        r = await api_client().get("/notes", tenant, params={"limit": limit})
+        return NoteList.model_validate_json(r.content).items
+
+class InProcessNotesBackend:
+    """
+    与 API 挂载在同一进程：MCP 工具直接调用存储层
+
+    使用 API 的存储实例池（get_store），租户ID 与 API 一样经过清理，
+    保存走同一个 asave（同样的去重语义），省去回环 HTTP 的序列化、鉴权和网络往返。
+    """
+
+    def __init__(self, get_store: Callable[[str], Any]):
+        self.get_store = get_store
+
+    async def add_note(self, note: NoteIn, tenant: str) -> Note:
+        tenant = sanitize_tenant(tenant)
+        try:
+            saved = await self.get_store(tenant).asave(note, datetime.now(timezone.utc))
+            logger.info(f"MCP 创建笔记成功: {saved.id}, 租户: {tenant}")
+            return saved
+        except NearDuplicateError as e:
+            logger.warning(f"MCP 创建笔记被拒绝: 与 {e.note_id} 近似重复（距离 {e.distance}）, 租户: {tenant}")
+            raise
+        except Exception as e:
+            logger.error(f"MCP 创建笔记失败: {e}", exc_info=True)
+            raise
+
+    async def recent_notes(self, limit: int, tenant: str) -> List[Note]:
+        tenant = sanitize_tenant(tenant)
+        try:
+            items, _ = await self.get_store(tenant).alist_page(limit)
+            return items
+        except Exception as e:
+            logger.error(f"MCP 列出笔记失败: {e}", exc_info=True)
+            raise
+
+_notes_backend: Optional[Any] = None
+_notes_backend_lock = threading.Lock()
+
+def configure_notes_backend(backend):
+    """设置 MCP 工具使用的笔记后端（与 API 同进程时由 app_server 设置为 InProcessNotesBackend）"""
+    global _notes_backend
+    with _notes_backend_lock:
+        _notes_backend = backend
+    logger.info(f"MCP 笔记后端: {type(backend).__name__}")
+
+def notes_backend():
+    """MCP 工具使用的笔记后端；未配置时经 HTTP 访问 NOTES_API_URL"""
+    global _notes_backend
+    with _notes_backend_lock:
+        if _notes_backend is None:
+            _notes_backend = HTTPNotesBackend()
+        return _notes_backend
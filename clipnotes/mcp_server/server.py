@@ -1,14 +1,15 @@
-from __future__ import annotations
-from typing import Optional, Literal, List
+# 不使用 from __future__ import annotations：FastMCP 按注解对象（is Context）识别上下文参数
+from typing import Dict, Optional, Literal, List
 from pydantic import BaseModel
-import httpx
 import os
+import logging
 from mcp.server.fastmcp import FastMCP, Context
 from ..models import NoteIn, ContextMsg, SourceRef
 from ..config import settings
+from .api_client import close_api_client
+from .notes_backend import notes_backend
 
-API_URL = settings.notes_api_url
-API_TOKEN = settings.notes_api_token
+logger = logging.getLogger(__name__)
 
 mcp = FastMCP(name=settings.mcp_server_name, stateless_http=settings.mcp_stateless_http)
 
@@ -24,6 +25,8 @@ class AddNoteArgs(BaseModel):
 class ListArgs(BaseModel):
     limit: int = 5
 
+LIST_LIMIT_MAX = 50  # 与 GET /notes 的上限一致
+
 @mcp.tool(
     name="add_note",
     description=(
@@ -47,16 +50,9 @@ async def add_note(args: AddNoteArgs, ctx: Context) -> str:
         await ctx.warning("缺少 content（应由模型填入上一条助理输出）")
         raise ValueError("missing content")
 
-    headers = {
-        "Authorization": f"Bearer {API_TOKEN}",
-        "X-User-Id": os.getenv("DEFAULT_TENANT", settings.default_tenant),
-        "Content-Type": "application/json",
-    }
-    async with httpx.AsyncClient(timeout=15) as client:
-        r = await client.post(f"{API_URL}/notes", headers=headers, json=payload.model_dump())
-        r.raise_for_status()
-        data = r.json()
-    title = (data.get("title") or "").strip()[:60]
+    tenant = os.getenv("DEFAULT_TENANT", settings.default_tenant)
+    saved = await notes_backend().add_note(payload, tenant)
+    title = (saved.title or "").strip()[:60]
     return f"✅ 已记：{title}" if args.receipt_style == "check" else f"已记：{title}"
 
 @mcp.tool(
@@ -64,48 +60,67 @@ async def add_note(args: AddNoteArgs, ctx: Context) -> str:
     description="列出最近的笔记 - 列出最近 N 条笔记（默认 5 条），仅显示标题与时间。"
 )
 async def list_notes(args: ListArgs) -> str:
-    headers = {
-        "Authorization": f"Bearer {API_TOKEN}",
-        "X-User-Id": os.getenv("DEFAULT_TENANT", settings.default_tenant),
-    }
-    async with httpx.AsyncClient(timeout=15) as client:
-        r = await client.get(f"{API_URL}/notes", headers=headers, params={"limit": args.limit})
-        r.raise_for_status()
-        data = r.json()
+    tenant = os.getenv("DEFAULT_TENANT", settings.default_tenant)
+    limit = max(1, min(args.limit, LIST_LIMIT_MAX))
+    items = await notes_backend().recent_notes(limit, tenant)
     lines = []
-    for it in data.get("items", []):
-        t = (it.get("saved_at","")[:19]).replace("T"," ")
-        lines.append(f"- [{t}] {it.get('title','')}")
+    for it in items:
+        t = it.saved_at.isoformat()[:19].replace("T", " ")
+        lines.append(f"- [{t}] {it.title}")
     return "\n".join(lines) or "(暂无)"
 
 # 创建 Starlette 应用用于 MCP SSE 端点
+from contextlib import asynccontextmanager
 from starlette.applications import Starlette
 from starlette.routing import Route
-from starlette.responses import JSONResponse
 from mcp.server.sse import SseServerTransport
-from anyio.streams.memory import MemoryObjectSendStream, MemoryObjectReceiveStream
-
-async def handle_sse(request):
-    """处理 SSE 连接"""
-    from sse_starlette import EventSourceResponse
-    
-    async def event_generator():
-        # 这里需要实现 MCP SSE 协议
-        # 暂时返回简单响应
-        yield {
-            "event": "message",
-            "data": "MCP endpoint - under construction"
-        }
-    
-    return EventSourceResponse(event_generator())
-
-async def handle_messages(request):
-    """处理 MCP 消息"""
-    return JSONResponse({"error": "MCP endpoint under construction"})
+
+_sse_transports: Dict[str, SseServerTransport] = {}
+
+def _sse_transport(root_path: str) -> SseServerTransport:
+    """
+    按挂载路径取 SSE 传输
+
+    客户端按 endpoint 事件中的地址回发消息，地址须带上挂载前缀（如 /mcp/messages），
+    同一挂载路径下的 /sse 与 /messages 共用一个传输，以便按 session_id 找到会话。
+    """
+    transport = _sse_transports.get(root_path)
+    if transport is None:
+        transport = _sse_transports[root_path] = SseServerTransport(f"{root_path}/messages")
+    return transport
+
+class SSEEndpoint:
+    """GET /sse：建立 SSE 长连接，连接期间运行一个 MCP 会话（ASGI 端点，直接写响应流）"""
+
+    async def __call__(self, scope, receive, send):
+        server = mcp._mcp_server
+        transport = _sse_transport(scope.get("root_path", ""))
+        logger.info("MCP SSE 连接建立")
+        try:
+            async with transport.connect_sse(scope, receive, send) as (read_stream, write_stream):
+                await server.run(read_stream, write_stream, server.create_initialization_options())
+        finally:
+            logger.info("MCP SSE 连接关闭")
+
+class MessagesEndpoint:
+    """POST /messages?session_id=...：把客户端消息投递给对应的 SSE 会话"""
+
+    async def __call__(self, scope, receive, send):
+        await _sse_transport(scope.get("root_path", "")).handle_post_message(scope, receive, send)
+
+handle_sse = SSEEndpoint()
+handle_messages = MessagesEndpoint()
+
+@asynccontextmanager
+async def lifespan(app: Starlette):
+    """单独运行 mcp_app 时，退出前关闭共享的 Notes API 客户端"""
+    yield
+    await close_api_client()
 
 mcp_app = Starlette(
+    lifespan=lifespan,
     routes=[
-        Route("/sse", handle_sse),
+        Route("/sse", handle_sse, methods=["GET"]),
         Route("/messages", handle_messages, methods=["POST"]),
     ]
 )
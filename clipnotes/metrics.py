@@ -0,0 +1,197 @@
+from __future__ import annotations
+from bisect import bisect_left
+from functools import wraps
+from typing import Callable, Dict, Iterable, List, Sequence, Tuple
+import math
+import threading
+import time
+
+# 延迟直方图的默认桶（秒）：覆盖内存缓存命中（亚毫秒）到慢 OSS 往返（数秒）
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+Labels = Tuple[str, ...]
+
+def _escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = '') -> str:
+    parts = [f'{n}="{_escape(str(v))}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return '{' + ','.join(parts) + '}' if parts else ''
+
+def _format_value(v: float) -> str:
+    if math.isinf(v):
+        return '+Inf' if v > 0 else '-Inf'
+    if float(v).is_integer():
+        return str(int(v))
+    return repr(float(v))
+
+class Metric:
+    """指标基类：名称、说明、标签名；render 输出 Prometheus 文本格式"""
+    TYPE = ''
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _samples(self) -> Iterable[str]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.TYPE}"]
+        lines.extend(self._samples())
+        return '\n'.join(lines)
+
+class Counter(Metric):
+    """单调递增计数器"""
+    TYPE = 'counter'
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Labels, float] = {}
+
+    def inc(self, *labels: str, amount: float = 1.0):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0.0) + amount
+
+    def value(self, *labels: str) -> float:
+        with self._lock:
+            return self._values.get(labels, 0.0)
+
+    def _samples(self) -> Iterable[str]:
+        with self._lock:
+            items = sorted(self._values.items())
+        for labels, v in items:
+            yield f"{self.name}{_format_labels(self.labelnames, labels)} {_format_value(v)}"
+
+class Histogram(Metric):
+    """累积桶直方图（observe 只做一次二分查找和两次加法）"""
+    TYPE = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # 标签 -> [各桶计数（非累积，最后一个为 +Inf）, 总和]
+        self._values: Dict[Labels, Tuple[List[int], List[float]]] = {}
+
+    def observe(self, value: float, *labels: str):
+        i = bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(labels)
+            if entry is None:
+                entry = self._values[labels] = ([0] * (len(self.buckets) + 1), [0.0])
+            entry[0][i] += 1
+            entry[1][0] += value
+
+    def time(self, *labels: str) -> 'Timer':
+        """计时上下文：with HIST.time('a', 'b'): ..."""
+        return Timer(self, labels)
+
+    def _samples(self) -> Iterable[str]:
+        with self._lock:
+            items = sorted((labels, (list(counts), total[0])) for labels, (counts, total) in self._values.items())
+        for labels, (counts, total) in items:
+            cumulative = 0
+            for bound, c in zip((*self.buckets, math.inf), counts):
+                cumulative += c
+                le = f'le="{_format_value(bound)}"'
+                yield f"{self.name}_bucket{_format_labels(self.labelnames, labels, le)} {cumulative}"
+            yield f"{self.name}_sum{_format_labels(self.labelnames, labels)} {_format_value(total)}"
+            yield f"{self.name}_count{_format_labels(self.labelnames, labels)} {cumulative}"
+
+class Timer:
+    __slots__ = ('hist', 'labels', 'start')
+
+    def __init__(self, hist: Histogram, labels: Labels):
+        self.hist = hist
+        self.labels = labels
+
+    def __enter__(self) -> 'Timer':
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.hist.observe(time.perf_counter() - self.start, *self.labels)
+
+def timed(hist: Histogram, *labels: str):
+    """装饰器：把函数每次调用的耗时记入 hist"""
+    def decorator(fn):
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                hist.observe(time.perf_counter() - start, *labels)
+        return wrapper
+    return decorator
+
+class GaugeCallback(Metric):
+    """采集时才计算的指标（缓存命中率、索引大小等），callback 返回 [(标签值, 数值)]"""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str],
+                 callback: Callable[[], Iterable[Tuple[Labels, float]]], kind: str = 'gauge'):
+        super().__init__(name, documentation, labelnames)
+        self.callback = callback
+        self.TYPE = kind
+
+    def _samples(self) -> Iterable[str]:
+        for labels, v in self.callback():
+            yield f"{self.name}{_format_labels(self.labelnames, labels)} {_format_value(v)}"
+
+class Registry:
+    def __init__(self):
+        self._metrics: Dict[str, Metric] = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric: Metric) -> Metric:
+        """注册指标；同名指标只保留一个（重复 import 或重复注册回调时返回已有的）"""
+        with self._lock:
+            return self._metrics.setdefault(metric.name, metric)
+
+    def replace(self, metric: Metric) -> Metric:
+        with self._lock:
+            self._metrics[metric.name] = metric
+            return metric
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return '\n'.join(m.render() for m in metrics) + '\n'
+
+REGISTRY = Registry()
+
+def counter(name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+    return REGISTRY.register(Counter(name, documentation, labelnames))
+
+def histogram(name: str, documentation: str, labelnames: Sequence[str] = (),
+              buckets: Sequence[float] = LATENCY_BUCKETS) -> Histogram:
+    return REGISTRY.register(Histogram(name, documentation, labelnames, buckets))
+
+def gauge_callback(name: str, documentation: str, labelnames: Sequence[str],
+                   callback: Callable[[], Iterable[Tuple[Labels, float]]], kind: str = 'gauge') -> GaugeCallback:
+    return REGISTRY.replace(GaugeCallback(name, documentation, labelnames, callback, kind))
+
+def render_metrics() -> str:
+    """全部指标的 Prometheus 文本格式（text/plain; version=0.0.4）"""
+    return REGISTRY.render()
+
+# ---- 各模块共用的指标 ----
+
+HTTP_REQUESTS = counter("clipnotes_http_requests_total", "HTTP 请求数", ("method", "route", "status"))
+HTTP_LATENCY = histogram("clipnotes_http_request_duration_seconds", "HTTP 请求耗时", ("method", "route"))
+
+STORAGE_OP_LATENCY = histogram("clipnotes_storage_operation_duration_seconds",
+                               "存储操作耗时（API 调用的一次存储方法）", ("backend", "op"))
+STORAGE_STEP_LATENCY = histogram("clipnotes_storage_step_duration_seconds",
+                                 "存储内部步骤耗时（去重查询、写 JSON/Markdown、更新索引、读取笔记）", ("backend", "step"))
+
+OSS_REQUESTS = counter("clipnotes_oss_requests_total", "OSS 请求数", ("op",))
+OSS_BYTES = counter("clipnotes_oss_bytes_total", "OSS 传输字节数", ("direction",))
+
+KEYWORD_LATENCY = histogram("clipnotes_keyword_extraction_seconds", "关键词提取耗时", ("path",))
+KEYWORD_CACHE = counter("clipnotes_keyword_cache_total", "关键词缓存查询次数", ("result",))
@@ -63,6 +63,44 @@ class Note(BaseModel):
     embedding: Optional[Any] = None
     context_before: Optional[List[ContextMsg]] = None
     tenant: Optional[str] = None
+    near_duplicate_of: Optional[str] = None
 
 class NoteList(BaseModel):
     items: List[Note]
+    next_cursor: Optional[str] = None
+
+class SearchHit(Note):
+    score: float = 0.0
+    snippet: Optional[str] = None
+    content_truncated: bool = False
+
+class SearchResult(BaseModel):
+    items: List[SearchHit]
+
+class NoteBatchIn(BaseModel):
+    items: List[NoteIn] = Field(..., min_length=1, max_length=500, description="待保存的笔记（最多500条）")
+
+class BatchItemResult(BaseModel):
+    index: int
+    status: Literal["created", "duplicate", "error"]
+    note: Optional[Note] = None
+    error: Optional[str] = None
+
+class NoteBatchResult(BaseModel):
+    items: List[BatchItemResult]
+    created: int = 0
+    duplicates: int = 0
+    errors: int = 0
+
+class NearDuplicateMember(BaseModel):
+    id: str
+    distance: int = 0
+
+class NearDuplicateGroup(BaseModel):
+    items: List[NearDuplicateMember]
+
+class NearDuplicateReport(BaseModel):
+    groups: List[NearDuplicateGroup]
+    notes: int = 0
+    duplicates: int = 0
+    total_groups: int = 0
@@ -1,2 +1,5 @@
 from .local_fs import LocalStorage
 from .aliyun_oss import AliyunOSSStorage
+from .segment_store import SegmentStorage
+from .sqlite_store import SQLiteStorage
+from .pool import StoragePool
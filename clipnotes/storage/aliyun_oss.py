@@ -1,20 +1,426 @@
 from __future__ import annotations
-from typing import List, Optional
-from datetime import datetime
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Set, Tuple
+from datetime import datetime, timezone
+from functools import partial
+import asyncio
 import json
+import threading
+import time
 import logging
 import oss2
-from ..models import Note, NoteIn
-from ..utils import short_title, dedup_key, extract_keywords, generate_ai_title, sanitize_filename, sanitize_tenant
+from ..models import Note, NoteIn, BatchItemResult, NoteBatchResult
+from ..metrics import OSS_BYTES, OSS_REQUESTS, STORAGE_STEP_LATENCY, timed
+from .dedup_index import DedupIndex, WriteConflict, WRITE_RETRIES, conflict_backoff
+from ..utils import (sanitize_filename, sanitize_tenant, index_terms, query_terms, time_key, encode_cursor,
+                     decode_cursor)
+from .base import AsyncStorageMixin, build_note, plan_batch, batch_summary, run_io
+from .markdown import MARKDOWN_SYNC, MARKDOWN_LAZY, render_markdown, markdown_queue
+from .note_cache import note_cache
+from .note_codec import NOTE_FORMAT_PRETTY, dump_note, load_note
+from .ranking import BM25Ranker, MAX_CANDIDATES
 
 logger = logging.getLogger(__name__)
 
-class AliyunOSSStorage:
-    def __init__(self, endpoint: str, ak: str, sk: str, bucket_name: str, prefix: str, tenant: str):
+_shared_session: Optional[oss2.Session] = None
+_shared_session_lock = threading.Lock()
+
+def shared_session(pool_size: Optional[int] = None) -> oss2.Session:
+    """进程内共享的 OSS HTTP 会话（复用连接池）"""
+    global _shared_session
+    with _shared_session_lock:
+        if _shared_session is None:
+            _shared_session = oss2.Session(pool_size=pool_size)
+            logger.info(f"创建共享 OSS 会话: pool_size={pool_size}")
+        return _shared_session
+
+class MeteredBucket(oss2.Bucket):
+    """记录请求次数与传输字节数的 Bucket（/metrics 的 clipnotes_oss_* 指标）"""
+
+    def put_object(self, key, data, *args, **kwargs):
+        OSS_REQUESTS.inc('put_object')
+        if isinstance(data, (bytes, bytearray)):
+            OSS_BYTES.inc('out', amount=len(data))
+        elif isinstance(data, str):
+            OSS_BYTES.inc('out', amount=len(data.encode('utf-8')))
+        return super().put_object(key, data, *args, **kwargs)
+
+    def get_object(self, key, *args, **kwargs):
+        OSS_REQUESTS.inc('get_object')
+        result = super().get_object(key, *args, **kwargs)
+        OSS_BYTES.inc('in', amount=result.content_length or 0)
+        return result
+
+    def object_exists(self, key, *args, **kwargs):
+        OSS_REQUESTS.inc('object_exists')
+        return super().object_exists(key, *args, **kwargs)
+
+    def delete_object(self, key, *args, **kwargs):
+        OSS_REQUESTS.inc('delete_object')
+        return super().delete_object(key, *args, **kwargs)
+
+    def batch_delete_objects(self, key_list, *args, **kwargs):
+        OSS_REQUESTS.inc('batch_delete_objects')
+        return super().batch_delete_objects(key_list, *args, **kwargs)
+
+    def list_objects(self, *args, **kwargs):
+        OSS_REQUESTS.inc('list_objects')
+        return super().list_objects(*args, **kwargs)
+
+def quote_etag(etag: str) -> str:
+    """条件请求头中的 ETag 需带双引号（oss2 返回的 etag 已去掉引号）"""
+    return etag if etag.startswith('"') else f'"{etag}"'
+
+def load_versioned(bucket: oss2.Bucket, key: str, what: str) -> Tuple[dict, Optional[str]]:
+    """读取 JSON 索引对象及其 ETag；对象不存在时返回 ({}, None)，内容损坏时返回空内容和原 ETag"""
+    try:
+        result = bucket.get_object(key)
+    except oss2.exceptions.NoSuchKey:
+        return {}, None
+    try:
+        return json.loads(result.read().decode('utf-8')), result.etag
+    except json.JSONDecodeError as e:
+        logger.warning(f"{what}损坏，重置: {key}, 错误: {e}")
+        return {}, result.etag
+
+def put_conditional(bucket: oss2.Bucket, key: str, data: bytes, etag: Optional[str]):
+    """
+    条件写入索引对象：etag 为读取时的版本（If-Match），None 表示读取时对象不存在（禁止覆盖）
+
+    其间对象已被其他进程改写时抛出 WriteConflict，调用方重新读取合并后重试。
+    """
+    headers = {'If-Match': quote_etag(etag)} if etag is not None else {'x-oss-forbid-overwrite': 'true'}
+    try:
+        bucket.put_object(key, data, headers=headers)
+    except oss2.exceptions.ServerError as e:
+        # If-Match 不满足返回 412 PreconditionFailed；禁止覆盖时对象已存在返回 409 FileAlreadyExists
+        if e.status == 412 or e.code == 'FileAlreadyExists':
+            raise WriteConflict(key) from e
+        raise
+
+class OSSDedupIndex(DedupIndex):
+    """OSS 去重索引：<prefix><tenant>/index/dedup/<YYYYmmddHH>.json"""
+
+    def __init__(self, bucket: oss2.Bucket, key_prefix: str, retention_hours: int = 48):
+        super().__init__(retention_hours)
+        self.bucket = bucket
+        self.key_prefix = key_prefix
+
+    def _key(self, bucket: str) -> str:
+        return f"{self.key_prefix}{bucket}.json"
+
+    def _load_bucket(self, bucket: str) -> Dict[str, str]:
+        return self._load_versioned(bucket)[0]
+
+    def _load_versioned(self, bucket: str) -> Tuple[Dict[str, str], Optional[str]]:
+        """读取分片及其 ETag；分片不存在时版本为 None"""
+        return load_versioned(self.bucket, self._key(bucket), "去重分片")
+
+    def _store_bucket(self, bucket: str, entries: Dict[str, str], version: Optional[str] = None):
+        data = json.dumps(entries, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+        put_conditional(self.bucket, self._key(bucket), data, version)
+
+    def _drop_bucket(self, bucket: str):
+        self.bucket.delete_object(self._key(bucket))
+
+    def _list_buckets(self) -> List[str]:
+        return [obj.key[len(self.key_prefix):].rsplit('.', 1)[0]
+                for obj in oss2.ObjectIterator(self.bucket, prefix=self.key_prefix)]
+
+_fetch_executor: Optional[ThreadPoolExecutor] = None
+_fetch_executor_lock = threading.Lock()
+
+def fetch_executor() -> ThreadPoolExecutor:
+    """并发读取 OSS 对象的线程池（列表页、搜索命中的笔记）；与存储 I/O 线程池分开，避免嵌套提交时互相等待"""
+    global _fetch_executor
+    with _fetch_executor_lock:
+        if _fetch_executor is None:
+            _fetch_executor = ThreadPoolExecutor(max_workers=16, thread_name_prefix='clipnotes-oss-fetch')
+        return _fetch_executor
+
+def prefetch(fn: Callable, items: Iterable, window: int = 4) -> Iterator:
+    """
+    按顺序产出 fn(item)，同时最多有 window 个任务在 fetch_executor 中提前执行
+
+    消费方停止迭代后不再提交新任务，已排队的任务会被取消。
+    fn 本身不能再向 fetch_executor 提交并等待任务。
+    """
+    ex = fetch_executor()
+    pending = deque()
+    it = iter(items)
+    try:
+        for item in it:
+            pending.append(ex.submit(fn, item))
+            if len(pending) >= window:
+                break
+        while pending:
+            result = pending.popleft().result()
+            for item in it:
+                pending.append(ex.submit(fn, item))
+                break
+            yield result
+    finally:
+        for f in pending:
+            f.cancel()
+
+def list_names(bucket: oss2.Bucket, prefix: str) -> List[str]:
+    """
+    列出 prefix 下一层的名称（目录去掉末尾 '/'，对象去掉扩展名）
+
+    使用 delimiter='/' 并按 marker 翻页，不受单次列举 1000 个 key 的限制。
+    """
+    names: List[str] = []
+    marker = ''
+    while True:
+        result = bucket.list_objects(prefix=prefix, delimiter='/', marker=marker, max_keys=1000)
+        names.extend(p[len(prefix):].rstrip('/') for p in result.prefix_list)
+        names.extend(obj.key[len(prefix):].split('.', 1)[0] for obj in result.object_list)
+        if not result.is_truncated:
+            return names
+        marker = result.next_marker
+
+def list_keys(bucket: oss2.Bucket, prefix: str) -> List[str]:
+    """按 marker 翻页列出 prefix 下的全部对象 key"""
+    keys: List[str] = []
+    marker = ''
+    while True:
+        result = bucket.list_objects(prefix=prefix, marker=marker, max_keys=1000)
+        keys.extend(obj.key for obj in result.object_list)
+        if not result.is_truncated:
+            return keys
+        marker = result.next_marker
+
+def _date_names(bucket: oss2.Bucket, prefix: str, width: int, lo: Optional[str], hi: Optional[str],
+                newest_first: bool) -> List[str]:
+    names = [n for n in list_names(bucket, prefix) if len(n) == width and n.isdigit()]
+    return sorted((n for n in names if (lo is None or n >= lo) and (hi is None or n <= hi)), reverse=newest_first)
+
+def iter_days(bucket: oss2.Bucket, prefix: str, end_day: Optional[str] = None,
+              start_day: Optional[str] = None, newest_first: bool = True) -> Iterator[str]:
+    """
+    按 YYYY/MM/DD 层级遍历 prefix 下的日期（默认从新到旧）
+
+    逐层列举年、月、日，只在需要时才列举下一个年份和月份；
+    早于 start_day 或晚于 end_day 的日期直接跳过。消费方凑够数据后停止迭代即可。
+    """
+    sy, sm, sd = start_day.split('/') if start_day else (None, None, None)
+    ey, em, ed = end_day.split('/') if end_day else (None, None, None)
+    for y in _date_names(bucket, prefix, 4, sy, ey, newest_first):
+        for m in _date_names(bucket, f"{prefix}{y}/", 2, sm if y == sy else None, em if y == ey else None,
+                             newest_first):
+            for d in _date_names(bucket, f"{prefix}{y}/{m}/", 2, sd if (y, m) == (sy, sm) else None,
+                                 ed if (y, m) == (ey, em) else None, newest_first):
+                yield f"{y}/{m}/{d}"
+
+class OSSDayManifest:
+    """
+    OSS 按天的笔记清单：<prefix><tenant>/index/manifest/YYYY/MM/DD.json
+
+    每条记录含 id、标题、标签、保存时间和可搜索的文本摘要（标题 + 正文 + 上下文，小写）。
+    列表和搜索只需读取少量清单对象，再读取真正需要返回的笔记。
+    摘要超过 DIGEST_CHARS 时截断，并附带全文词项，搜索打分时补充到正文中。
+    """
+    DIGEST_CHARS = 2000
+    READY_MARK = 'manifest.ready'
+    # 旧笔记的位置索引对象（loc/）已补写完毕的标记
+    LOCATIONS_READY_MARK = 'locations.ready'
+
+    def __init__(self, bucket: oss2.Bucket, index_prefix: str):
+        self.bucket = bucket
+        self.index_prefix = index_prefix
+        self.key_prefix = f"{index_prefix}manifest/"
+        self._locks: Dict[str, threading.Lock] = {}
+        self._locks_lock = threading.Lock()
+
+    def key(self, day: str) -> str:
+        return f"{self.key_prefix}{day}.json"
+
+    def day_of(self, key: str) -> str:
+        return key[len(self.key_prefix):-len('.json')]
+
+    def _lock(self, day: str) -> threading.Lock:
+        with self._locks_lock:
+            return self._locks.setdefault(day, threading.Lock())
+
+    @classmethod
+    def entry(cls, note: Note) -> dict:
+        hay = AliyunOSSStorage._haystack(note.model_dump()).lower()
+        e = {"id": note.id, "title": note.title, "tags": note.tags, "t": time_key(note.saved_at),
+             "digest": hay[:cls.DIGEST_CHARS]}
+        if len(hay) > cls.DIGEST_CHARS:
+            e["terms"] = sorted(index_terms(hay))
+        return e
+
+    @staticmethod
+    def fields(entry: dict) -> Dict[str, str]:
+        """清单记录的搜索字段（与 ranking.note_fields 对应）；摘要被截断时用全文词项补充正文"""
+        body = entry.get('digest', '')
+        if 'terms' in entry:
+            body += ' ' + ' '.join(entry['terms'])
+        return {'title': entry.get('title', '').lower(), 'tags': ' '.join(entry.get('tags') or []).lower(),
+                'body': body}
+
+    @classmethod
+    def terms(cls, entry: dict) -> Set[str]:
+        """清单记录的全部词项（写入按月词项摘要）"""
+        return index_terms(' '.join(cls.fields(entry).values()))
+
+    def load(self, day: str) -> Dict[str, dict]:
+        return load_versioned(self.bucket, self.key(day), "笔记清单")[0]
+
+    def update(self, day: str, add: Iterable[dict] = (), remove: Iterable[str] = ()):
+        """
+        读-改-写一天的清单
+
+        进程内按天串行；跨进程（多个 worker / 实例）用 ETag 条件写入，
+        清单在读取后被改写时重新读取合并，最多重试 WRITE_RETRIES 次。
+        """
+        add, remove = list(add), list(remove)
+        key = self.key(day)
+        with self._lock(day):
+            for attempt in range(WRITE_RETRIES):
+                entries, etag = load_versioned(self.bucket, key, "笔记清单")
+                for note_id in remove:
+                    entries.pop(note_id, None)
+                for e in add:
+                    entries[e['id']] = e
+                data = json.dumps(entries, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+                try:
+                    put_conditional(self.bucket, key, data, etag)
+                    return
+                except WriteConflict:
+                    if attempt == WRITE_RETRIES - 1:
+                        logger.error(f"笔记清单写冲突，重试 {WRITE_RETRIES} 次后放弃: {key}")
+                        raise
+                    logger.info(f"笔记清单写冲突，重新读取后重试: {key}, 第 {attempt + 1} 次")
+                    time.sleep(conflict_backoff(attempt))
+
+    def iter_days(self, end_day: Optional[str] = None) -> Iterator[str]:
+        """有清单的日期，新的在前（不晚于 end_day）"""
+        return iter_days(self.bucket, self.key_prefix, end_day)
+
+    def iter_loaded(self, end_day: Optional[str] = None, window: int = 4) -> Iterator[Tuple[str, Dict[str, dict]]]:
+        """从新到旧产出 (日期, 清单)，并发预取后面 window 天的清单"""
+        return prefetch(lambda day: (day, self.load(day)), self.iter_days(end_day), window)
+
+    def is_ready(self, mark: str = READY_MARK) -> bool:
+        return self.bucket.object_exists(f"{self.index_prefix}{mark}")
+
+    def mark_ready(self, mark: str = READY_MARK):
+        self.bucket.put_object(f"{self.index_prefix}{mark}", b'1')
+
+class OSSTermDigest:
+    """
+    OSS 按月的词项摘要：<prefix><tenant>/index/terms/YYYY/MM.json，{词项: 日期位图}
+
+    位图第 d 位表示当月 d 日至少有一篇笔记含该词项（词项与倒排索引一致，见 index_terms）。
+    搜索先读按月摘要求出可能命中的日期，只读取这些天的清单，罕见词不再逐天读取全部历史。
+    删除笔记时不回收位（摘要是命中日期的超集，多读的清单由打分时过滤）。
+    """
+    READY_MARK = 'terms.ready'
+
+    def __init__(self, bucket: oss2.Bucket, index_prefix: str):
+        self.bucket = bucket
+        self.key_prefix = f"{index_prefix}terms/"
+        self._locks: Dict[str, threading.Lock] = {}
+        self._locks_lock = threading.Lock()
+
+    def key(self, month: str) -> str:
+        return f"{self.key_prefix}{month}.json"
+
+    def _lock(self, month: str) -> threading.Lock:
+        with self._locks_lock:
+            return self._locks.setdefault(month, threading.Lock())
+
+    def load(self, month: str) -> Dict[str, int]:
+        return load_versioned(self.bucket, self.key(month), "词项摘要")[0]
+
+    def update(self, month: str, add: Dict[str, int]):
+        """把 {词项: 日期位图} 按位或合并进当月摘要（与清单一样用 ETag 条件写入，冲突时重新读取合并）"""
+        if not add:
+            return
+        key = self.key(month)
+        with self._lock(month):
+            for attempt in range(WRITE_RETRIES):
+                digest, etag = load_versioned(self.bucket, key, "词项摘要")
+                changed = False
+                for term, bits in add.items():
+                    merged = digest.get(term, 0) | bits
+                    if merged != digest.get(term):
+                        digest[term] = merged
+                        changed = True
+                if not changed:
+                    return
+                data = json.dumps(digest, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+                try:
+                    put_conditional(self.bucket, key, data, etag)
+                    return
+                except WriteConflict:
+                    if attempt == WRITE_RETRIES - 1:
+                        logger.error(f"词项摘要写冲突，重试 {WRITE_RETRIES} 次后放弃: {key}")
+                        raise
+                    logger.info(f"词项摘要写冲突，重新读取后重试: {key}, 第 {attempt + 1} 次")
+                    time.sleep(conflict_backoff(attempt))
+
+    def iter_months(self) -> Iterator[str]:
+        """有摘要的月份，新的在前"""
+        for y in _date_names(self.bucket, self.key_prefix, 4, None, None, True):
+            for m in _date_names(self.bucket, f"{self.key_prefix}{y}/", 2, None, None, True):
+                yield f"{y}/{m}"
+
+    @staticmethod
+    def group(days_terms: Iterable[Tuple[str, Iterable[str]]]) -> Dict[str, Dict[str, int]]:
+        """(日期 YYYY/MM/DD, 词项) 序列 -> {月份: {词项: 日期位图}}"""
+        out: Dict[str, Dict[str, int]] = {}
+        for day, terms in days_terms:
+            month, bit = day[:7], 1 << int(day[8:10])
+            digest = out.setdefault(month, {})
+            for t in terms:
+                digest[t] = digest.get(t, 0) | bit
+        return out
+
+    @staticmethod
+    def candidate_days(month: str, digest: Dict[str, int], cjk: Iterable[str], words: Iterable[str]) -> List[str]:
+        """当月可能同时含全部查询词项的日期（新的在前）；英文片段与倒排索引一样在词表中做子串匹配"""
+        mask = (1 << 32) - 2
+        for t in cjk:
+            mask &= digest.get(t, 0)
+        for w in words:
+            if not mask:
+                break
+            bits = 0
+            for term, b in digest.items():
+                if w in term:
+                    bits |= b
+            mask &= bits
+        return [f"{month}/{d:02d}" for d in range(31, 0, -1) if mask >> d & 1]
+
+    def is_ready(self) -> bool:
+        return self.bucket.object_exists(f"{self.key_prefix}{self.READY_MARK}")
+
+    def mark_ready(self):
+        self.bucket.put_object(f"{self.key_prefix}{self.READY_MARK}", b'1')
+
+class AliyunOSSStorage(AsyncStorageMixin):
+    def __init__(self, endpoint: str, ak: str, sk: str, bucket_name: str, prefix: str, tenant: str,
+                 session: Optional[oss2.Session] = None, dedup_retention_hours: int = 48,
+                 markdown_mode: str = MARKDOWN_SYNC, note_format: str = NOTE_FORMAT_PRETTY,
+                 bucket: Optional[oss2.Bucket] = None):
+        """bucket: 直接使用已构造的 Bucket（或接口兼容的对象，如基准测试的内存桶），此时忽略连接参数"""
         try:
-            self.bucket = oss2.Bucket(oss2.Auth(ak, sk), endpoint, bucket_name)
+            self.bucket = bucket if bucket is not None else MeteredBucket(oss2.Auth(ak, sk), endpoint, bucket_name,
+                                                                         session=session)
             self.prefix = prefix.rstrip('/') + '/'
             self.tenant = sanitize_tenant(tenant)
+            self.markdown_mode = markdown_mode
+            self.note_format = note_format
+            self.dedup = OSSDedupIndex(self.bucket, f"{self.prefix}{self.tenant}/index/dedup/", dedup_retention_hours)
+            self.manifest = OSSDayManifest(self.bucket, f"{self.prefix}{self.tenant}/index/")
+            self.terms = OSSTermDigest(self.bucket, f"{self.prefix}{self.tenant}/index/")
+            self._manifest_ready = False
+            self._terms_ready = False
+            self._cache_scope = f"oss:{bucket_name}/{self.prefix}{self.tenant}"
             logger.info(f"初始化阿里云 OSS 存储: bucket={bucket_name}, tenant={self.tenant}")
         except Exception as e:
             logger.error(f"初始化 OSS 存储失败: {e}", exc_info=True)
@@ -24,139 +430,549 @@ class AliyunOSSStorage:
         sub = ts.strftime('%Y/%m/%d')
         return f"{self.prefix}{self.tenant}/{sub}/{note_id}.{ext}"
 
-    def save(self, note_in: NoteIn, now: datetime, suggested_id: Optional[str] = None) -> Note:
+    def _loc_key(self, note_id: str) -> str:
+        """位置索引对象：每篇笔记一个小对象，记录日期路径与格式"""
+        return f"{self.prefix}{self.tenant}/index/loc/{note_id}.json"
+
+    def _locate(self, note_id: str) -> List[str]:
+        """
+        定位笔记的全部对象 key：读取位置索引对象（单次 GET）
+
+        旧数据的位置索引在一次性生成清单时补写（见 _ensure_manifest），
+        之后没有位置索引即视为笔记不存在，不再列举扫描历史（任意 ID 都不会触发 LIST）。
+        """
         try:
-            # 尝试使用 AI 生成标题，如果未启用则使用默认策略
-            ai_title = generate_ai_title(note_in.content)
-            title = ai_title if ai_title else short_title(note_in.content)
-            tags = list(note_in.tags or []) or extract_keywords(note_in.content, topk=5)
-            dd = dedup_key(note_in.content, now)
-            note_id = sanitize_filename(suggested_id or dd.replace('@','-'))
+            loc = json.loads(self.bucket.get_object(self._loc_key(note_id)).read().decode('utf-8'))
+            return [f"{self.prefix}{self.tenant}/{loc['path']}/{note_id}.{ext}" for ext in loc.get('formats', ['json'])]
+        except oss2.exceptions.NoSuchKey:
+            pass
+        except (json.JSONDecodeError, KeyError) as e:
+            logger.warning(f"位置索引损坏，视为不存在: {note_id}, 错误: {e}")
+            return []
+        if not self._manifest_ready:
+            # 补写完成前的旧笔记可能还没有位置索引：先完成一次性补写再查一次
+            self._ensure_manifest()
+            return self._locate(note_id)
+        logger.debug("位置索引不存在，笔记未找到: %s", note_id)
+        return []
 
-            note = Note(id=note_id, title=title, content=note_in.content, tags=tags, topic=note_in.topic,
-                        saved_at=now, source=note_in.source, dedup_key=dd, summary=None, embedding=None,
-                        context_before=note_in.context_before, tenant=self.tenant)
+    def _backfill_locations(self, day: str, keys: List[str]) -> int:
+        """补写一天内旧笔记的位置索引对象（已存在的不覆盖，以免改写并发保存的新记录）"""
+        formats: Dict[str, List[str]] = {}
+        for k in keys:
+            note_id, ext = k.rsplit('/', 1)[-1].split('.', 1)
+            formats.setdefault(note_id, []).append(ext)
 
-            # 幂等索引
-            idx_key = f"{self.prefix}{self.tenant}/index/dedup_index.json"
+        def put(item: Tuple[str, List[str]]):
+            note_id, exts = item
+            loc = {"path": day, "formats": sorted(exts)}
             try:
-                existing = json.loads(self.bucket.get_object(idx_key).read().decode('utf-8'))
-            except oss2.exceptions.NoSuchKey:
-                existing = {}
-                logger.debug(f"索引文件不存在，创建新索引: {idx_key}")
-            except json.JSONDecodeError as e:
-                logger.warning(f"索引文件损坏，重置索引: {idx_key}, 错误: {e}")
-                existing = {}
-            except Exception as e:
-                logger.error(f"读取索引文件失败: {idx_key}, 错误: {e}", exc_info=True)
-                raise
-            
-            if note.dedup_key in existing:
-                logger.info(f"检测到重复内容，返回已存在的笔记: {existing[note.dedup_key]}")
-                return note.model_copy(update={"id": existing[note.dedup_key]})
-
-            # 写 JSON
-            try:
-                self.bucket.put_object(self._key(note.id, now, "json"), note.model_dump_json(ensure_ascii=False, indent=2).encode('utf-8'))
-                logger.debug(f"保存 JSON 文件到 OSS: {self._key(note.id, now, 'json')}")
-            except Exception as e:
-                logger.error(f"保存 JSON 文件到 OSS 失败: {e}", exc_info=True)
-                raise
-
-            # 写 Markdown
-            ctx_md = ''
-            if note.context_before:
-                ctx_lines = [f"- **{m['role'] if isinstance(m, dict) else m.role}**：{(m['text'] if isinstance(m, dict) else m.text)}" for m in note.context_before]
-                ctx_md = "\n\n### 上下文（前 3 轮）\n" + "\n".join(ctx_lines)
-            md = f"# {note.title}\n- 时间：{now.isoformat()}\n- 标签：{', '.join(note.tags) if note.tags else '-'}\n- 主题：{note.topic or '-'}\n- 来源：{(note.source and (note.source.thread_title or '')) or '-'}\n\n## 原文\n{note.content}{ctx_md}\n"
+                put_conditional(self.bucket, self._loc_key(note_id), json.dumps(loc).encode('utf-8'), None)
+            except WriteConflict:
+                pass
+
+        list(fetch_executor().map(put, formats.items()))
+        return len(formats)
+
+    def _put_location(self, note_id: str, date_path: str, formats: List[str]):
+        loc = {"path": date_path, "formats": formats}
+        self.bucket.put_object(self._loc_key(note_id), json.dumps(loc).encode('utf-8'))
+
+    @staticmethod
+    def _haystack(data: dict) -> str:
+        """搜索文本：标题 + 正文 + 上下文"""
+        hay = data.get('title', '') + ' ' + data.get('content', '')
+        for m in (data.get('context_before') or []):
+            hay += ' ' + (m.get('text', '') if isinstance(m, dict) else '')
+        return hay
+
+    def _ensure_manifest(self):
+        """
+        旧数据没有清单时，遍历已有笔记一次性生成（之后由 save/delete 增量维护）
+
+        同一遍列举顺带补写旧笔记的位置索引对象；清单已由旧版本生成、只缺位置索引时只列举不读取笔记。
+        """
+        if self._manifest_ready:
+            return
+        manifest_ready = self.manifest.is_ready()
+        locations_ready = self.manifest.is_ready(OSSDayManifest.LOCATIONS_READY_MARK)
+        if manifest_ready and locations_ready:
+            self._manifest_ready = True
+            return
+        prefix = f"{self.prefix}{self.tenant}/"
+        days = notes = located = 0
+        for day, keys in prefetch(lambda d: (d, list_keys(self.bucket, f"{prefix}{d}/")), iter_days(self.bucket, prefix)):
+            if not locations_ready:
+                located += self._backfill_locations(day, keys)
+            if manifest_ready:
+                continue
+            entries = [OSSDayManifest.entry(n) for n in self._fetch_notes([k for k in keys if k.endswith('.json')]) if n]
+            if entries:
+                self.manifest.update(day, add=entries)
+                days, notes = days + 1, notes + len(entries)
+        if not manifest_ready:
+            self.manifest.mark_ready()
+            logger.info(f"生成 OSS 笔记清单: tenant={self.tenant}, 天数 {days}, 笔记数 {notes}")
+        if not locations_ready:
+            self.manifest.mark_ready(OSSDayManifest.LOCATIONS_READY_MARK)
+            logger.info(f"补写 OSS 位置索引: tenant={self.tenant}, 笔记数 {located}")
+        self._manifest_ready = True
+
+    def _ensure_term_digest(self):
+        """旧数据没有词项摘要时，逐天读取清单一次性生成（之后由 save 增量维护）"""
+        if self._terms_ready:
+            return
+        if self.terms.is_ready():
+            self._terms_ready = True
+            return
+        months = 0
+        batch: List[Tuple[str, Set[str]]] = []  # 同一个月的 (日期, 词项)，日期从新到旧连续产出
+
+        def flush():
+            for month, digest in OSSTermDigest.group(batch).items():
+                self.terms.update(month, digest)
+
+        for day, manifest in self.manifest.iter_loaded(window=8):
+            if batch and batch[0][0][:7] != day[:7]:
+                flush()
+                months, batch = months + 1, []
+            batch.append((day, set().union(*(OSSDayManifest.terms(e) for e in manifest.values()))))
+        if batch:
+            flush()
+            months += 1
+        self.terms.mark_ready()
+        self._terms_ready = True
+        logger.info(f"生成 OSS 词项摘要: tenant={self.tenant}, 月数 {months}")
+
+    @timed(STORAGE_STEP_LATENCY, 'oss', 'update_manifest')
+    def _update_manifest(self, notes: List[Note]):
+        by_day: Dict[str, List[dict]] = {}
+        for n in notes:
+            by_day.setdefault(n.saved_at.strftime('%Y/%m/%d'), []).append(OSSDayManifest.entry(n))
+        try:
+            for day, entries in by_day.items():
+                self.manifest.update(day, add=entries)
+                logger.debug("更新笔记清单: %s, %s 条", self.manifest.key(day), len(entries))
+            digests = OSSTermDigest.group((day, OSSDayManifest.terms(e))
+                                          for day, entries in by_day.items() for e in entries)
+            for month, digest in digests.items():
+                self.terms.update(month, digest)
+                logger.debug("更新词项摘要: %s, %s 个词项", self.terms.key(month), len(digest))
+        except Exception as e:
+            logger.error(f"更新笔记清单失败: {e}", exc_info=True)
+            raise
+
+    @timed(STORAGE_STEP_LATENCY, 'oss', 'read_note')
+    def _read_note(self, key: str) -> Note:
+        """
+        读取笔记对象（经过笔记缓存）
+
+        缓存中有该笔记时带 If-None-Match 条件读取，ETag 未变（304）直接使用缓存，
+        省去下载与解析。对象不存在时抛出 NoSuchKey。
+        """
+        note_id = key.rsplit('/', 1)[-1][:-len('.json')]
+        cache = note_cache()
+        cached = cache.peek(self._cache_scope, note_id)
+        if cached is not None:
             try:
-                self.bucket.put_object(self._key(note.id, now, "md"), md.encode('utf-8'))
-                logger.debug(f"保存 Markdown 文件到 OSS: {self._key(note.id, now, 'md')}")
-            except Exception as e:
-                logger.error(f"保存 Markdown 文件到 OSS 失败: {e}", exc_info=True)
-                raise
+                result = self.bucket.get_object(key, headers={'If-None-Match': quote_etag(cached[0])})
+            except oss2.exceptions.NotModified:
+                note = cache.get(self._cache_scope, note_id, cached[0])
+                if note is not None:
+                    return note
+                result = self.bucket.get_object(key)
+        else:
+            result = self.bucket.get_object(key)
+        data = result.read()
+        note = cache.get(self._cache_scope, note_id, result.etag)
+        if note is None:
+            note = load_note(data)
+            cache.put(self._cache_scope, note_id, result.etag, note, len(data))
+        return note
 
-            existing[note.dedup_key] = note.id
+    def _fetch_notes(self, keys: List[str]) -> List[Optional[Note]]:
+        """并发读取笔记对象，不存在或损坏的返回 None"""
+        def fetch(key: str) -> Optional[Note]:
             try:
-                self.bucket.put_object(idx_key, json.dumps(existing, ensure_ascii=False, indent=2).encode('utf-8'))
-                logger.debug(f"更新索引文件: {idx_key}")
+                return self._read_note(key)
+            except oss2.exceptions.NoSuchKey:
+                logger.warning(f"清单指向的笔记不存在: {key}")
             except Exception as e:
-                logger.error(f"更新索引文件失败: {idx_key}, 错误: {e}", exc_info=True)
-                raise
-            
+                logger.warning(f"读取笔记失败: {key}, 错误: {e}")
+            return None
+        if len(keys) <= 1:
+            return [fetch(k) for k in keys]
+        return list(fetch_executor().map(fetch, keys))
+
+    def save(self, note_in: NoteIn, now: datetime, suggested_id: Optional[str] = None) -> Note:
+        try:
+            note = build_note(note_in, now, self.tenant, suggested_id)
+            existing_id = self._check_dedup(note)
+            if existing_id:
+                logger.info(f"检测到重复内容，返回已存在的笔记: {existing_id}")
+                return note.model_copy(update={"id": existing_id})
+
+            self._write_json(note)
+            self._write_markdown(note)
+            self._update_dedup([note])
+            self._update_location(note)
+            self._update_manifest([note])
+
             logger.info(f"笔记保存成功: {note.id}, 标题: {note.title[:50]}")
             return note
         except Exception as e:
             logger.error(f"保存笔记失败: {e}", exc_info=True)
             raise
 
+    async def asave(self, note_in: NoteIn, now: datetime, suggested_id: Optional[str] = None) -> Note:
+        """异步保存：相互独立的 PUT 请求并发发出"""
+        try:
+            note = await run_io(build_note, note_in, now, self.tenant, suggested_id)
+            existing_id = await run_io(self._check_dedup, note)
+            if existing_id:
+                logger.info(f"检测到重复内容，返回已存在的笔记: {existing_id}")
+                return note.model_copy(update={"id": existing_id})
+
+            await self._awrite_files(note)
+            await asyncio.gather(run_io(self._update_dedup, [note]), run_io(self._update_location, note),
+                                 run_io(self._update_manifest, [note]))
+
+            logger.info(f"笔记保存成功: {note.id}, 标题: {note.title[:50]}")
+            return note
+        except Exception as e:
+            logger.error(f"保存笔记失败: {e}", exc_info=True)
+            raise
+
+    @timed(STORAGE_STEP_LATENCY, 'oss', 'dedup_lookup')
+    def _check_dedup(self, note: Note) -> Optional[str]:
+        """幂等：按小时分片的去重索引"""
+        try:
+            return self.dedup.get(note.dedup_key)
+        except Exception as e:
+            logger.error(f"读取去重索引失败: {note.dedup_key}, 错误: {e}", exc_info=True)
+            raise
+
+    @timed(STORAGE_STEP_LATENCY, 'oss', 'write_json')
+    def _write_json(self, note: Note):
+        key = self._key(note.id, note.saved_at, "json")
+        try:
+            data = dump_note(note, self.note_format)
+            result = self.bucket.put_object(key, data)
+            note_cache().put(self._cache_scope, note.id, result.etag, note, len(data))
+            logger.debug("保存 JSON 文件到 OSS: %s", key)
+        except Exception as e:
+            logger.error(f"保存 JSON 文件到 OSS 失败: {e}", exc_info=True)
+            raise
+
+    @timed(STORAGE_STEP_LATENCY, 'oss', 'write_markdown')
+    def _write_md(self, note: Note, md: Optional[str] = None):
+        key = self._key(note.id, note.saved_at, "md")
+        try:
+            self.bucket.put_object(key, (md if md is not None else render_markdown(note)).encode('utf-8'))
+            logger.debug("保存 Markdown 文件到 OSS: %s", key)
+        except Exception as e:
+            logger.error(f"保存 Markdown 文件到 OSS 失败: {e}", exc_info=True)
+            raise
+
+    def _write_md_deferred(self, note: Note):
+        # 后台任务执行时笔记可能已被删除，不再写出孤立的 Markdown
+        if self.bucket.object_exists(self._key(note.id, note.saved_at, "json")):
+            self._write_md(note)
+
+    def _write_markdown(self, note: Note):
+        """按 markdown_mode 写入 Markdown：同步写、交给后台队列或留到首次读取"""
+        if self.markdown_mode == MARKDOWN_SYNC:
+            self._write_md(note)
+        elif self.markdown_mode != MARKDOWN_LAZY:
+            markdown_queue().submit(partial(self._write_md_deferred, note))
+
+    async def _awrite_files(self, note: Note):
+        if self.markdown_mode == MARKDOWN_SYNC:
+            await asyncio.gather(run_io(self._write_json, note), run_io(self._write_md, note))
+        else:
+            await run_io(self._write_json, note)
+            await run_io(self._write_markdown, note)
+
+    def _formats(self) -> List[str]:
+        return ['json'] if self.markdown_mode == MARKDOWN_LAZY else ['json', 'md']
+
+    @timed(STORAGE_STEP_LATENCY, 'oss', 'update_dedup')
+    def _update_dedup(self, notes: List[Note]):
+        if not notes:
+            return
+        keys = ', '.join(n.dedup_key for n in notes[:3]) + (' ...' if len(notes) > 3 else '')
+        try:
+            self.dedup.put_many([(n.dedup_key, n.id) for n in notes])
+            logger.debug("更新去重索引: %s", keys)
+        except Exception as e:
+            logger.error(f"更新去重索引失败: {keys}, 错误: {e}", exc_info=True)
+            raise
+
+    def _update_location(self, note: Note):
+        try:
+            self._put_location(note.id, note.saved_at.strftime('%Y/%m/%d'), self._formats())
+            logger.debug("更新位置索引: %s", self._loc_key(note.id))
+        except Exception as e:
+            logger.error(f"更新位置索引失败: {note.id}, 错误: {e}", exc_info=True)
+            raise
+
+    def save_many(self, note_ins: List[NoteIn], now: datetime) -> NoteBatchResult:
+        """批量保存：批内去重，写入全部对象后去重索引只提交一次"""
+        try:
+            results, fresh = plan_batch(note_ins, now, self.tenant, self._check_dedup)
+            written: List[Note] = []
+            for i, note in fresh:
+                try:
+                    self._write_json(note)
+                    self._write_markdown(note)
+                    self._update_location(note)
+                    written.append(note)
+                except Exception as e:
+                    results[i] = BatchItemResult(index=i, status="error", error=str(e))
+            self._update_dedup(written)
+            self._update_manifest(written)
+            logger.info(f"批量保存完成: 共 {len(note_ins)} 条, 新增 {len(written)} 条")
+            return batch_summary(results)
+        except Exception as e:
+            logger.error(f"批量保存失败: {e}", exc_info=True)
+            raise
+
+    async def asave_many(self, note_ins: List[NoteIn], now: datetime) -> NoteBatchResult:
+        """异步批量保存：所有对象并发上传"""
+        try:
+            results, fresh = await run_io(plan_batch, note_ins, now, self.tenant, self._check_dedup)
+            outcomes = await asyncio.gather(
+                *[asyncio.gather(self._awrite_files(n), run_io(self._update_location, n)) for _, n in fresh],
+                return_exceptions=True,
+            )
+            written: List[Note] = []
+            for (i, note), outcome in zip(fresh, outcomes):
+                if isinstance(outcome, Exception):
+                    results[i] = BatchItemResult(index=i, status="error", error=str(outcome))
+                else:
+                    written.append(note)
+            await asyncio.gather(run_io(self._update_dedup, written), run_io(self._update_manifest, written))
+            logger.info(f"批量保存完成: 共 {len(note_ins)} 条, 新增 {len(written)} 条")
+            return batch_summary(results)
+        except Exception as e:
+            logger.error(f"批量保存失败: {e}", exc_info=True)
+            raise
+
     def list_recent(self, limit: int = 5) -> List[Note]:
-        items: List[Note] = []
+        return self.list_page(limit)[0]
+
+    def list_page(self, limit: int = 5, cursor: Optional[str] = None,
+                  before: Optional[datetime] = None) -> Tuple[List[Note], Optional[str]]:
+        """
+        按时间倒序分页列出笔记
+
+        从最新一天的清单往前读，凑够 limit 条后只读取这些笔记对象。
+        游标记录上一页最后一条的 (日期, 保存时间, ID)。
+        """
         try:
-            prefix = f"{self.prefix}{self.tenant}/"
-            for obj in self.bucket.list_objects(prefix=prefix).object_list[::-1]:
-                if obj.key.endswith('.json'):
-                    try:
-                        data = self.bucket.get_object(obj.key).read().decode('utf-8')
-                        items.append(Note.model_validate_json(data))
-                        if len(items) >= limit:
-                            break
-                    except json.JSONDecodeError as e:
-                        logger.warning(f"JSON 解析失败: {obj.key}, 错误: {e}")
-                        continue
-                    except Exception as e:
-                        logger.warning(f"读取笔记失败: {obj.key}, 错误: {e}")
+            end: Optional[Tuple[str, str]] = None
+            end_day: Optional[str] = None
+            if cursor:
+                c = decode_cursor(cursor)
+                if not all(isinstance(c.get(k), str) for k in ('d', 't', 'i')):
+                    raise ValueError(f"invalid cursor: {cursor}")
+                end_day, end = c['d'], (c['t'], c['i'])
+            elif before:
+                if before.tzinfo is None:
+                    before = before.replace(tzinfo=timezone.utc)
+                end_day, end = before.astimezone(timezone.utc).strftime('%Y/%m/%d'), (time_key(before), '')
+
+            self._ensure_manifest()
+            picked: List[Tuple[str, dict]] = []
+            for day, manifest in self.manifest.iter_loaded(end_day):
+                entries = sorted(manifest.values(), key=lambda e: (e['t'], e['id']), reverse=True)
+                for e in entries:
+                    if end and (e['t'], e['id']) >= end:
                         continue
-            logger.debug(f"列出最近笔记: {len(items)} 条")
-            return items
+                    picked.append((day, e))
+                    if len(picked) >= limit:
+                        break
+                if len(picked) >= limit:
+                    break
+
+            base = f"{self.prefix}{self.tenant}/"
+            notes = self._fetch_notes([f"{base}{day}/{e['id']}.json" for day, e in picked])
+            items = [n for n in notes if n is not None]
+            next_cursor = None
+            if len(picked) >= limit:
+                day, e = picked[-1]
+                next_cursor = encode_cursor({"d": day, "t": e['t'], "i": e['id']})
+            logger.debug("列出最近笔记: %s 条", len(items))
+            return items, next_cursor
+        except ValueError:
+            raise
         except Exception as e:
             logger.error(f"列出笔记失败: {e}", exc_info=True)
             raise
 
     def search(self, q: str, limit: int = 10) -> List[Note]:
-        items: List[Note] = []
+        """搜索笔记，按相关度排序"""
+        return [note for note, _ in self.search_scored(q, limit)]
+
+    def search_scored(self, q: str, limit: int = 10) -> List[Tuple[Note, float]]:
+        """
+        BM25 排序搜索：先读按月词项摘要求出可能命中的日期，只读取这些天的清单（新的在前，并发预取），
+        用清单中的标题、标签和摘要打分，命中 MAX_CANDIDATES 条后停止扫描；只读取得分最高的 limit 篇笔记
+        """
         try:
-            prefix = f"{self.prefix}{self.tenant}/"
-            for obj in self.bucket.list_objects(prefix=prefix).object_list:
-                if not obj.key.endswith('.json'): 
-                    continue
-                try:
-                    data = json.loads(self.bucket.get_object(obj.key).read().decode('utf-8'))
-                    hay = (data.get('title','') + ' ' + data.get('content','')).lower()
-                    for m in (data.get('context_before') or []):
-                        hay += ' ' + (m.get('text','') if isinstance(m, dict) else '')
-                    if q.lower() in hay:
-                        items.append(Note.model_validate(data))
-                        if len(items) >= limit:
-                            return items
-                except json.JSONDecodeError as e:
-                    logger.warning(f"JSON 解析失败: {obj.key}, 错误: {e}")
-                    continue
-                except Exception as e:
-                    logger.warning(f"搜索笔记失败: {obj.key}, 错误: {e}")
-                    continue
-            logger.debug(f"搜索完成: 查询 '{q}', 找到 {len(items)} 条")
-            return items
+            self._ensure_manifest()
+            ranker = BM25Ranker(q)
+            df = {t: 0 for t in ranker.terms}
+            ranker.df = df
+            scanned = 0
+            cjk, words = query_terms(q)
+            if cjk or words:
+                self._ensure_term_digest()
+
+                def candidate_days():
+                    for month, digest in prefetch(lambda m: (m, self.terms.load(m)), self.terms.iter_months()):
+                        yield from OSSTermDigest.candidate_days(month, digest, cjk, words)
+
+                loaded = prefetch(lambda day: (day, self.manifest.load(day)), candidate_days(), window=8)
+            else:
+                # 查询没有可索引的词项（如只有标点）：逐天扫描全部清单
+                loaded = self.manifest.iter_loaded(window=8)
+
+            def docs():
+                nonlocal scanned
+                matched = 0
+                for day, manifest in loaded:
+                    for e in sorted(manifest.values(), key=lambda e: (e['t'], e['id']), reverse=True):
+                        fields = OSSDayManifest.fields(e)
+                        scanned += 1
+                        present = [t for t in ranker.terms if any(t in v for v in fields.values())]
+                        for t in present:
+                            df[t] += 1
+                        if len(present) == len(ranker.terms):
+                            matched += 1
+                            yield (day, e['id']), fields
+                    if matched >= MAX_CANDIDATES:
+                        break
+                ranker.n_docs = scanned
+
+            top = ranker.rank(docs(), limit)
+            base = f"{self.prefix}{self.tenant}/"
+            notes = self._fetch_notes([f"{base}{day}/{note_id}.json" for (day, note_id), _ in top])
+            hits = [(note, score) for note, (_, score) in zip(notes, top) if note is not None]
+            logger.debug("搜索完成: 查询 '%s', 扫描清单记录 %s 条, 返回 %s 条", q, scanned, len(hits))
+            return hits
         except Exception as e:
             logger.error(f"搜索失败: {e}", exc_info=True)
             raise
 
-    def delete(self, note_id: str) -> bool:
-        """删除笔记，带安全检查"""
+    def iter_notes(self, since: Optional[datetime] = None) -> Iterator[Note]:
+        """
+        按日期从旧到新遍历全部笔记（导出用）
+
+        逐天列举笔记对象，并发预取后续对象，每天的笔记按保存时间排序后产出（内存中只保留一天）；
+        不经过笔记缓存，避免整租户导出挤掉热数据。
+        since 只返回保存时间不早于它的笔记，更早的日期前缀不会被列举。
+        """
+        prefix = f"{self.prefix}{self.tenant}/"
+        since_day = None
+        if since:
+            if since.tzinfo is None:
+                since = since.replace(tzinfo=timezone.utc)
+            since_day = since.astimezone(timezone.utc).strftime('%Y/%m/%d')
+
+        def keys() -> Iterator[Tuple[str, str]]:
+            for day in iter_days(self.bucket, prefix, start_day=since_day, newest_first=False):
+                for k in list_keys(self.bucket, f"{prefix}{day}/"):
+                    if k.endswith('.json'):
+                        yield day, k
+
+        def fetch(item: Tuple[str, str]) -> Tuple[str, Optional[Note]]:
+            day, key = item
+            try:
+                return day, load_note(self.bucket.get_object(key).read())
+            except oss2.exceptions.NoSuchKey:
+                return day, None  # 已删除
+            except Exception as e:
+                logger.warning(f"导出时读取笔记失败: {key}, 错误: {e}")
+                return day, None
+
+        current, notes = None, []
+        for day, note in prefetch(fetch, keys(), window=16):
+            if day != current:
+                yield from sorted(notes, key=lambda n: (n.saved_at, n.id))
+                current, notes = day, []
+            if note is not None and (since is None or note.saved_at >= since):
+                notes.append(note)
+        yield from sorted(notes, key=lambda n: (n.saved_at, n.id))
+
+    def get(self, note_id: str) -> Optional[Note]:
+        """按 ID 读取笔记（位置索引单次查找）"""
         note_id = sanitize_filename(note_id)
-        found = False
         try:
-            prefix = f"{self.prefix}{self.tenant}/"
-            for obj in self.bucket.list_objects(prefix=prefix).object_list:
-                base = obj.key.rsplit('/', 1)[-1]
-                if base.split('.')[0] == note_id:
+            for key in self._locate(note_id):
+                if key.endswith('.json'):
                     try:
-                        self.bucket.delete_object(obj.key)
-                        logger.debug(f"删除文件: {obj.key}")
-                        found = True
-                    except Exception as e:
-                        logger.error(f"删除文件失败: {obj.key}, 错误: {e}", exc_info=True)
-            
+                        return self._read_note(key)
+                    except oss2.exceptions.NoSuchKey:
+                        logger.warning(f"位置索引指向的笔记不存在: {key}")
+                        return None
+            logger.debug("笔记未找到: %s", note_id)
+            return None
+        except Exception as e:
+            logger.error(f"读取笔记失败: {note_id}, 错误: {e}", exc_info=True)
+            raise
+
+    def get_markdown(self, note_id: str) -> Optional[str]:
+        """读取笔记 Markdown；尚未生成时由 JSON 渲染并写入，之后直接读取对象"""
+        note_id = sanitize_filename(note_id)
+        try:
+            keys = self._locate(note_id)
+            json_key = next((k for k in keys if k.endswith('.json')), None)
+            if json_key is None:
+                return None
+            md_key = json_key[:-len('json')] + 'md'
+            try:
+                return self.bucket.get_object(md_key).read().decode('utf-8')
+            except oss2.exceptions.NoSuchKey:
+                pass
+            try:
+                note = self._read_note(json_key)
+            except oss2.exceptions.NoSuchKey:
+                logger.warning(f"位置索引指向的笔记不存在: {json_key}")
+                return None
+            md = render_markdown(note)
+            try:
+                self._write_md(note, md)
+                if md_key not in keys:
+                    self._put_location(note_id, note.saved_at.strftime('%Y/%m/%d'), ['json', 'md'])
+            except Exception as e:
+                logger.warning(f"缓存 Markdown 文件失败: {note_id}, 错误: {e}")
+            return md
+        except Exception as e:
+            logger.error(f"读取 Markdown 失败: {note_id}, 错误: {e}", exc_info=True)
+            raise
+
+    def delete(self, note_id: str) -> bool:
+        """删除笔记：通过位置索引直接定位对象"""
+        note_id = sanitize_filename(note_id)
+        try:
+            keys = self._locate(note_id)
+            found = bool(keys)
+            if found:
+                try:
+                    self.bucket.batch_delete_objects(keys + [self._loc_key(note_id)])
+                    logger.debug("删除文件: %s", keys)
+                except Exception as e:
+                    logger.error(f"删除文件失败: {keys}, 错误: {e}", exc_info=True)
+                    raise
+                note_cache().invalidate(self._cache_scope, note_id)
+                day = keys[0][len(f"{self.prefix}{self.tenant}/"):].rsplit('/', 1)[0]
+                try:
+                    self.manifest.update(day, remove=[note_id])
+                except Exception as e:
+                    logger.error(f"更新笔记清单失败: {self.manifest.key(day)}, 错误: {e}", exc_info=True)
+                    raise
+
             if found:
                 logger.info(f"笔记删除成功: {note_id}")
             else:
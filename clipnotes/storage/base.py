@@ -0,0 +1,169 @@
+from __future__ import annotations
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Any, AsyncIterator, Callable, Dict, Iterable, List, Optional, Tuple
+from datetime import datetime
+import asyncio
+import threading
+import logging
+from ..models import Note, NoteIn, BatchItemResult, NoteBatchResult, NearDuplicateReport
+from ..utils import short_title, dedup_key, extract_keywords, extract_keywords_many, generate_ai_title, sanitize_filename
+from .ranking import MAX_CANDIDATES, rank_notes
+
+logger = logging.getLogger(__name__)
+
+_io_executor: Optional[ThreadPoolExecutor] = None
+_io_executor_lock = threading.Lock()
+_io_threads = 64
+
+def configure_io_executor(max_workers: int):
+    """设置存储 I/O 线程池大小（须在首次使用前调用）"""
+    global _io_threads
+    _io_threads = max(1, max_workers)
+
+def io_executor() -> ThreadPoolExecutor:
+    """
+    存储 I/O 专用线程池
+
+    与 Starlette 的默认线程池分开：路由处理函数本身是协程，
+    只有真正阻塞的文件 / OSS 调用才占用这里的线程。
+    """
+    global _io_executor
+    with _io_executor_lock:
+        if _io_executor is None:
+            _io_executor = ThreadPoolExecutor(max_workers=_io_threads, thread_name_prefix='clipnotes-io')
+            logger.info(f"创建存储 I/O 线程池: max_workers={_io_threads}")
+        return _io_executor
+
+async def run_io(func: Callable[..., Any], *args, **kwargs) -> Any:
+    """在存储 I/O 线程池中执行阻塞调用"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(io_executor(), partial(func, *args, **kwargs))
+
+_END = object()
+
+async def iterate_io(items: Iterable[Any]) -> AsyncIterator[Any]:
+    """在存储 I/O 线程池中逐个推进阻塞的迭代器（流式响应用）"""
+    it = iter(items)
+    while True:
+        item = await run_io(next, it, _END)
+        if item is _END:
+            return
+        yield item
+
+def build_note(note_in: NoteIn, now: datetime, tenant: str, suggested_id: Optional[str] = None,
+               keywords: Optional[List[str]] = None, embedding: Optional[dict] = None) -> Note:
+    """
+    公共逻辑：由输入构造 Note（标题、标签、去重键、ID）；keywords 为预先提取的关键词，
+    embedding 为向量索引的模型说明（向量本身存放在租户的向量矩阵中，不写入笔记 JSON）
+    """
+    # 尝试使用 AI 生成标题，如果未启用则使用默认策略
+    ai_title = generate_ai_title(note_in.content)
+    title = ai_title if ai_title else short_title(note_in.content)
+    tags = list(note_in.tags or []) or (keywords if keywords is not None else extract_keywords(note_in.content, topk=5))
+    dd = dedup_key(note_in.content, now)
+    note_id = sanitize_filename(suggested_id or dd.replace('@', '-'))
+    return Note(
+        id=note_id, title=title, content=note_in.content, tags=tags, topic=note_in.topic,
+        saved_at=now, source=note_in.source, dedup_key=dd, summary=None, embedding=embedding,
+        context_before=note_in.context_before, tenant=tenant
+    )
+
+def plan_batch(note_ins: List[NoteIn], now: datetime, tenant: str,
+               check_dedup: Callable[[Note], Optional[str]],
+               embedding: Optional[dict] = None) -> Tuple[List[BatchItemResult], List[Tuple[int, Note]]]:
+    """
+    批量保存的公共逻辑：并行提取关键词、构造 Note、批内及存储去重
+
+    Returns:
+        (逐条结果, 需要写入的 (序号, Note))。待写入的条目先标记为 created，
+        写入失败时由调用方改为 error。
+    """
+    need_kw = [i for i, n in enumerate(note_ins) if not n.tags]
+    extracted = extract_keywords_many([note_ins[i].content for i in need_kw], topk=5)
+    keywords = dict(zip(need_kw, extracted))
+
+    results: List[BatchItemResult] = []
+    fresh: List[Tuple[int, Note]] = []
+    seen: Dict[str, str] = {}
+    for i, note_in in enumerate(note_ins):
+        try:
+            note = build_note(note_in, now, tenant, keywords=keywords.get(i), embedding=embedding)
+            existing_id = seen.get(note.dedup_key) or check_dedup(note)
+            if existing_id:
+                seen[note.dedup_key] = existing_id
+                results.append(BatchItemResult(index=i, status="duplicate", note=note.model_copy(update={"id": existing_id})))
+                continue
+            seen[note.dedup_key] = note.id
+            results.append(BatchItemResult(index=i, status="created", note=note))
+            fresh.append((i, note))
+        except Exception as e:
+            logger.warning(f"批量保存第 {i} 条失败: {e}")
+            results.append(BatchItemResult(index=i, status="error", error=str(e)))
+    return results, fresh
+
+def batch_summary(results: List[BatchItemResult]) -> NoteBatchResult:
+    return NoteBatchResult(
+        items=results,
+        created=sum(r.status == "created" for r in results),
+        duplicates=sum(r.status == "duplicate" for r in results),
+        errors=sum(r.status == "error" for r in results),
+    )
+
+class AsyncStorageMixin:
+    """
+    存储后端的异步接口
+
+    默认实现把同步方法放到存储 I/O 线程池执行；
+    后端可以覆盖（如 asave）以并发发出相互独立的写入。
+    """
+
+    async def asave(self, note_in: NoteIn, now: datetime, suggested_id: Optional[str] = None) -> Note:
+        return await run_io(self.save, note_in, now, suggested_id)
+
+    async def asave_many(self, note_ins: List[NoteIn], now: datetime) -> NoteBatchResult:
+        return await run_io(self.save_many, note_ins, now)
+
+    async def alist_page(self, limit: int = 5, cursor: Optional[str] = None,
+                         before: Optional[datetime] = None) -> Tuple[List[Note], Optional[str]]:
+        return await run_io(self.list_page, limit, cursor, before)
+
+    async def alist_recent(self, limit: int = 5) -> List[Note]:
+        return (await self.alist_page(limit))[0]
+
+    async def asearch(self, q: str, limit: int = 10) -> List[Note]:
+        return await run_io(self.search, q, limit)
+
+    def search_scored(self, q: str, limit: int = 10) -> List[Tuple[Note, float]]:
+        """按相关度排序的搜索结果 (笔记, 得分)；默认取 search 的前 MAX_CANDIDATES 条命中做 BM25 排序"""
+        return rank_notes(q, self.search(q, MAX_CANDIDATES), limit)
+
+    async def asearch_scored(self, q: str, limit: int = 10) -> List[Tuple[Note, float]]:
+        return await run_io(self.search_scored, q, limit)
+
+    async def aget(self, note_id: str) -> Optional[Note]:
+        return await run_io(self.get, note_id)
+
+    async def aget_markdown(self, note_id: str) -> Optional[str]:
+        return await run_io(self.get_markdown, note_id)
+
+    async def adelete(self, note_id: str) -> bool:
+        return await run_io(self.delete, note_id)
+
+    def similar_scored(self, q: str, limit: int = 10, exclude: Optional[str] = None) -> List[Tuple[Note, float]]:
+        """向量相似度检索 [(笔记, 余弦相似度)]；exclude 排除的笔记ID（查找相关笔记时排除自身）"""
+        raise NotImplementedError(f"{type(self).__name__} 不支持向量检索")
+
+    async def asimilar_scored(self, q: str, limit: int = 10, exclude: Optional[str] = None) -> List[Tuple[Note, float]]:
+        return await run_io(self.similar_scored, q, limit, exclude)
+
+    def near_duplicates(self, limit: int = 100) -> NearDuplicateReport:
+        """把已有笔记按近似重复聚类（SimHash 指纹索引），只返回最大的 limit 组"""
+        raise NotImplementedError(f"{type(self).__name__} 不支持近似重复检测")
+
+    async def anear_duplicates(self, limit: int = 100) -> NearDuplicateReport:
+        return await run_io(self.near_duplicates, limit)
+
+    def index_stats(self) -> Dict[str, int]:
+        """本租户各索引的大小（/metrics 用）；后端无本地索引时为空"""
+        return {}
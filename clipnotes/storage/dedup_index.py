@@ -0,0 +1,182 @@
+from __future__ import annotations
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+from datetime import datetime, timedelta, timezone
+import json
+import os
+import random
+import time
+import threading
+import logging
+
+logger = logging.getLogger(__name__)
+
+WRITE_RETRIES = 5
+
+class WriteConflict(Exception):
+    """条件写入失败：对象在读取之后已被其他进程改写"""
+
+def conflict_backoff(attempt: int) -> float:
+    """写冲突后的等待秒数：指数退避加随机抖动，避免多个 worker 同步重试"""
+    return 0.05 * (2 ** attempt) * (0.5 + random.random())
+
+class DedupIndex:
+    """
+    去重索引基类：按小时分片，过期分片自动清理，内存中缓存热分片
+
+    dedup_key 形如 <hash>@YYYYmmddHHMM，只可能与同一分钟内保存的内容重复，
+    因此查重只需访问所属小时的分片，写入也只重写这一个小分片；
+    超过保留期的分片不会再被命中，可以直接删除。
+    子类实现分片的读取、写入、删除和列举。
+    支持条件写入的子类在 _load_versioned 中返回分片版本，_store_bucket 按版本写入，
+    版本不一致时抛出 WriteConflict，由 put_many 重新读取合并后重试。
+    """
+    PURGE_INTERVAL = 3600  # 秒
+    HOT_BUCKETS = 4
+
+    def __init__(self, retention_hours: int = 48):
+        self.retention = timedelta(hours=max(1, retention_hours))
+        self._hot: "OrderedDict[str, Dict[str, str]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._last_purge: Optional[float] = None
+
+    # ---- 子类实现 ----
+
+    def _load_bucket(self, bucket: str) -> Dict[str, str]:
+        raise NotImplementedError
+
+    def _load_versioned(self, bucket: str) -> Tuple[Dict[str, str], Optional[str]]:
+        """读取分片及其版本（用于条件写入）；默认不带版本"""
+        return self._load_bucket(bucket), None
+
+    def _store_bucket(self, bucket: str, entries: Dict[str, str], version: Optional[str] = None):
+        raise NotImplementedError
+
+    def _drop_bucket(self, bucket: str):
+        raise NotImplementedError
+
+    def _list_buckets(self) -> List[str]:
+        raise NotImplementedError
+
+    # ---- 公共逻辑 ----
+
+    @staticmethod
+    def bucket_of(key: str) -> str:
+        """dedup_key 所属的小时分片，如 2025102213"""
+        return key.rsplit('@', 1)[-1][:10]
+
+    def _remember(self, bucket: str, entries: Dict[str, str]):
+        with self._lock:
+            self._hot[bucket] = entries
+            self._hot.move_to_end(bucket)
+            while len(self._hot) > self.HOT_BUCKETS:
+                self._hot.popitem(last=False)
+
+    def get(self, key: str) -> Optional[str]:
+        """查找重复内容对应的笔记ID"""
+        bucket = self.bucket_of(key)
+        with self._lock:
+            entries = self._hot.get(bucket)
+            if entries is not None and key in entries:
+                return entries[key]
+        # 热集未命中时重新读取分片，以看到其他进程的写入
+        entries = self._load_bucket(bucket)
+        self._remember(bucket, entries)
+        return entries.get(key)
+
+    def put(self, key: str, note_id: str):
+        """记录 dedup_key -> 笔记ID，只重写所属分片"""
+        self.put_many([(key, note_id)])
+
+    def put_many(self, pairs: Iterable[Tuple[str, str]]):
+        """批量记录，每个涉及的分片只重写一次"""
+        by_bucket: Dict[str, Dict[str, str]] = {}
+        for key, note_id in pairs:
+            by_bucket.setdefault(self.bucket_of(key), {})[key] = note_id
+        with self._write_lock:
+            for bucket, new_entries in by_bucket.items():
+                self._merge_bucket(bucket, new_entries)
+        self._maybe_purge()
+
+    def _merge_bucket(self, bucket: str, new_entries: Dict[str, str]):
+        """读-改-写一个分片；遇到 WriteConflict 时重新读取合并，最多重试 WRITE_RETRIES 次"""
+        for attempt in range(WRITE_RETRIES):
+            loaded, version = self._load_versioned(bucket)
+            entries = dict(loaded)
+            entries.update(new_entries)
+            try:
+                self._store_bucket(bucket, entries, version)
+            except WriteConflict:
+                if attempt == WRITE_RETRIES - 1:
+                    logger.error(f"去重分片写冲突，重试 {WRITE_RETRIES} 次后放弃: {bucket}")
+                    raise
+                logger.info(f"去重分片写冲突，重新读取后重试: {bucket}, 第 {attempt + 1} 次")
+                time.sleep(conflict_backoff(attempt))
+                continue
+            self._remember(bucket, entries)
+            return
+
+    def _maybe_purge(self):
+        if self._last_purge is not None and time.monotonic() - self._last_purge < self.PURGE_INTERVAL:
+            return
+        self._last_purge = time.monotonic()
+        cutoff = (datetime.now(timezone.utc) - self.retention).strftime('%Y%m%d%H')
+        try:
+            expired = [b for b in self._list_buckets() if b < cutoff]
+            for b in expired:
+                self._drop_bucket(b)
+                with self._lock:
+                    self._hot.pop(b, None)
+            if expired:
+                logger.info(f"清理过期去重分片: {len(expired)} 个")
+        except Exception as e:
+            logger.warning(f"清理过期去重分片失败: {e}", exc_info=True)
+
+class LocalDedupIndex(DedupIndex):
+    """本地去重索引：index/dedup/<YYYYmmddHH>.json"""
+
+    def __init__(self, index_dir: Path, retention_hours: int = 48):
+        super().__init__(retention_hours)
+        self.dir = index_dir / 'dedup'
+        self.dir.mkdir(parents=True, exist_ok=True)
+        self._stamps: Dict[str, Tuple[int, int, Dict[str, str]]] = {}
+
+    def _path(self, bucket: str) -> Path:
+        return self.dir / f"{bucket}.json"
+
+    def _load_bucket(self, bucket: str) -> Dict[str, str]:
+        p = self._path(bucket)
+        try:
+            st = p.stat()
+        except FileNotFoundError:
+            return {}
+        cached = self._stamps.get(bucket)
+        if cached and cached[:2] == (st.st_mtime_ns, st.st_size):
+            return cached[2]
+        try:
+            entries = json.loads(p.read_text(encoding='utf-8'))
+        except FileNotFoundError:
+            return {}
+        except json.JSONDecodeError as e:
+            logger.warning(f"去重分片损坏，重置分片: {p}, 错误: {e}")
+            entries = {}
+        self._stamps[bucket] = (st.st_mtime_ns, st.st_size, entries)
+        return entries
+
+    def _store_bucket(self, bucket: str, entries: Dict[str, str], version: Optional[str] = None):
+        # 本地写入由租户锁串行，不需要版本校验
+        p = self._path(bucket)
+        tmp = p.with_name(f"{p.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+        tmp.write_text(json.dumps(entries, ensure_ascii=False, separators=(',', ':')), encoding='utf-8')
+        os.replace(tmp, p)
+        st = p.stat()
+        self._stamps[bucket] = (st.st_mtime_ns, st.st_size, entries)
+
+    def _drop_bucket(self, bucket: str):
+        self._path(bucket).unlink(missing_ok=True)
+        self._stamps.pop(bucket, None)
+
+    def _list_buckets(self) -> List[str]:
+        return [p.stem for p in self.dir.glob('*.json')]
@@ -0,0 +1,75 @@
+from __future__ import annotations
+from typing import Iterable, Iterator, List
+import io
+import tarfile
+import zlib
+from ..models import Note
+from .markdown import render_markdown
+
+# 导出格式
+EXPORT_NDJSON = 'ndjson'      # 每行一篇笔记的 JSON
+EXPORT_MARKDOWN = 'markdown'  # Markdown 文件的 tar 包，路径与存储布局一致：YYYY/MM/DD/<id>.md
+EXPORT_FORMATS = (EXPORT_NDJSON, EXPORT_MARKDOWN)
+
+CHUNK_SIZE = 64 * 1024
+
+def ndjson_chunks(notes: Iterable[Note]) -> Iterator[bytes]:
+    """笔记序列 -> NDJSON 字节块（攒到约 CHUNK_SIZE 再产出）"""
+    buf: List[bytes] = []
+    size = 0
+    for note in notes:
+        line = note.model_dump_json().encode('utf-8') + b'\n'
+        buf.append(line)
+        size += len(line)
+        if size >= CHUNK_SIZE:
+            yield b''.join(buf)
+            buf, size = [], 0
+    if buf:
+        yield b''.join(buf)
+
+class _Sink:
+    """tarfile 的只写目标：收集写入的字节，由调用方定期取走"""
+
+    def __init__(self):
+        self.parts: List[bytes] = []
+
+    def write(self, data: bytes) -> int:
+        self.parts.append(bytes(data))
+        return len(data)
+
+    def drain(self) -> bytes:
+        data, self.parts = b''.join(self.parts), []
+        return data
+
+def markdown_tar_chunks(notes: Iterable[Note]) -> Iterator[bytes]:
+    """笔记序列 -> Markdown 文件 tar 包的字节块（流式 tar，不回写文件头）"""
+    sink = _Sink()
+    tar = tarfile.open(fileobj=sink, mode='w|', format=tarfile.PAX_FORMAT)
+    pending = 0
+    for note in notes:
+        data = render_markdown(note).encode('utf-8')
+        info = tarfile.TarInfo(f"{note.saved_at.strftime('%Y/%m/%d')}/{note.id}.md")
+        info.size = len(data)
+        info.mtime = int(note.saved_at.timestamp())
+        info.mode = 0o644
+        tar.addfile(info, io.BytesIO(data))
+        pending += len(data)
+        if pending >= CHUNK_SIZE:
+            yield sink.drain()
+            pending = 0
+    tar.close()
+    yield sink.drain()
+
+def gzip_chunks(chunks: Iterable[bytes], level: int = 6) -> Iterator[bytes]:
+    """边读边压缩为 gzip 流"""
+    z = zlib.compressobj(level, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        out = z.compress(chunk)
+        if out:
+            yield out
+    yield z.flush()
+
+def export_chunks(notes: Iterable[Note], fmt: str = EXPORT_NDJSON, gzip: bool = False) -> Iterator[bytes]:
+    """按格式导出笔记序列为字节流"""
+    chunks = markdown_tar_chunks(notes) if fmt == EXPORT_MARKDOWN else ndjson_chunks(notes)
+    return gzip_chunks(chunks) if gzip else chunks
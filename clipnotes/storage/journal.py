@@ -0,0 +1,131 @@
+from __future__ import annotations
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+import json
+import os
+import threading
+import logging
+
+logger = logging.getLogger(__name__)
+
+class JournalIndex:
+    """
+    追加日志式的本地索引基类
+
+    索引持久化为 index/<FILENAME> 的 JSONL 文件，每行一条记录（通常是 add/del）。
+    内存状态由子类的 _apply 重放得到；每次访问只读取文件新增的尾部，
+    因此其他进程追加的记录也能增量看到。死记录过多时整体重写（压缩）。
+    """
+    FILENAME = ''
+    COMPACT_MIN_DEAD = 1000
+
+    _instances: Dict[Tuple[type, Path], 'JournalIndex'] = {}
+    _instances_lock = threading.Lock()
+
+    @classmethod
+    def open(cls, index_dir: Path):
+        """获取（进程内共享的）索引实例"""
+        path = (index_dir / cls.FILENAME).resolve()
+        with JournalIndex._instances_lock:
+            inst = JournalIndex._instances.get((cls, path))
+            if inst is None:
+                inst = JournalIndex._instances[(cls, path)] = cls(path)
+            return inst
+
+    @classmethod
+    def peek(cls, index_dir: Path) -> Optional['JournalIndex']:
+        """已在本进程打开过的索引实例；未打开时返回 None（不读取文件）"""
+        path = (index_dir / cls.FILENAME).resolve()
+        with JournalIndex._instances_lock:
+            return JournalIndex._instances.get((cls, path))
+
+    def __init__(self, path: Path):
+        self.path = path
+        self._lock = threading.RLock()
+        self._reset()
+
+    def _reset(self):
+        self._offset = 0
+        self._ino: Optional[int] = None
+        self._dead = 0
+        self._clear()
+
+    # ---- 子类实现 ----
+
+    def _clear(self):
+        raise NotImplementedError
+
+    def _apply(self, rec: dict):
+        raise NotImplementedError
+
+    def _live_records(self) -> List[dict]:
+        raise NotImplementedError
+
+    def _size(self) -> int:
+        raise NotImplementedError
+
+    # ---- 日志读写 ----
+
+    def exists(self) -> bool:
+        return self.path.exists()
+
+    def __len__(self) -> int:
+        with self._lock:
+            self._refresh()
+            return self._size()
+
+    def _refresh(self):
+        """读取日志中尚未应用的新记录"""
+        try:
+            st = self.path.stat()
+        except FileNotFoundError:
+            if self._ino is not None:
+                self._reset()
+            return
+        if self._ino != st.st_ino or st.st_size < self._offset:
+            # 文件被压缩重写或替换，完整重放
+            self._reset()
+            self._ino = st.st_ino
+        if st.st_size == self._offset:
+            return
+        with open(self.path, 'rb') as f:
+            f.seek(self._offset)
+            chunk = f.read()
+        end = chunk.rfind(b'\n') + 1
+        if end == 0:
+            return  # 只有未写完的半行
+        for line in chunk[:end].splitlines():
+            if not line.strip():
+                continue
+            try:
+                self._apply(json.loads(line))
+            except json.JSONDecodeError as e:
+                logger.warning(f"索引记录损坏，已跳过: {self.path}, 错误: {e}")
+        self._offset += end
+
+    def _append(self, records: Iterable[dict]):
+        data = ''.join(json.dumps(r, ensure_ascii=False) + '\n' for r in records).encode('utf-8')
+        with open(self.path, 'ab') as f:
+            f.write(data)
+
+    def _commit(self, records: Iterable[dict]):
+        """追加记录并立即应用到内存"""
+        with self._lock:
+            self._refresh()
+            self._append(records)
+            self._refresh()
+            self._maybe_compact()
+
+    def _rewrite(self, records: List[dict]):
+        tmp = self.path.with_name(self.path.name + '.tmp')
+        tmp.write_text(''.join(json.dumps(r, ensure_ascii=False) + '\n' for r in records), encoding='utf-8')
+        os.replace(tmp, self.path)
+        self._reset()
+        self._refresh()
+
+    def _maybe_compact(self):
+        if self._dead < self.COMPACT_MIN_DEAD or self._dead < self._size():
+            return
+        records = self._live_records()
+        self._rewrite(records)
+        logger.info(f"压缩索引: {self.path}, 保留 {len(records)} 条")
@@ -1,21 +1,50 @@
 from __future__ import annotations
 from pathlib import Path
-from typing import List, Optional, Dict
-from datetime import datetime
+from typing import Callable, Dict, Iterator, List, Optional, Set, Tuple
+from datetime import datetime, timezone
+from functools import partial
+import asyncio
 import json
+import os
+import time
 import logging
-from ..models import Note, NoteIn
-from ..utils import short_title, dedup_key, extract_keywords, generate_ai_title, sanitize_filename, sanitize_tenant
+from ..models import Note, NoteIn, BatchItemResult, NoteBatchResult, NearDuplicateReport
+from ..utils import sanitize_filename, sanitize_tenant, index_terms, encode_cursor, decode_cursor
+from ..metrics import STORAGE_STEP_LATENCY, timed
+from ..embedding import embedder, note_text
+from .base import AsyncStorageMixin, build_note, plan_batch, batch_summary, run_io
+from .search_index import SearchIndex
+from .location_index import LocationIndex
+from .recent_manifest import RecentManifest
+from .dedup_index import LocalDedupIndex
+from .markdown import MARKDOWN_SYNC, MARKDOWN_LAZY, render_markdown, markdown_queue
+from .note_cache import note_cache
+from .note_codec import NOTE_FORMAT_PRETTY, dump_note, load_note
+from .ranking import BM25Ranker, MAX_CANDIDATES, note_fields, rank_notes
+from .vector_index import VectorIndex, rank_similar
+from .near_dup import (NEAR_DUP_OFF, NearDupIndex, NearDuplicateError, duplicate_report, near_dup_mode,
+                       resolve_near_duplicate, screen_batch, simhash)
+from .tenant_lock import TenantLock
 
 logger = logging.getLogger(__name__)
 
-class LocalStorage:
-    def __init__(self, base_dir: str, tenant: str):
+class LocalStorage(AsyncStorageMixin):
+    # 读路径首次使用时等待租户锁重建索引的秒数上限：等待的是 I/O 线程池中的线程，不能无限占用
+    INDEX_BUILD_TIMEOUT = 30.0
+
+    def __init__(self, base_dir: str, tenant: str, dedup_retention_hours: int = 48,
+                 markdown_mode: str = MARKDOWN_SYNC, note_format: str = NOTE_FORMAT_PRETTY):
         self.base_dir = Path(base_dir).resolve()
         self.tenant = sanitize_tenant(tenant)
+        self.markdown_mode = markdown_mode
+        self.note_format = note_format
+        self._cache_scope = f"local:{self.base_dir / self.tenant}"
         try:
             (self.base_dir / self.tenant).mkdir(parents=True, exist_ok=True)
             (self.base_dir / self.tenant / 'index').mkdir(parents=True, exist_ok=True)
+            self.dedup = LocalDedupIndex(self.base_dir / self.tenant / 'index', dedup_retention_hours)
+            self._tenant_lock = TenantLock.open(self.base_dir / self.tenant / 'index' / 'LOCK')
+            self._ready_indexes: Set[str] = set()
             logger.info(f"初始化本地存储: {self.base_dir}/{self.tenant}")
         except Exception as e:
             logger.error(f"创建存储目录失败: {e}", exc_info=True)
@@ -33,160 +62,730 @@ class LocalStorage:
         p.mkdir(parents=True, exist_ok=True)
         return p / f"{note_id}.md"
 
-    def save(self, note_in: NoteIn, now: datetime, suggested_id: Optional[str] = None) -> Note:
+    @staticmethod
+    def _haystack(data: dict) -> str:
+        """搜索文本：标题 + 标签 + 正文 + 上下文"""
+        hay = data.get('title', '') + ' ' + ' '.join(data.get('tags') or []) + ' ' + data.get('content', '')
+        for m in (data.get('context_before') or []):
+            hay += ' ' + (m.get('text', '') if isinstance(m, dict) else '')
+        return hay
+
+    @classmethod
+    def _note_haystack(cls, note: Note) -> str:
+        return cls._haystack(note.model_dump(include={'title', 'tags', 'content', 'context_before'}))
+
+    @timed(STORAGE_STEP_LATENCY, 'local', 'read_note')
+    def _read_note(self, f: Path) -> Note:
+        """
+        读取笔记文件（经过笔记缓存）
+
+        以文件的 (mtime, 大小) 作为校验值，未变化时直接返回缓存的 Note，省去读取与解析。
+        文件不存在时抛出 FileNotFoundError。
+        """
+        cache = note_cache()
+        with open(f, 'rb') as fp:
+            st = os.fstat(fp.fileno())
+            validator = (st.st_mtime_ns, st.st_size)
+            note = cache.get(self._cache_scope, f.stem, validator)
+            if note is None:
+                note = load_note(fp.read())
+                cache.put(self._cache_scope, f.stem, validator, note, st.st_size)
+        return note
+
+    def _ensure_index(self, name: str, ready: Callable[[], bool], rebuild: Callable[[], None], locked: bool):
+        """
+        首次使用时从已有笔记重建索引；locked 表示调用方已持有租户锁
+
+        未持锁时先取租户锁并再检查一次：否则扫描与替换索引文件之间其他 worker 保存的笔记会永久缺失
+        （索引已存在，不会再重建），两个进程同时重建还会共用同一个临时文件。
+        同步读路径等锁时轮询：其他进程或持锁的保存建好索引后直接使用，超时抛出 TimeoutError；
+        异步读路径先经 _aensure_indexes 在事件循环上等锁，不会走到这里等待。
+        """
+        if not ready():
+            if locked:
+                rebuild()
+            else:
+                self._rebuild_unlocked(ready, rebuild)
+        self._ready_indexes.add(name)
+
+    def _rebuild_unlocked(self, ready: Callable[[], bool], rebuild: Callable[[], None]):
+        deadline = time.monotonic() + self.INDEX_BUILD_TIMEOUT
+        while not self._tenant_lock.acquire(blocking=False):
+            if ready():
+                return
+            if time.monotonic() >= deadline:
+                raise TimeoutError(f"等待租户锁重建索引超时: {self.base_dir / self.tenant}")
+            time.sleep(0.05)
         try:
-            # 尝试使用 AI 生成标题，如果未启用则使用默认策略
-            ai_title = generate_ai_title(note_in.content)
-            title = ai_title if ai_title else short_title(note_in.content)
-            tags = list(note_in.tags or []) or extract_keywords(note_in.content, topk=5)
-            dd = dedup_key(note_in.content, now)
-            note_id = sanitize_filename(suggested_id or dd.replace('@','-'))
-
-            note = Note(
-                id=note_id, title=title, content=note_in.content, tags=tags, topic=note_in.topic,
-                saved_at=now, source=note_in.source, dedup_key=dd, summary=None, embedding=None,
-                context_before=note_in.context_before, tenant=self.tenant
-            )
-
-            # 幂等：dedup_index.json
-            idx_file = self.base_dir / self.tenant / 'index' / 'dedup_index.json'
+            if not ready():
+                rebuild()
+        finally:
+            self._tenant_lock.release()
+
+    async def _aensure_indexes(self, *indexes: Tuple[str, Callable[[bool], object]]):
+        """
+        异步读路径：本实例尚未确认存在的索引，先在事件循环上等租户锁（与 asave 相同），持锁后到线程池中检查、重建
+
+        随后的同步读取直接使用已建好的索引，I/O 线程池中的线程不会阻塞在租户锁上。
+        """
+        missing = [(name, getter) for name, getter in indexes if name not in self._ready_indexes]
+        if not missing:
+            return
+        async with self._tenant_lock.ahold():
+            for name, getter in missing:
+                await run_io(getter, True)
+                self._ready_indexes.add(name)
+
+    def _search_index(self, locked: bool = False) -> SearchIndex:
+        """获取倒排索引，首次使用时从已有笔记重建"""
+        idx = SearchIndex.open(self.base_dir / self.tenant / 'index')
+        self._ensure_index('search', idx.exists, lambda: idx.rebuild(self._scan_index_entries()), locked)
+        return idx
+
+    def _location_index(self, locked: bool = False) -> LocationIndex:
+        """获取位置索引，首次使用时从已有笔记重建"""
+        idx = LocationIndex.open(self.base_dir / self.tenant / 'index')
+        self._ensure_index('location', idx.exists, lambda: idx.rebuild(self._scan_locations()), locked)
+        return idx
+
+    def index_stats(self) -> Dict[str, int]:
+        """已加载索引的条目数与最近清单大小；未加载的索引不在采集时读取"""
+        index_dir = self.base_dir / self.tenant / 'index'
+        stats = {"recent_manifest_bytes": RecentManifest(index_dir).size()}
+        for name, cls in (("location", LocationIndex), ("search_docs", SearchIndex), ("vectors", VectorIndex),
+                          ("simhash", NearDupIndex)):
+            idx = cls.peek(index_dir)
+            if idx is not None:
+                stats[name] = len(idx)
+        return stats
+
+    def _scan_locations(self):
+        tenant_dir = self.base_dir / self.tenant
+        for f in tenant_dir.glob('[0-9]*/*/*/*.json'):
+            formats = ['json', 'md'] if f.with_suffix('.md').exists() else ['json']
+            yield f.stem, f.parent.relative_to(tenant_dir).as_posix(), formats
+
+    def _locate(self, note_id: str, locked: bool = False):
+        """通过位置索引定位笔记文件，返回 (目录, 格式列表) 或 None"""
+        loc = self._location_index(locked).get(note_id)
+        if loc is None:
+            return None
+        date_path, formats = loc
+        return self.base_dir / self.tenant / date_path, formats
+
+    def _recent_manifest(self, locked: bool = False) -> RecentManifest:
+        """获取最近笔记清单，首次使用时从已有笔记重建"""
+        manifest = RecentManifest(self.base_dir / self.tenant / 'index')
+        self._ensure_index('manifest', manifest.exists, lambda: manifest.rebuild(self._scan_manifest_entries()),
+                           locked)
+        return manifest
+
+    def _scan_manifest_entries(self):
+        tenant_dir = self.base_dir / self.tenant
+        for f in tenant_dir.glob('[0-9]*/*/*/*.json'):
             try:
-                existing: Dict[str, str] = json.loads(idx_file.read_text(encoding='utf-8'))
-            except FileNotFoundError:
-                existing = {}
-                logger.debug(f"索引文件不存在，创建新索引: {idx_file}")
-            except json.JSONDecodeError as e:
-                logger.warning(f"索引文件损坏，重置索引: {idx_file}, 错误: {e}")
-                existing = {}
+                data = json.loads(f.read_text(encoding='utf-8'))
+                saved_at = datetime.fromisoformat(data['saved_at'])
+                yield f.stem, f.parent.relative_to(tenant_dir).as_posix(), saved_at
             except Exception as e:
-                logger.error(f"读取索引文件失败: {idx_file}, 错误: {e}", exc_info=True)
-                raise
-            
-            if note.dedup_key in existing:
-                logger.info(f"检测到重复内容，返回已存在的笔记: {existing[note.dedup_key]}")
-                return note.model_copy(update={"id": existing[note.dedup_key]})
+                logger.warning(f"建立清单时读取笔记失败: {f}, 错误: {e}")
+
+    def _vector_index(self, locked: bool = False) -> Optional[VectorIndex]:
+        """获取向量索引（未启用向量化时为 None），首次使用或维度变化时从已有笔记重建"""
+        emb = embedder()
+        if emb is None:
+            return None
+        idx = VectorIndex.open(self.base_dir / self.tenant / 'index')
+        self._ensure_index('vector', lambda: idx.exists() and idx.dimension() == emb.dim,
+                           lambda: idx.rebuild(emb.dim, self._scan_vectors(emb)), locked)
+        return idx
 
-            # 写 JSON
-            p_json = self._path_for(note.id, now)
+    def _embedding_ref(self) -> Optional[dict]:
+        emb = embedder()
+        return emb.ref if emb is not None else None
+
+    def _scan_vectors(self, emb):
+        tenant_dir = self.base_dir / self.tenant
+        for f in tenant_dir.glob('[0-9]*/*/*/*.json'):
             try:
-                p_json.write_text(note.model_dump_json(ensure_ascii=False, indent=2), encoding='utf-8')
-                logger.debug(f"保存 JSON 文件: {p_json}")
+                data = json.loads(f.read_text(encoding='utf-8'))
+                yield f.stem, emb.embed(note_text(data))
             except Exception as e:
-                logger.error(f"保存 JSON 文件失败: {p_json}, 错误: {e}", exc_info=True)
-                raise
+                logger.warning(f"建立向量索引时读取笔记失败: {f}, 错误: {e}")
 
-            # 写 Markdown（带前三轮上下文）
-            p_md = self._path_for_md(note.id, now)
-            ctx_md = ''
-            if note.context_before:
-                ctx_lines = [f"- **{m['role'] if isinstance(m, dict) else m.role}**：{(m['text'] if isinstance(m, dict) else m.text)}" for m in note.context_before]
-                ctx_md = "\n\n### 上下文（前 3 轮）\n" + "\n".join(ctx_lines)
-            md = f"# {note.title}\n- 时间：{now.isoformat()}\n- 标签：{', '.join(note.tags) if note.tags else '-'}\n- 主题：{note.topic or '-'}\n- 来源：{(note.source and (note.source.thread_title or '')) or '-'}\n\n## 原文\n{note.content}{ctx_md}\n"
+    def _near_dup_index(self, locked: bool = False) -> Optional[NearDupIndex]:
+        """获取 SimHash 指纹索引（NEAR_DUP_MODE=off 时为 None），首次使用时从已有笔记重建"""
+        if near_dup_mode() == NEAR_DUP_OFF:
+            return None
+        idx = NearDupIndex.open(self.base_dir / self.tenant / 'index')
+        self._ensure_index('near_dup', idx.exists, lambda: idx.rebuild(self._scan_fingerprints()), locked)
+        return idx
+
+    def _scan_fingerprints(self):
+        tenant_dir = self.base_dir / self.tenant
+        for f in tenant_dir.glob('[0-9]*/*/*/*.json'):
             try:
-                p_md.write_text(md, encoding='utf-8')
-                logger.debug(f"保存 Markdown 文件: {p_md}")
+                data = json.loads(f.read_text(encoding='utf-8'))
+                yield f.stem, simhash(data.get('content', '')), data.get('saved_at', '')
             except Exception as e:
-                logger.error(f"保存 Markdown 文件失败: {p_md}, 错误: {e}", exc_info=True)
-                raise
+                logger.warning(f"建立指纹索引时读取笔记失败: {f}, 错误: {e}")
 
-            # 更新索引
-            existing[note.dedup_key] = note.id
+    def _scan_index_entries(self):
+        tenant_dir = self.base_dir / self.tenant
+        for f in tenant_dir.glob('[0-9]*/*/*/*.json'):
             try:
-                idx_file.write_text(json.dumps(existing, ensure_ascii=False, indent=2), encoding='utf-8')
-                logger.debug(f"更新索引文件: {idx_file}")
+                data = json.loads(f.read_text(encoding='utf-8'))
+                yield f.stem, f.relative_to(tenant_dir).as_posix(), index_terms(self._haystack(data))
             except Exception as e:
-                logger.error(f"更新索引文件失败: {idx_file}, 错误: {e}", exc_info=True)
-                raise
-            
+                logger.warning(f"建立索引时读取笔记失败: {f}, 错误: {e}")
+
+    def save(self, note_in: NoteIn, now: datetime, suggested_id: Optional[str] = None) -> Note:
+        try:
+            note = build_note(note_in, now, self.tenant, suggested_id, embedding=self._embedding_ref())
+            # 查重、写文件、更新索引在租户锁内完成（多 worker / 多实例共享数据目录）
+            with self._tenant_lock:
+                existing_id = self._check_dedup(note)
+                if existing_id:
+                    logger.info(f"检测到重复内容，返回已存在的笔记: {existing_id}")
+                    return note.model_copy(update={"id": existing_id})
+
+                indexes = self._open_indexes()
+                linked = self._check_near_dup(note, indexes[-1])
+                if linked is not None:
+                    return linked
+                self._write_json(note)
+                self._write_markdown(note)
+                self._update_indexes([note], *indexes)
+
+            logger.info(f"笔记保存成功: {note.id}, 标题: {note.title[:50]}")
+            return note
+        except NearDuplicateError:
+            raise
+        except Exception as e:
+            logger.error(f"保存笔记失败: {e}", exc_info=True)
+            raise
+
+    async def asave(self, note_in: NoteIn, now: datetime, suggested_id: Optional[str] = None) -> Note:
+        """异步保存：同步写 Markdown 时与 JSON 并发写入"""
+        try:
+            note = await run_io(build_note, note_in, now, self.tenant, suggested_id, embedding=self._embedding_ref())
+            async with self._tenant_lock.ahold():
+                existing_id = await run_io(self._check_dedup, note)
+                if existing_id:
+                    logger.info(f"检测到重复内容，返回已存在的笔记: {existing_id}")
+                    return note.model_copy(update={"id": existing_id})
+
+                indexes = await run_io(self._open_indexes)
+                linked = await run_io(self._check_near_dup, note, indexes[-1])
+                if linked is not None:
+                    return linked
+                await self._awrite_files(note)
+                await run_io(self._update_indexes, [note], *indexes)
+
             logger.info(f"笔记保存成功: {note.id}, 标题: {note.title[:50]}")
             return note
+        except NearDuplicateError:
+            raise
         except Exception as e:
             logger.error(f"保存笔记失败: {e}", exc_info=True)
             raise
 
+    @timed(STORAGE_STEP_LATENCY, 'local', 'dedup_lookup')
+    def _check_dedup(self, note: Note) -> Optional[str]:
+        """幂等：按小时分片的去重索引"""
+        try:
+            return self.dedup.get(note.dedup_key)
+        except Exception as e:
+            logger.error(f"读取去重索引失败: {note.dedup_key}, 错误: {e}", exc_info=True)
+            raise
+
+    @timed(STORAGE_STEP_LATENCY, 'local', 'near_dup_lookup')
+    def _check_near_dup(self, note: Note, near_dup_index: Optional[NearDupIndex]) -> Optional[Note]:
+        """近似重复：SimHash 指纹索引只比较分段相同的候选；link 模式返回已有笔记"""
+        if near_dup_index is None:
+            return None
+        return resolve_near_duplicate(note, near_dup_index.find(simhash(note.content)))
+
+    def _recheck_dedup(self, results: List[BatchItemResult], fresh: List[Tuple[int, Note]]) -> List[Tuple[int, Note]]:
+        """持锁后再查一次去重索引：计划阶段之后其他 worker 可能已保存相同内容"""
+        still: List[Tuple[int, Note]] = []
+        for i, note in fresh:
+            existing_id = self._check_dedup(note)
+            if existing_id:
+                results[i] = BatchItemResult(index=i, status="duplicate", note=note.model_copy(update={"id": existing_id}))
+            else:
+                still.append((i, note))
+        return still
+
+    def _open_indexes(self) -> Tuple[LocationIndex, RecentManifest, SearchIndex, Optional[VectorIndex],
+                                     Optional[NearDupIndex]]:
+        """持租户锁时先打开索引（首次使用时会从已有笔记重建，须在写入新文件之前）"""
+        return (self._location_index(True), self._recent_manifest(True), self._search_index(True),
+                self._vector_index(True), self._near_dup_index(True))
+
+    @timed(STORAGE_STEP_LATENCY, 'local', 'write_json')
+    def _write_json(self, note: Note):
+        p_json = self._path_for(note.id, note.saved_at)
+        try:
+            p_json.write_bytes(dump_note(note, self.note_format))
+            st = p_json.stat()
+            note_cache().put(self._cache_scope, note.id, (st.st_mtime_ns, st.st_size), note, st.st_size)
+            logger.debug("保存 JSON 文件: %s", p_json)
+        except Exception as e:
+            logger.error(f"保存 JSON 文件失败: {p_json}, 错误: {e}", exc_info=True)
+            raise
+
+    @timed(STORAGE_STEP_LATENCY, 'local', 'write_markdown')
+    def _write_md(self, note: Note, md: Optional[str] = None):
+        """写 Markdown（带前三轮上下文）"""
+        p_md = self._path_for_md(note.id, note.saved_at)
+        try:
+            p_md.write_text(md if md is not None else render_markdown(note), encoding='utf-8')
+            logger.debug("保存 Markdown 文件: %s", p_md)
+        except Exception as e:
+            logger.error(f"保存 Markdown 文件失败: {p_md}, 错误: {e}", exc_info=True)
+            raise
+
+    def _write_md_deferred(self, note: Note):
+        # 后台任务执行时笔记可能已被删除，不再写出孤立的 Markdown
+        if self._path_for(note.id, note.saved_at).exists():
+            self._write_md(note)
+
+    def _write_markdown(self, note: Note):
+        """按 markdown_mode 写入 Markdown：同步写、交给后台队列或留到首次读取"""
+        if self.markdown_mode == MARKDOWN_SYNC:
+            self._write_md(note)
+        elif self.markdown_mode != MARKDOWN_LAZY:
+            markdown_queue().submit(partial(self._write_md_deferred, note))
+
+    async def _awrite_files(self, note: Note):
+        if self.markdown_mode == MARKDOWN_SYNC:
+            await asyncio.gather(run_io(self._write_json, note), run_io(self._write_md, note))
+        else:
+            await run_io(self._write_json, note)
+            await run_io(self._write_markdown, note)
+
+    def _formats(self):
+        return ['json'] if self.markdown_mode == MARKDOWN_LAZY else ['json', 'md']
+
+    @timed(STORAGE_STEP_LATENCY, 'local', 'update_indexes')
+    def _update_indexes(self, notes: List[Note], loc_index: LocationIndex, manifest: RecentManifest,
+                        search_index: SearchIndex, vector_index: Optional[VectorIndex] = None,
+                        near_dup_index: Optional[NearDupIndex] = None):
+        """笔记文件写入后更新各索引（批量保存时每个索引只提交一次）"""
+        if not notes:
+            return
+        ids = ', '.join(n.id for n in notes[:3]) + (' ...' if len(notes) > 3 else '')
+        entries = [(n, n.saved_at.strftime('%Y/%m/%d')) for n in notes]
+
+        # 更新去重索引
+        try:
+            self.dedup.put_many([(n.dedup_key, n.id) for n in notes])
+            logger.debug("更新去重索引: %s", ids)
+        except Exception as e:
+            logger.error(f"更新去重索引失败: {ids}, 错误: {e}", exc_info=True)
+            raise
+
+        # 更新位置索引
+        try:
+            loc_index.put_many([(n.id, d, self._formats()) for n, d in entries])
+            logger.debug("更新位置索引: %s", ids)
+        except Exception as e:
+            logger.error(f"更新位置索引失败: {ids}, 错误: {e}", exc_info=True)
+            raise
+
+        # 追加最近笔记清单
+        try:
+            manifest.append_many([(n.id, d, n.saved_at) for n, d in entries])
+            logger.debug("追加最近笔记清单: %s", ids)
+        except Exception as e:
+            logger.error(f"追加最近笔记清单失败: {ids}, 错误: {e}", exc_info=True)
+            raise
+
+        # 更新倒排索引
+        try:
+            search_index.add_many([
+                (n.id, f"{d}/{n.id}.json", index_terms(self._haystack(n.model_dump()))) for n, d in entries
+            ])
+            logger.debug("更新倒排索引: %s", ids)
+        except Exception as e:
+            logger.error(f"更新倒排索引失败: {ids}, 错误: {e}", exc_info=True)
+            raise
+
+        # 更新向量索引
+        if vector_index is not None:
+            try:
+                emb = embedder()
+                vector_index.add_many([(n.id, emb.embed(note_text(n.model_dump()))) for n in notes])
+                logger.debug("更新向量索引: %s", ids)
+            except Exception as e:
+                logger.error(f"更新向量索引失败: {ids}, 错误: {e}", exc_info=True)
+                raise
+
+        # 更新指纹索引
+        if near_dup_index is not None:
+            try:
+                near_dup_index.add_many([(n.id, simhash(n.content), n.saved_at.isoformat()) for n in notes])
+                logger.debug("更新指纹索引: %s", ids)
+            except Exception as e:
+                logger.error(f"更新指纹索引失败: {ids}, 错误: {e}", exc_info=True)
+                raise
+
+    def save_many(self, note_ins: List[NoteIn], now: datetime) -> NoteBatchResult:
+        """批量保存：批内去重，写入全部文件后每个索引只提交一次"""
+        try:
+            results, fresh = plan_batch(note_ins, now, self.tenant, self._check_dedup, self._embedding_ref())
+            written: List[Note] = []
+            with self._tenant_lock:
+                fresh = self._recheck_dedup(results, fresh)
+                indexes = self._open_indexes()
+                if indexes[-1] is not None:
+                    fresh = screen_batch(indexes[-1], results, fresh)
+                for i, note in fresh:
+                    try:
+                        self._write_json(note)
+                        self._write_markdown(note)
+                        written.append(note)
+                    except Exception as e:
+                        results[i] = BatchItemResult(index=i, status="error", error=str(e))
+                self._update_indexes(written, *indexes)
+            logger.info(f"批量保存完成: 共 {len(note_ins)} 条, 新增 {len(written)} 条")
+            return batch_summary(results)
+        except Exception as e:
+            logger.error(f"批量保存失败: {e}", exc_info=True)
+            raise
+
+    async def asave_many(self, note_ins: List[NoteIn], now: datetime) -> NoteBatchResult:
+        """异步批量保存：所有文件并发写入"""
+        try:
+            results, fresh = await run_io(plan_batch, note_ins, now, self.tenant, self._check_dedup, self._embedding_ref())
+            written: List[Note] = []
+            async with self._tenant_lock.ahold():
+                fresh = await run_io(self._recheck_dedup, results, fresh)
+                indexes = await run_io(self._open_indexes)
+                if indexes[-1] is not None:
+                    fresh = await run_io(screen_batch, indexes[-1], results, fresh)
+                outcomes = await asyncio.gather(*[self._awrite_files(n) for _, n in fresh], return_exceptions=True)
+                for (i, note), outcome in zip(fresh, outcomes):
+                    if isinstance(outcome, Exception):
+                        results[i] = BatchItemResult(index=i, status="error", error=str(outcome))
+                    else:
+                        written.append(note)
+                await run_io(self._update_indexes, written, *indexes)
+            logger.info(f"批量保存完成: 共 {len(note_ins)} 条, 新增 {len(written)} 条")
+            return batch_summary(results)
+        except Exception as e:
+            logger.error(f"批量保存失败: {e}", exc_info=True)
+            raise
+
     def list_recent(self, limit: int = 5) -> List[Note]:
+        return self.list_page(limit)[0]
+
+    def list_page(self, limit: int = 5, cursor: Optional[str] = None,
+                  before: Optional[datetime] = None) -> Tuple[List[Note], Optional[str]]:
+        """
+        按时间倒序分页列出笔记
+
+        Args:
+            limit: 每页条数
+            cursor: 上一页返回的游标
+            before: 只返回早于该时间的笔记（与 cursor 二选一）
+
+        Returns:
+            (笔记列表, 下一页游标；没有更多时为 None)
+        """
         items: List[Note] = []
         try:
+            manifest = self._recent_manifest()
+            end = None
+            if cursor:
+                c = decode_cursor(cursor)
+                end = c.get('o')
+                if not isinstance(end, int) or end > manifest.size():
+                    # 清单被重建过，偏移失效，退回按时间定位
+                    if 't' not in c:
+                        raise ValueError(f"invalid cursor: {cursor}")
+                    end = manifest.offset_before(datetime.fromisoformat(c['t']))
+            elif before:
+                if before.tzinfo is None:
+                    before = before.replace(tzinfo=timezone.utc)
+                end = manifest.offset_before(before)
+
             tenant_dir = self.base_dir / self.tenant
-            for y in sorted([p for p in tenant_dir.glob('*') if p.is_dir() and p.name.isdigit()], reverse=True):
-                for m in sorted([p for p in y.glob('*') if p.is_dir()], reverse=True):
-                    for d in sorted([p for p in m.glob('*') if p.is_dir()], reverse=True):
-                        # 按文件修改时间排序，而不是文件名
-                        for f in sorted([p for p in d.glob('*.json')], key=lambda x: x.stat().st_mtime, reverse=True):
-                            try:
-                                data = json.loads(f.read_text(encoding='utf-8'))
-                                items.append(Note.model_validate(data))
-                                if len(items) >= limit:
-                                    return items
-                            except json.JSONDecodeError as e:
-                                logger.warning(f"JSON 解析失败: {f}, 错误: {e}")
-                                continue
-                            except Exception as e:
-                                logger.warning(f"读取笔记失败: {f}, 错误: {e}")
-                                continue
-            logger.debug(f"列出最近笔记: {len(items)} 条")
-            return items
+            last = None
+            for entry, offset in manifest.iter_backward(end):
+                f = tenant_dir / entry['path'] / f"{entry['id']}.json"
+                try:
+                    items.append(self._read_note(f))
+                except FileNotFoundError:
+                    continue  # 已删除
+                except Exception as e:
+                    logger.warning(f"读取笔记失败: {f}, 错误: {e}")
+                    continue
+                last = {"o": offset, "t": entry['t']}
+                if len(items) >= limit:
+                    break
+            next_cursor = encode_cursor(last) if last and len(items) >= limit and last['o'] > 0 else None
+            logger.debug("列出最近笔记: %s 条", len(items))
+            return items, next_cursor
+        except ValueError:
+            raise
         except Exception as e:
             logger.error(f"列出笔记失败: {e}", exc_info=True)
             raise
 
+    async def alist_page(self, limit: int = 5, cursor: Optional[str] = None,
+                         before: Optional[datetime] = None) -> Tuple[List[Note], Optional[str]]:
+        await self._aensure_indexes(('manifest', self._recent_manifest))
+        return await super().alist_page(limit, cursor, before)
+
     def search(self, q: str, limit: int = 10) -> List[Note]:
-        items: List[Note] = []
+        """搜索笔记，按相关度排序"""
+        return [note for note, _ in self.search_scored(q, limit)]
+
+    async def asearch(self, q: str, limit: int = 10) -> List[Note]:
+        await self._aensure_indexes(('search', self._search_index))
+        return await super().asearch(q, limit)
+
+    def search_scored(self, q: str, limit: int = 10) -> List[Tuple[Note, float]]:
+        """
+        BM25 排序搜索：倒排索引取候选集（新笔记在前，最多 MAX_CANDIDATES 篇），
+        读取候选笔记统计词频并打分，堆选出前 limit 篇；IDF 使用倒排索引中的文档频率
+        """
         try:
-            search_dir = self.base_dir / self.tenant
-            for f in search_dir.glob('**/*.json'):
+            search_index = self._search_index()
+            candidates = search_index.candidates(q)
+            if candidates is None:
+                logger.debug("查询无可索引词项，回退全量扫描: '%s'", q)
+                hits = rank_notes(q, self._search_scan(q, MAX_CANDIDATES), limit)
+                logger.debug("搜索完成: 查询 '%s', 返回 %s 条", q, len(hits))
+                return hits
+
+            ranker = BM25Ranker(q)
+            ranker.n_docs, ranker.df = search_index.doc_freqs(ranker.terms)
+            tenant_dir = self.base_dir / self.tenant
+
+            def docs():
+                for note_id, rel_path in candidates[:MAX_CANDIDATES]:
+                    f = tenant_dir / rel_path
+                    try:
+                        note = self._read_note(f)
+                    except FileNotFoundError:
+                        logger.warning(f"索引指向的笔记不存在: {f}")
+                        continue
+                    except Exception as e:
+                        logger.warning(f"搜索笔记失败: {f}, 错误: {e}")
+                        continue
+                    yield note, note_fields(note)
+
+            hits = ranker.rank(docs(), limit)
+            logger.debug("搜索完成: 查询 '%s', 候选 %s 条, 返回 %s 条", q, len(candidates), len(hits))
+            return hits
+        except Exception as e:
+            logger.error(f"搜索失败: {e}", exc_info=True)
+            raise
+
+    async def asearch_scored(self, q: str, limit: int = 10) -> List[Tuple[Note, float]]:
+        await self._aensure_indexes(('search', self._search_index))
+        return await super().asearch_scored(q, limit)
+
+    def similar_scored(self, q: str, limit: int = 10, exclude: Optional[str] = None) -> List[Tuple[Note, float]]:
+        """向量检索：整块向量矩阵算余弦相似度取前 limit 篇，只读取返回的笔记"""
+        try:
+            vector_index = self._vector_index()
+            if vector_index is None:
+                raise NotImplementedError("向量检索未启用（EMBEDDING_MODE=none 或未安装 numpy）")
+            hits = rank_similar(vector_index, embedder().embed(q), limit, self.get, exclude)
+            logger.debug("向量检索完成: 返回 %s 条", len(hits))
+            return hits
+        except NotImplementedError:
+            raise
+        except Exception as e:
+            logger.error(f"向量检索失败: {e}", exc_info=True)
+            raise
+
+    async def asimilar_scored(self, q: str, limit: int = 10, exclude: Optional[str] = None) -> List[Tuple[Note, float]]:
+        await self._aensure_indexes(('vector', self._vector_index), ('location', self._location_index))
+        return await super().asimilar_scored(q, limit, exclude)
+
+    def near_duplicates(self, limit: int = 100) -> NearDuplicateReport:
+        """近似重复聚类：只读指纹索引，不读取笔记文件；索引未变化时复用上次结果"""
+        try:
+            near_dup_index = self._near_dup_index()
+            if near_dup_index is None:
+                raise NotImplementedError("近似重复检测未启用（NEAR_DUP_MODE=off 或未安装 numpy）")
+            report = duplicate_report(near_dup_index, limit)
+            logger.debug("近似重复聚类完成: %s 组", len(report.groups))
+            return report
+        except NotImplementedError:
+            raise
+        except Exception as e:
+            logger.error(f"近似重复聚类失败: {e}", exc_info=True)
+            raise
+
+    async def anear_duplicates(self, limit: int = 100) -> NearDuplicateReport:
+        await self._aensure_indexes(('near_dup', self._near_dup_index))
+        return await super().anear_duplicates(limit)
+
+    def _search_scan(self, q: str, limit: int) -> List[Note]:
+        """全量扫描搜索（查询无法使用索引时的回退路径）"""
+        items: List[Note] = []
+        search_dir = self.base_dir / self.tenant
+        for f in search_dir.glob('[0-9]*/**/*.json'):
+            try:
+                note = self._read_note(f)
+                if q.lower() in self._note_haystack(note).lower():
+                    items.append(note)
+                    if len(items) >= limit:
+                        return items
+            except Exception as e:
+                logger.warning(f"搜索笔记失败: {f}, 错误: {e}")
+                continue
+        logger.debug("搜索完成: 查询 '%s', 找到 %s 条", q, len(items))
+        return items
+
+    def iter_notes(self, since: Optional[datetime] = None) -> Iterator[Note]:
+        """
+        按日期从旧到新遍历全部笔记（导出用）
+
+        逐个日期目录读取，内存中只保留一天的笔记；不经过笔记缓存。
+        since 只返回保存时间不早于它的笔记，更早的日期目录直接跳过。
+        """
+        tenant_dir = self.base_dir / self.tenant
+        since_day = None
+        if since:
+            if since.tzinfo is None:
+                since = since.replace(tzinfo=timezone.utc)
+            since_day = since.astimezone(timezone.utc).strftime('%Y/%m/%d')
+        for day_dir in sorted(tenant_dir.glob('[0-9][0-9][0-9][0-9]/[0-9][0-9]/[0-9][0-9]')):
+            if since_day and day_dir.relative_to(tenant_dir).as_posix() < since_day:
+                continue
+            notes: List[Note] = []
+            for f in day_dir.glob('*.json'):
                 try:
-                    data = json.loads(f.read_text(encoding='utf-8'))
-                    hay = (data.get('title','') + ' ' + data.get('content','')).lower()
-                    for m in (data.get('context_before') or []):
-                        hay += ' ' + (m.get('text','') if isinstance(m, dict) else '')
-                    if q.lower() in hay:
-                        items.append(Note.model_validate(data))
-                        if len(items) >= limit:
-                            return items
-                except json.JSONDecodeError as e:
-                    logger.warning(f"JSON 解析失败: {f}, 错误: {e}")
-                    continue
+                    note = load_note(f.read_bytes())
+                except FileNotFoundError:
+                    continue  # 已删除
                 except Exception as e:
-                    logger.warning(f"搜索笔记失败: {f}, 错误: {e}")
+                    logger.warning(f"导出时读取笔记失败: {f}, 错误: {e}")
                     continue
-            logger.debug(f"搜索完成: 查询 '{q}', 找到 {len(items)} 条")
-            return items
+                if since is None or note.saved_at >= since:
+                    notes.append(note)
+            notes.sort(key=lambda n: (n.saved_at, n.id))
+            yield from notes
+
+    def get(self, note_id: str) -> Optional[Note]:
+        """按 ID 读取笔记（位置索引单次查找）"""
+        note_id = sanitize_filename(note_id)
+        try:
+            loc = self._locate(note_id)
+            if loc is None:
+                logger.debug("笔记未找到: %s", note_id)
+                return None
+            f = loc[0] / f"{note_id}.json"
+            try:
+                return self._read_note(f)
+            except FileNotFoundError:
+                logger.warning(f"位置索引指向的笔记不存在: {f}")
+                return None
         except Exception as e:
-            logger.error(f"搜索失败: {e}", exc_info=True)
+            logger.error(f"读取笔记失败: {note_id}, 错误: {e}", exc_info=True)
             raise
 
-    def delete(self, note_id: str) -> bool:
-        """删除笔记，带安全检查"""
+    async def aget(self, note_id: str) -> Optional[Note]:
+        await self._aensure_indexes(('location', self._location_index))
+        return await super().aget(note_id)
+
+    def get_markdown(self, note_id: str) -> Optional[str]:
+        """读取笔记 Markdown；尚未生成时由 JSON 渲染并写入，之后直接读取文件"""
         note_id = sanitize_filename(note_id)
-        found = False
         try:
-            search_dir = self.base_dir / self.tenant
-            for f in search_dir.glob('**/*.json'):
-                if f.stem == note_id:
-                    found = True
-                    md = f.with_suffix('.md')
-                    try:
-                        f.unlink()
-                        logger.debug(f"删除 JSON 文件: {f}")
-                    except FileNotFoundError:
-                        logger.warning(f"JSON 文件不存在: {f}")
-                    except Exception as e:
-                        logger.error(f"删除 JSON 文件失败: {f}, 错误: {e}", exc_info=True)
-                    
+            loc = self._locate(note_id)
+            if loc is None:
+                return None
+            day_dir, formats = loc
+            try:
+                return (day_dir / f"{note_id}.md").read_text(encoding='utf-8')
+            except FileNotFoundError:
+                pass
+            try:
+                note = self._read_note(day_dir / f"{note_id}.json")
+            except FileNotFoundError:
+                logger.warning(f"位置索引指向的笔记不存在: {day_dir / note_id}.json")
+                return None
+            md = render_markdown(note)
+            try:
+                self._write_md(note, md)
+                # 只是缓存提示：租户锁被占用时不等待（本方法在 I/O 线程池中执行），下次读取再补记
+                if 'md' not in formats and self._tenant_lock.acquire(blocking=False):
                     try:
-                        md.unlink()
-                        logger.debug(f"删除 Markdown 文件: {md}")
-                    except FileNotFoundError:
-                        logger.warning(f"Markdown 文件不存在: {md}")
-                    except Exception as e:
-                        logger.error(f"删除 Markdown 文件失败: {md}, 错误: {e}", exc_info=True)
-            
-            if found:
-                logger.info(f"笔记删除成功: {note_id}")
-            else:
-                logger.warning(f"笔记未找到: {note_id}")
+                        self._location_index(True).put(note_id, note.saved_at.strftime('%Y/%m/%d'), [*formats, 'md'])
+                    finally:
+                        self._tenant_lock.release()
+            except Exception as e:
+                logger.warning(f"缓存 Markdown 文件失败: {note_id}, 错误: {e}")
+            return md
+        except Exception as e:
+            logger.error(f"读取 Markdown 失败: {note_id}, 错误: {e}", exc_info=True)
+            raise
+
+    async def aget_markdown(self, note_id: str) -> Optional[str]:
+        await self._aensure_indexes(('location', self._location_index))
+        return await super().aget_markdown(note_id)
+
+    def _delete_locked(self, note_id: str) -> bool:
+        """持租户锁时删除笔记文件并更新各索引"""
+        loc = self._locate(note_id, True)
+        if loc is None:
+            return False
+        day_dir, formats = loc
+        for ext in formats:
+            f = day_dir / f"{note_id}.{ext}"
+            try:
+                f.unlink()
+                logger.debug("删除文件: %s", f)
+            except FileNotFoundError:
+                logger.warning(f"文件不存在: {f}")
+            except Exception as e:
+                logger.error(f"删除文件失败: {f}, 错误: {e}", exc_info=True)
+        self._location_index(True).remove(note_id)
+        self._search_index(True).remove(note_id)
+        vector_index = self._vector_index(True)
+        if vector_index is not None:
+            vector_index.remove(note_id)
+        near_dup_index = self._near_dup_index(True)
+        if near_dup_index is not None:
+            near_dup_index.remove(note_id)
+        note_cache().invalidate(self._cache_scope, note_id)
+        return True
+
+    def delete(self, note_id: str) -> bool:
+        """删除笔记：通过位置索引直接定位文件"""
+        note_id = sanitize_filename(note_id)
+        try:
+            with self._tenant_lock:
+                found = self._delete_locked(note_id)
+            self._log_delete(note_id, found)
             return found
         except Exception as e:
             logger.error(f"删除笔记失败: {note_id}, 错误: {e}", exc_info=True)
             raise
+
+    async def adelete(self, note_id: str) -> bool:
+        """异步删除：与 asave 一样在事件循环上等租户锁，不占用 I/O 线程等待"""
+        note_id = sanitize_filename(note_id)
+        try:
+            async with self._tenant_lock.ahold():
+                found = await run_io(self._delete_locked, note_id)
+            self._log_delete(note_id, found)
+            return found
+        except Exception as e:
+            logger.error(f"删除笔记失败: {note_id}, 错误: {e}", exc_info=True)
+            raise
+
+    @staticmethod
+    def _log_delete(note_id: str, found: bool):
+        if found:
+            logger.info(f"笔记删除成功: {note_id}")
+        else:
+            logger.warning(f"笔记未找到: {note_id}")
@@ -0,0 +1,62 @@
+from __future__ import annotations
+from typing import Dict, Iterable, List, Optional, Tuple
+import logging
+from .journal import JournalIndex
+
+logger = logging.getLogger(__name__)
+
+class LocationIndex(JournalIndex):
+    """
+    笔记位置索引（本地存储）：笔记ID -> (日期路径, 已写入的格式)
+
+    持久化为 index/location_index.jsonl 追加日志：
+    - {"op": "add", "id": ..., "path": "YYYY/MM/DD", "formats": ["json", "md"]}
+    - {"op": "del", "id": ...}
+    """
+    FILENAME = 'location_index.jsonl'
+
+    def _clear(self):
+        self._locs: Dict[str, Tuple[str, Tuple[str, ...]]] = {}
+
+    def _size(self) -> int:
+        return len(self._locs)
+
+    def _apply(self, rec: dict):
+        note_id = rec.get('id')
+        if not note_id:
+            return
+        if self._locs.pop(note_id, None) is not None:
+            self._dead += 1
+        if rec.get('op') == 'add':
+            self._locs[note_id] = (rec.get('path', ''), tuple(rec.get('formats') or ()))
+        else:
+            self._dead += 1
+
+    def _live_records(self) -> List[dict]:
+        return [{"op": "add", "id": i, "path": p, "formats": list(f)} for i, (p, f) in self._locs.items()]
+
+    def get(self, note_id: str) -> Optional[Tuple[str, Tuple[str, ...]]]:
+        """查找笔记位置，返回 (日期路径, 格式列表)，不存在返回 None"""
+        with self._lock:
+            self._refresh()
+            return self._locs.get(note_id)
+
+    def put(self, note_id: str, date_path: str, formats: Iterable[str]):
+        self.put_many([(note_id, date_path, formats)])
+
+    def put_many(self, entries: Iterable[Tuple[str, str, Iterable[str]]]):
+        """批量记录位置：(id, 日期路径, 格式)，一次追加写入"""
+        self._commit([{"op": "add", "id": i, "path": p, "formats": list(f)} for i, p, f in entries])
+
+    def remove(self, note_id: str):
+        with self._lock:
+            self._refresh()
+            if note_id in self._locs:
+                self._commit([{"op": "del", "id": note_id}])
+
+    def rebuild(self, entries: Iterable[Tuple[str, str, Iterable[str]]]):
+        """用 (id, 日期路径, 格式) 全量重建索引文件"""
+        with self._lock:
+            records = [{"op": "add", "id": i, "path": p, "formats": list(f)} for i, p, f in entries]
+            self._rewrite(records)
+            logger.info(f"重建位置索引: {self.path}, 笔记数: {len(records)}")
@@ -0,0 +1,130 @@
+from __future__ import annotations
+from typing import Callable, List, Optional
+import queue
+import threading
+import logging
+from ..models import Note
+
+logger = logging.getLogger(__name__)
+
+# Markdown 写入模式
+MARKDOWN_SYNC = 'sync'              # 随 JSON 一起写入，保存返回时两个文件都已落盘
+MARKDOWN_BACKGROUND = 'background'  # JSON 写入后即返回，Markdown 交给后台队列
+MARKDOWN_LAZY = 'lazy'              # 保存时不写，首次 GET /notes/{id}.md 时渲染并写入
+MARKDOWN_MODES = (MARKDOWN_SYNC, MARKDOWN_BACKGROUND, MARKDOWN_LAZY)
+
+def render_markdown(note: Note) -> str:
+    """渲染笔记 Markdown（带前三轮上下文）"""
+    ctx_md = ''
+    if note.context_before:
+        ctx_lines = [f"- **{m['role'] if isinstance(m, dict) else m.role}**：{(m['text'] if isinstance(m, dict) else m.text)}" for m in note.context_before]
+        ctx_md = "\n\n### 上下文（前 3 轮）\n" + "\n".join(ctx_lines)
+    return f"# {note.title}\n- 时间：{note.saved_at.isoformat()}\n- 标签：{', '.join(note.tags) if note.tags else '-'}\n- 主题：{note.topic or '-'}\n- 来源：{(note.source and (note.source.thread_title or '')) or '-'}\n\n## 原文\n{note.content}{ctx_md}\n"
+
+class MarkdownQueue:
+    """
+    Markdown 后台写入队列
+
+    有界队列 + 少量工作线程。队列满时由提交方直接执行（背压，不丢任务）；
+    关闭时先等待队列清空再停止工作线程。
+    """
+
+    def __init__(self, maxsize: int = 1000, workers: int = 2):
+        self._q: "queue.Queue[Optional[Callable[[], None]]]" = queue.Queue(maxsize=max(1, maxsize))
+        self._workers = max(1, workers)
+        self._threads: List[threading.Thread] = []
+        self._lock = threading.Lock()
+        self.completed = 0
+        self.failed = 0
+        self.inline = 0
+
+    def _ensure_started(self):
+        with self._lock:
+            if self._threads:
+                return
+            for i in range(self._workers):
+                t = threading.Thread(target=self._run, name=f"clipnotes-md-{i}", daemon=True)
+                t.start()
+                self._threads.append(t)
+
+    def submit(self, job: Callable[[], None]):
+        """提交写入任务；队列已满时在当前线程执行"""
+        self._ensure_started()
+        try:
+            self._q.put_nowait(job)
+        except queue.Full:
+            self.inline += 1
+            logger.warning(f"Markdown 写入队列已满（{self._q.maxsize}），在请求线程中直接写入")
+            self._execute(job)
+
+    def _execute(self, job: Callable[[], None]):
+        try:
+            job()
+            self.completed += 1
+        except Exception as e:
+            self.failed += 1
+            logger.error(f"后台写入 Markdown 失败: {e}", exc_info=True)
+
+    def _run(self):
+        while True:
+            job = self._q.get()
+            try:
+                if job is None:
+                    return
+                self._execute(job)
+            finally:
+                self._q.task_done()
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """等待已提交的任务全部完成，超时返回 False"""
+        waiter = threading.Thread(target=self._q.join, daemon=True)
+        waiter.start()
+        waiter.join(timeout)
+        return not waiter.is_alive()
+
+    def shutdown(self, timeout: Optional[float] = None):
+        """清空队列后停止工作线程"""
+        with self._lock:
+            threads, self._threads = self._threads, []
+        if not threads:
+            return
+        if not self.flush(timeout):
+            logger.warning(f"关闭时 Markdown 写入队列未清空，剩余 {self._q.qsize()} 个任务")
+        for _ in threads:
+            try:
+                self._q.put_nowait(None)
+            except queue.Full:
+                break
+        logger.info(f"Markdown 写入队列已关闭: 完成 {self.completed}, 失败 {self.failed}")
+
+    def stats(self) -> dict:
+        return {
+            "pending": self._q.qsize(), "max_size": self._q.maxsize,
+            "completed": self.completed, "failed": self.failed, "inline": self.inline,
+        }
+
+_markdown_queue: Optional[MarkdownQueue] = None
+_markdown_queue_lock = threading.Lock()
+_markdown_queue_size = 1000
+
+def configure_markdown_queue(maxsize: int):
+    """设置 Markdown 后台队列长度（须在首次使用前调用）"""
+    global _markdown_queue_size
+    _markdown_queue_size = max(1, maxsize)
+
+def markdown_queue() -> MarkdownQueue:
+    """进程内共享的 Markdown 后台写入队列"""
+    global _markdown_queue
+    with _markdown_queue_lock:
+        if _markdown_queue is None:
+            _markdown_queue = MarkdownQueue(_markdown_queue_size)
+            logger.info(f"创建 Markdown 写入队列: max_size={_markdown_queue_size}")
+        return _markdown_queue
+
+def shutdown_markdown_queue(timeout: Optional[float] = None):
+    """关闭 Markdown 后台队列（先写完已排队的任务）"""
+    global _markdown_queue
+    with _markdown_queue_lock:
+        q, _markdown_queue = _markdown_queue, None
+    if q is not None:
+        q.shutdown(timeout)
@@ -0,0 +1,378 @@
+from __future__ import annotations
+from itertools import combinations, count
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+import threading
+import logging
+from ..embedding import ngram_hashes, normalize_text, np
+from ..models import BatchItemResult, NearDuplicateGroup, NearDuplicateMember, NearDuplicateReport, Note
+from .journal import JournalIndex
+
+logger = logging.getLogger(__name__)
+
+NEAR_DUP_OFF = 'off'
+NEAR_DUP_REJECT = 'reject'
+NEAR_DUP_LINK = 'link'
+NEAR_DUP_FLAG = 'flag'
+NEAR_DUP_MODES = (NEAR_DUP_OFF, NEAR_DUP_REJECT, NEAR_DUP_LINK, NEAR_DUP_FLAG)
+
+FINGERPRINT_BITS = 64
+# 指纹使用的字符 shingle 长度
+SHINGLE_CHARS = 3
+# 置换查找表的键至少 16 位：随机指纹每张表平均只有 N / 65536 个候选
+MIN_KEY_BITS = 16
+# 阈值上限：距离 6 需要 C(8, 2) = 28 张表；再大时表数成倍增长（距离 7 为 120 张），内存不划算
+MAX_DISTANCE_LIMIT = 6
+# 置换表之外尚未排序的新指纹超过该数（且超过已排序部分的 1/8）时，查询前重新排序
+REINDEX_MIN = 1024
+
+_POPCOUNT8 = np.array([bin(i).count('1') for i in range(256)], dtype=np.uint8) if np is not None else None
+
+class NearDuplicateError(Exception):
+    """NEAR_DUP_MODE=reject 时保存近似重复的内容"""
+
+    def __init__(self, note_id: str, distance: int):
+        super().__init__(f"near duplicate of {note_id} (distance {distance})")
+        self.note_id = note_id
+        self.distance = distance
+
+def simhash(text: str) -> int:
+    """
+    64 位 SimHash 指纹：文本小写、空白归一后取字符三元组，每个 shingle 的哈希按位投票
+
+    内容相同的笔记指纹相同；小幅修改只翻转少数位，汉明距离小即为近似重复。
+    """
+    text = normalize_text(text)
+    h = ngram_hashes(text, min(SHINGLE_CHARS, len(text))) if text else np.zeros(0, dtype=np.uint64)
+    if not len(h):
+        return 0
+    bits = (h[:, None] >> np.arange(FINGERPRINT_BITS, dtype=np.uint64)) & np.uint64(1)
+    votes = bits.sum(axis=0, dtype=np.int64) * 2 - len(h)
+    fp = 0
+    for i in np.flatnonzero(votes > 0):
+        fp |= 1 << int(i)
+    return fp
+
+def hamming(a: int, b: int) -> int:
+    return bin(a ^ b).count('1')
+
+def _popcount(x: 'np.ndarray') -> 'np.ndarray':
+    """uint64 数组逐元素的置位数"""
+    if hasattr(np, 'bitwise_count'):
+        return np.bitwise_count(x)
+    return _POPCOUNT8[np.ascontiguousarray(x).view(np.uint8)].reshape(-1, 8).sum(axis=1)
+
+def table_masks(max_distance: int) -> List[int]:
+    """
+    置换查找表的键掩码
+
+    64 位切成 max_distance + m 块，任取 m 块拼成一张表的键：距离不超过 max_distance 的两个指纹
+    至多有 max_distance 块不同，必有一张表的 m 块完全相同（抽屉原理）。
+    m 取使最窄的键也不少于 MIN_KEY_BITS 位的最小值。
+    """
+    m = 1
+    while True:
+        blocks = max_distance + m
+        width, extra = divmod(FINGERPRINT_BITS, blocks)
+        # 前 extra 块多一位，最窄的 m 块都在末尾
+        if width * m >= MIN_KEY_BITS or blocks == m:
+            break
+        m += 1
+    masks, shift = [], 0
+    for i in range(blocks):
+        w = width + (i < extra)
+        masks.append(((1 << w) - 1) << shift)
+        shift += w
+    return [sum(c) for c in combinations(masks, m)]
+
+class SimHashTable:
+    """
+    内存中的 SimHash 查找表（置换表，Manku 等人的做法）
+
+    指纹存放在连续的 uint64 数组中，每张置换表是按键（指纹 & 掩码）排序的数组；
+    查询对每张表做两次二分查找取出键相同的候选，再用 numpy 批量算汉明距离，
+    不扫描全部指纹。新增的指纹先追加在数组末尾，积累到一定数量后在查询前重新排序。
+    """
+
+    def __init__(self, max_distance: int):
+        self.max_distance = max(0, min(max_distance, MAX_DISTANCE_LIMIT))
+        self._masks = [np.uint64(m) for m in table_masks(self.max_distance)]
+        self._fps = np.zeros(64, dtype=np.uint64)
+        self._alive = np.zeros(64, dtype=bool)
+        self._ids: List[Optional[str]] = []
+        self._slots: Dict[str, int] = {}
+        self._tables: List[Tuple['np.ndarray', 'np.ndarray']] = []
+        self._indexed = 0  # 已进入置换表的槽位数
+
+    def __len__(self) -> int:
+        return len(self._slots)
+
+    def items(self) -> Iterator[Tuple[str, int]]:
+        """全部 (id, 指纹)"""
+        for note_id, slot in self._slots.items():
+            yield note_id, int(self._fps[slot])
+
+    def snapshot(self) -> Tuple[List[str], 'np.ndarray']:
+        """存活指纹的副本 (ids, 指纹数组)，供锁外聚类"""
+        slots = np.flatnonzero(self._alive[:len(self._ids)])
+        return [self._ids[s] for s in slots], self._fps[slots].copy()
+
+    def add(self, note_id: str, fp: int):
+        self.remove(note_id)
+        slot = len(self._ids)
+        if slot >= len(self._fps):
+            self._fps = np.concatenate([self._fps, np.zeros(len(self._fps), dtype=np.uint64)])
+            self._alive = np.concatenate([self._alive, np.zeros(len(self._alive), dtype=bool)])
+        self._fps[slot] = fp
+        self._alive[slot] = True
+        self._ids.append(note_id)
+        self._slots[note_id] = slot
+
+    def remove(self, note_id: str):
+        slot = self._slots.pop(note_id, None)
+        if slot is not None:
+            self._alive[slot] = False
+            self._ids[slot] = None
+
+    def _reindex(self):
+        n = len(self._ids)
+        fps = self._fps[:n]
+        self._tables = []
+        for mask in self._masks:
+            keys = fps & mask
+            order = np.argsort(keys, kind='stable')
+            self._tables.append((keys[order], order))
+        self._indexed = n
+
+    def matches(self, fp: int) -> List[Tuple[str, int]]:
+        """距离不超过 max_distance 的全部笔记 [(id, 距离)]"""
+        n = len(self._ids)
+        if not self._slots:
+            return []
+        if n - self._indexed > max(REINDEX_MIN, self._indexed // 8):
+            self._reindex()
+        q = np.uint64(fp)
+        parts = [np.arange(self._indexed, n)]
+        for mask, (keys, order) in zip(self._masks, self._tables):
+            key = q & mask
+            lo, hi = np.searchsorted(keys, key, 'left'), np.searchsorted(keys, key, 'right')
+            if hi > lo:
+                parts.append(order[lo:hi])
+        cand = np.unique(np.concatenate(parts))
+        cand = cand[self._alive[cand]]
+        dist = _popcount(self._fps[cand] ^ q)
+        keep = dist <= self.max_distance
+        return [(self._ids[s], int(d)) for s, d in zip(cand[keep], dist[keep])]
+
+    def find(self, fp: int) -> Optional[Tuple[str, int]]:
+        """距离最近的近似重复 (id, 距离)，没有时返回 None"""
+        best = None
+        for note_id, d in self.matches(fp):
+            if best is None or (d, note_id) < (best[1], best[0]):
+                best = (note_id, d)
+        return best
+
+def cluster_fingerprints(fps: 'np.ndarray', max_distance: int) -> 'np.ndarray':
+    """
+    把指纹按近似重复划分连通分量，返回每个指纹所属分量的代表下标
+
+    相同指纹先合并；每张置换表排序后只比较键相同的相邻区间，边的判定和分量合并都是 numpy 向量运算。
+    """
+    uniq, inverse = np.unique(fps, return_inverse=True)
+    edges_a, edges_b = [], []
+    for mask in table_masks(max_distance):
+        keys = uniq & np.uint64(mask)
+        order = np.argsort(keys, kind='stable')
+        keys = keys[order]
+        for off in range(1, len(keys)):
+            same = keys[:-off] == keys[off:]
+            if not same.any():
+                break
+            a, b = order[:-off][same], order[off:][same]
+            near = _popcount(uniq[a] ^ uniq[b]) <= max_distance
+            edges_a.append(a[near])
+            edges_b.append(b[near])
+    labels = np.arange(len(uniq))
+    if edges_a:
+        a, b = np.concatenate(edges_a), np.concatenate(edges_b)
+        while True:
+            low = np.minimum(labels[a], labels[b])
+            new = labels.copy()
+            np.minimum.at(new, a, low)
+            np.minimum.at(new, b, low)
+            new = new[new]
+            if np.array_equal(new, labels):
+                break
+            labels = new
+    return labels[inverse.reshape(-1)]
+
+_generations = count()
+
+class NearDupIndex(JournalIndex):
+    """
+    租户级 SimHash 指纹索引（local / segment 存储）
+
+    持久化为 simhash_index.jsonl 追加日志：
+    - {"op": "add", "id": ..., "fp": "<16 位十六进制>", "t": "<保存时间>"}
+    - {"op": "del", "id": ...}
+    内存中是置换查找表，保存时的查重只比较少量候选。
+    """
+    FILENAME = 'simhash_index.jsonl'
+
+    def _clear(self):
+        self._table = SimHashTable(near_dup_distance())
+        self._times: Dict[str, str] = {}
+        self._generation = next(_generations)
+        self._clusters_cache: Optional[Tuple[tuple, list]] = None
+
+    def _size(self) -> int:
+        return len(self._table)
+
+    def _apply(self, rec: dict):
+        note_id = rec.get('id')
+        if not note_id:
+            return
+        if note_id in self._times:
+            self._table.remove(note_id)
+            del self._times[note_id]
+            self._dead += 1
+        if rec.get('op') == 'add':
+            self._table.add(note_id, int(rec.get('fp', '0'), 16))
+            self._times[note_id] = rec.get('t', '')
+        else:
+            self._dead += 1
+
+    def _live_records(self) -> List[dict]:
+        return [{"op": "add", "id": i, "fp": f"{fp:016x}", "t": self._times.get(i, '')}
+                for i, fp in self._table.items()]
+
+    def find(self, fp: int) -> Optional[Tuple[str, int]]:
+        with self._lock:
+            self._refresh()
+            return self._table.find(fp)
+
+    def add_many(self, entries: Iterable[Tuple[str, int, str]]):
+        """批量写入指纹：(id, 指纹, 保存时间)"""
+        self._commit([{"op": "add", "id": i, "fp": f"{fp:016x}", "t": t} for i, fp, t in entries])
+
+    def remove(self, note_id: str):
+        with self._lock:
+            self._refresh()
+            if note_id in self._times:
+                self._commit([{"op": "del", "id": note_id}])
+
+    def rebuild(self, entries: Iterable[Tuple[str, int, str]]):
+        """用 (id, 指纹, 保存时间) 全量重建索引文件"""
+        with self._lock:
+            records = [{"op": "add", "id": i, "fp": f"{fp:016x}", "t": t} for i, fp, t in entries]
+            self._rewrite(records)
+            logger.info(f"重建近似重复索引: {self.path}, 笔记数: {len(records)}")
+
+    def clusters(self) -> List[List[Tuple[str, int]]]:
+        """
+        把已有笔记按近似重复聚类
+
+        持锁只复制指纹，聚类在锁外进行，不阻塞保存时的查重；结果按索引版本缓存，索引未变化时直接返回。
+
+        Returns:
+            每组 [(id, 与组内最早一篇的距离)]，按保存时间从旧到新，只返回两篇以上的组；组按大小降序
+        """
+        with self._lock:
+            self._refresh()
+            version = (self._generation, self._offset)
+            if self._clusters_cache is not None and self._clusters_cache[0] == version:
+                return self._clusters_cache[1]
+            ids, fps = self._table.snapshot()
+            times = [self._times.get(i, '') for i in ids]
+            max_distance = self._table.max_distance
+        labels = cluster_fingerprints(fps, max_distance) if ids else np.zeros(0, dtype=np.int64)
+        groups: Dict[int, List[int]] = {}
+        for k, label in enumerate(labels.tolist()):
+            groups.setdefault(label, []).append(k)
+        out = []
+        for members in groups.values():
+            if len(members) < 2:
+                continue
+            members.sort(key=lambda k: (times[k], ids[k]))
+            first = int(fps[members[0]])
+            out.append([(ids[k], hamming(first, int(fps[k]))) for k in members])
+        out.sort(key=lambda g: (-len(g), g[0][0]))
+        with self._lock:
+            if (self._generation, self._offset) == version:
+                self._clusters_cache = (version, out)
+        return out
+
+def duplicate_report(index: NearDupIndex, limit: int = 100) -> NearDuplicateReport:
+    """已有笔记的近似重复聚类报告（每组第一篇为最早保存的笔记；只返回最大的 limit 组）"""
+    groups = index.clusters()
+    return NearDuplicateReport(
+        groups=[NearDuplicateGroup(items=[NearDuplicateMember(id=i, distance=d) for i, d in g]) for g in groups[:limit]],
+        notes=len(index),
+        duplicates=sum(len(g) - 1 for g in groups),
+        total_groups=len(groups),
+    )
+
+def resolve_near_duplicate(note: Note, match: Optional[Tuple[str, int]]) -> Optional[Note]:
+    """
+    按 NEAR_DUP_MODE 处理近似重复（match 为 (已有笔记ID, 汉明距离)）
+
+    reject 抛出 NearDuplicateError；link 返回指向已有笔记的副本，调用方不再保存；
+    flag 在 note 上记录 near_duplicate_of 后返回 None，照常保存。
+    """
+    if match is None:
+        return None
+    note_id, distance = match
+    mode = near_dup_mode()
+    if mode == NEAR_DUP_REJECT:
+        raise NearDuplicateError(note_id, distance)
+    if mode == NEAR_DUP_LINK:
+        logger.info(f"检测到近似重复内容，返回已存在的笔记: {note_id}（距离 {distance}）")
+        return note.model_copy(update={"id": note_id, "near_duplicate_of": note_id})
+    note.near_duplicate_of = note_id
+    logger.info(f"检测到近似重复内容，保存并标记: {note.id} ≈ {note_id}（距离 {distance}）")
+    return None
+
+def screen_batch(index: NearDupIndex, results: List[BatchItemResult],
+                 fresh: List[Tuple[int, Note]]) -> List[Tuple[int, Note]]:
+    """批量保存的近似重复检查：与已有笔记及批内较早的笔记比较，返回仍需写入的条目"""
+    batch = SimHashTable(near_dup_distance())
+    still: List[Tuple[int, Note]] = []
+    for i, note in fresh:
+        fp = simhash(note.content)
+        match = index.find(fp) or batch.find(fp)
+        try:
+            linked = resolve_near_duplicate(note, match)
+        except NearDuplicateError as e:
+            results[i] = BatchItemResult(index=i, status="error", error=str(e))
+            continue
+        if linked is not None:
+            results[i] = BatchItemResult(index=i, status="duplicate", note=linked)
+            continue
+        batch.add(note.id, fp)
+        still.append((i, note))
+    return still
+
+_near_dup_mode = NEAR_DUP_FLAG
+_near_dup_distance = 6
+_near_dup_lock = threading.Lock()
+
+def configure_near_dup(mode: str, max_distance: int):
+    """设置近似重复处理方式与汉明距离阈值（须在首次使用前调用）；numpy 未安装时自动关闭"""
+    global _near_dup_mode, _near_dup_distance
+    mode = mode.lower()
+    if mode not in NEAR_DUP_MODES:
+        logger.warning(f"未知的 NEAR_DUP_MODE: {mode}，使用 {NEAR_DUP_OFF}")
+        mode = NEAR_DUP_OFF
+    if mode != NEAR_DUP_OFF and np is None:
+        logger.warning("未安装 numpy，近似重复检测已关闭（pip install numpy）")
+        mode = NEAR_DUP_OFF
+    if not 0 <= max_distance <= MAX_DISTANCE_LIMIT:
+        logger.warning(f"NEAR_DUP_DISTANCE 超出范围 0~{MAX_DISTANCE_LIMIT}: {max_distance}，已截断")
+    with _near_dup_lock:
+        _near_dup_mode = mode
+        _near_dup_distance = max(0, min(max_distance, MAX_DISTANCE_LIMIT))
+
+def near_dup_mode() -> str:
+    return _near_dup_mode if np is not None else NEAR_DUP_OFF
+
+def near_dup_distance() -> int:
+    return _near_dup_distance
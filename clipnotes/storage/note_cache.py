@@ -0,0 +1,96 @@
+from __future__ import annotations
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Optional, Tuple
+import threading
+import logging
+from ..models import Note
+
+logger = logging.getLogger(__name__)
+
+class NoteCache:
+    """
+    进程内已解析 Note 对象的读穿缓存，按占用字节数做 LRU 淘汰
+
+    键为 (存储范围, 笔记ID)，每条记录带一个校验值（本地为文件 mtime/大小，OSS 为 ETag），
+    读取时校验值不一致即视为未命中，因此其他进程的改写也不会读到旧内容。
+    save 写入后直接放入缓存，delete 时失效。
+    """
+
+    def __init__(self, max_bytes: int = 64 * 1024 * 1024):
+        self.max_bytes = max(0, max_bytes)
+        self._items: "OrderedDict[Tuple[str, str], Tuple[Hashable, Note, int]]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def peek(self, scope: str, note_id: str) -> Optional[Tuple[Hashable, Note]]:
+        """取出缓存记录 (校验值, 笔记)，不计入命中统计"""
+        with self._lock:
+            item = self._items.get((scope, note_id))
+            return (item[0], item[1]) if item else None
+
+    def get(self, scope: str, note_id: str, validator: Hashable) -> Optional[Note]:
+        """校验值一致时返回缓存的笔记"""
+        key = (scope, note_id)
+        with self._lock:
+            item = self._items.get(key)
+            if item is not None and item[0] == validator:
+                self._items.move_to_end(key)
+                self.hits += 1
+                return item[1]
+            self.misses += 1
+            return None
+
+    def put(self, scope: str, note_id: str, validator: Hashable, note: Note, size: int):
+        """放入缓存；size 为笔记序列化后的字节数，用于估算内存占用"""
+        if size > self.max_bytes:
+            return
+        key = (scope, note_id)
+        with self._lock:
+            old = self._items.pop(key, None)
+            if old is not None:
+                self._bytes -= old[2]
+            self._items[key] = (validator, note, size)
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                _, (_, _, evicted_size) = self._items.popitem(last=False)
+                self._bytes -= evicted_size
+                self.evictions += 1
+
+    def invalidate(self, scope: str, note_id: str):
+        with self._lock:
+            old = self._items.pop((scope, note_id), None)
+            if old is not None:
+                self._bytes -= old[2]
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+            self._bytes = 0
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "size": len(self._items), "bytes": self._bytes, "max_bytes": self.max_bytes,
+                "hits": self.hits, "misses": self.misses, "evictions": self.evictions,
+            }
+
+_note_cache: Optional[NoteCache] = None
+_note_cache_lock = threading.Lock()
+_note_cache_bytes = 64 * 1024 * 1024
+
+def configure_note_cache(max_bytes: int):
+    """设置笔记缓存容量（字节，须在首次使用前调用；0 表示不缓存）"""
+    global _note_cache_bytes
+    _note_cache_bytes = max(0, max_bytes)
+
+def note_cache() -> NoteCache:
+    """进程内共享的笔记缓存（本地与 OSS 后端共用）"""
+    global _note_cache
+    with _note_cache_lock:
+        if _note_cache is None:
+            _note_cache = NoteCache(_note_cache_bytes)
+            logger.info(f"创建笔记缓存: max_bytes={_note_cache_bytes}")
+        return _note_cache
@@ -0,0 +1,70 @@
+from __future__ import annotations
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Tuple
+import threading
+import logging
+
+logger = logging.getLogger(__name__)
+
+class StoragePool:
+    """
+    进程级存储后端实例池：按租户缓存，超过容量时淘汰最久未使用的实例
+
+    避免每个请求都重新创建后端（本地存储的 mkdir、OSS 的 Auth/Bucket 与连接）。
+    """
+
+    def __init__(self, factory: Callable[[str], Any], max_size: int = 256):
+        self._factory = factory
+        self.max_size = max(1, max_size)
+        self._items: "OrderedDict[str, Any]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, tenant: str) -> Any:
+        """获取租户的后端实例，不存在时创建"""
+        with self._lock:
+            store = self._items.get(tenant)
+            if store is not None:
+                self._items.move_to_end(tenant)
+                self.hits += 1
+                return store
+            self.misses += 1
+
+        # 在锁外创建，避免慢初始化阻塞其他租户
+        store = self._factory(tenant)
+        with self._lock:
+            existing = self._items.get(tenant)
+            if existing is not None:
+                self._items.move_to_end(tenant)
+                return existing
+            self._items[tenant] = store
+            while len(self._items) > self.max_size:
+                evicted, _ = self._items.popitem(last=False)
+                self.evictions += 1
+                logger.debug("存储实例池淘汰租户: %s", evicted)
+            return store
+
+    def items(self) -> List[Tuple[str, Any]]:
+        """当前池中的 (租户, 实例) 快照"""
+        with self._lock:
+            return list(self._items.items())
+
+    def invalidate(self, tenant: str):
+        with self._lock:
+            self._items.pop(tenant, None)
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "size": len(self._items),
+                "max_size": self.max_size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
@@ -0,0 +1,129 @@
+from __future__ import annotations
+from typing import Dict, Iterable, List, Optional, Tuple, TypeVar
+import heapq
+import math
+import re
+from ..models import Note
+from ..utils import query_terms
+
+_CJK_RUN = re.compile(r'[\u4e00-\u9fff]+')
+
+T = TypeVar('T')
+
+# BM25F 参数：字段权重（标题、标签高于正文）与长度归一化
+FIELD_WEIGHTS = {'title': 3.0, 'tags': 2.0, 'body': 1.0}
+K1 = 1.2
+B = 0.75
+PHRASE_BOOST = 1.5       # 完整查询串连续出现时的加成
+MAX_CANDIDATES = 2000    # 单次查询最多打分的候选数（按新笔记优先截断）
+
+SNIPPET_CHARS = 160
+HIGHLIGHT = ('**', '**')
+
+def note_fields(note: Note) -> Dict[str, str]:
+    """笔记的可搜索字段（小写）：标题、标签、正文（内容 + 上下文）"""
+    body = note.content
+    for m in (note.context_before or []):
+        body += ' ' + (m['text'] if isinstance(m, dict) else m.text)
+    return {'title': note.title.lower(), 'tags': ' '.join(note.tags).lower(), 'body': body.lower()}
+
+class BM25Ranker:
+    """
+    BM25F 排序：标题、标签、正文三个字段，按字段权重与长度归一化合并词频后打分
+
+    查询词项与倒排索引一致（中文二元组 + 英文/数字片段），词频按子串出现次数统计，
+    因此英文片段可以命中词的一部分。所有词项都出现才算命中（与倒排索引候选集的 AND 语义一致）。
+    文档频率可由倒排索引提供；未提供时按参与打分的候选集统计。
+    """
+
+    def __init__(self, q: str, n_docs: Optional[int] = None, df: Optional[Dict[str, int]] = None):
+        self.phrase = (q or '').lower().strip()
+        cjk, words = query_terms(q)
+        self.terms: List[str] = sorted(cjk) + list(dict.fromkeys(words)) or ([self.phrase] if self.phrase else [])
+        self.n_docs = n_docs
+        self.df = df
+
+    def _stats(self, fields: Dict[str, str]) -> Optional[Tuple[Dict[str, List[int]], Dict[str, int], bool]]:
+        """单篇文档的 (各字段词频, 各字段长度, 是否含完整短语)；有词项未出现时返回 None"""
+        tf = {f: [text.count(t) for t in self.terms] for f, text in fields.items()}
+        if not all(any(tf[f][i] for f in tf) for i in range(len(self.terms))):
+            return None
+        lens = {f: len(text) for f, text in fields.items()}
+        return tf, lens, any(self.phrase in text for text in fields.values())
+
+    def rank(self, docs: Iterable[Tuple[T, Dict[str, str]]], limit: int) -> List[Tuple[T, float]]:
+        """
+        对 (对象, 字段) 序列打分，返回得分最高的 limit 个 (对象, 得分)
+
+        先单遍统计词频和长度（不保留字段文本），再按平均长度打分，用堆选出前 limit 个；
+        得分相同时保持输入顺序（调用方按新笔记在前传入）。
+        """
+        if not self.terms:
+            return []
+        matched: List[Tuple[T, Dict[str, List[int]], Dict[str, int], bool]] = []
+        for obj, fields in docs:
+            st = self._stats(fields)
+            if st is not None:
+                matched.append((obj, *st))
+        if not matched:
+            return []
+
+        n = len(matched)
+        avg = {f: max(1.0, sum(m[2][f] for m in matched) / n) for f in FIELD_WEIGHTS}
+        n_docs = max(self.n_docs or 0, n)
+        idf = []
+        for i, t in enumerate(self.terms):
+            df = self.df.get(t) if self.df is not None else None
+            if df is None:
+                df = sum(1 for m in matched if any(m[1][f][i] for f in m[1]))
+            idf.append(math.log(1 + (n_docs - df + 0.5) / (df + 0.5)))
+
+        def score(m) -> float:
+            _, tf, lens, phrase = m
+            s = 0.0
+            for i in range(len(self.terms)):
+                w = 0.0
+                for f, weight in FIELD_WEIGHTS.items():
+                    c = tf[f][i]
+                    if c:
+                        w += weight * c / (1 - B + B * lens[f] / avg[f])
+                s += idf[i] * w / (K1 + w)
+            return s * PHRASE_BOOST if phrase else s
+
+        top = heapq.nlargest(limit, ((score(m), -order, m[0]) for order, m in enumerate(matched)),
+                             key=lambda x: (x[0], x[1]))
+        return [(obj, round(s, 4)) for s, _, obj in top]
+
+def rank_notes(q: str, notes: Iterable[Note], limit: int, n_docs: Optional[int] = None,
+               df: Optional[Dict[str, int]] = None) -> List[Tuple[Note, float]]:
+    """对笔记按 BM25F 打分排序，返回前 limit 个 (笔记, 得分)"""
+    return BM25Ranker(q, n_docs, df).rank(((n, note_fields(n)) for n in notes), limit)
+
+def make_snippet(note: Note, q: str, width: int = SNIPPET_CHARS) -> str:
+    """
+    生成高亮摘要：取正文中查询首次出现处前后约 width 个字符，查询词用 HIGHLIGHT 包围
+
+    正文未命中（只命中标题或标签）时取正文开头。
+    """
+    text = note.content
+    for m in (note.context_before or []):
+        text += '\n' + (m['text'] if isinstance(m, dict) else m.text)
+    lower = text.lower()
+    phrase = (q or '').lower().strip()
+    cjk, words = query_terms(q)
+    runs = _CJK_RUN.findall(phrase)
+    needles = sorted({t for t in [phrase, *runs, *words, *cjk] if t}, key=len, reverse=True)
+
+    pos = -1
+    for t in needles:
+        pos = lower.find(t)
+        if pos >= 0:
+            break
+    start = max(0, pos - width // 3) if pos >= 0 else 0
+    end = min(len(text), start + width)
+    snippet = text[start:end].replace('\n', ' ')
+    if needles:
+        pattern = re.compile('|'.join(re.escape(t) for t in needles), re.IGNORECASE)
+        snippet = pattern.sub(lambda m: f"{HIGHLIGHT[0]}{m.group(0)}{HIGHLIGHT[1]}", snippet)
+        snippet = snippet.replace(HIGHLIGHT[1] + HIGHLIGHT[0], '')
+    return ('…' if start > 0 else '') + snippet + ('…' if end < len(text) else '')
@@ -0,0 +1,128 @@
+from __future__ import annotations
+from pathlib import Path
+from typing import Iterable, Iterator, Optional, Tuple
+from datetime import datetime
+import json
+import os
+import logging
+
+logger = logging.getLogger(__name__)
+
+class RecentManifest:
+    """
+    按时间排序的最近笔记清单（本地存储）
+
+    index/recent_manifest.jsonl 只追加，每行 {"id": ..., "path": "YYYY/MM/DD", "t": saved_at}。
+    "最近 N 条" 只需从文件尾部倒序读取；分页游标就是行的字节偏移，
+    因此每一页的代价都与第一页相同。已删除的笔记不回写清单，读取时跳过即可。
+    """
+    FILENAME = 'recent_manifest.jsonl'
+    BLOCK_SIZE = 64 * 1024
+
+    def __init__(self, index_dir: Path):
+        self.path = index_dir / self.FILENAME
+
+    def exists(self) -> bool:
+        return self.path.exists()
+
+    def size(self) -> int:
+        try:
+            return self.path.stat().st_size
+        except FileNotFoundError:
+            return 0
+
+    def append(self, note_id: str, date_path: str, saved_at: datetime):
+        self.append_many([(note_id, date_path, saved_at)])
+
+    def append_many(self, entries: Iterable[Tuple[str, str, datetime]]):
+        """批量追加 (id, 日期路径, 保存时间)，一次写入"""
+        data = ''.join(
+            json.dumps({"id": i, "path": p, "t": t.isoformat()}, ensure_ascii=False) + '\n'
+            for i, p, t in sorted(entries, key=lambda e: e[2])
+        )
+        with open(self.path, 'ab') as f:
+            f.write(data.encode('utf-8'))
+
+    def rebuild(self, entries: Iterable[Tuple[str, str, datetime]]):
+        """用 (id, 日期路径, 保存时间) 全量重建清单，按时间升序写入"""
+        rows = sorted(entries, key=lambda e: e[2])
+        tmp = self.path.with_name(self.path.name + '.tmp')
+        tmp.write_text(''.join(
+            json.dumps({"id": i, "path": p, "t": t.isoformat()}, ensure_ascii=False) + '\n' for i, p, t in rows
+        ), encoding='utf-8')
+        os.replace(tmp, self.path)
+        logger.info(f"重建最近笔记清单: {self.path}, 笔记数: {len(rows)}")
+
+    def iter_backward(self, end: Optional[int] = None) -> Iterator[Tuple[dict, int]]:
+        """
+        从 end（字节偏移，不含；默认文件末尾）向前倒序遍历清单
+
+        Yields:
+            (清单记录, 该行起始偏移)
+        """
+        try:
+            f = open(self.path, 'rb')
+        except FileNotFoundError:
+            return
+        with f:
+            f.seek(0, os.SEEK_END)
+            pos = f.tell() if end is None else min(end, f.tell())
+            tail = b''
+            while pos > 0:
+                start = max(0, pos - self.BLOCK_SIZE)
+                f.seek(start)
+                data = f.read(pos - start) + tail
+                lines = data.split(b'\n')
+                if start > 0:
+                    # 块首可能是半行，留到下一块拼接
+                    tail = lines.pop(0)
+                    offset = start + len(tail) + 1
+                else:
+                    tail = b''
+                    offset = 0
+                starts = []
+                for ln in lines:
+                    starts.append(offset)
+                    offset += len(ln) + 1
+                for ln, o in zip(reversed(lines), reversed(starts)):
+                    if not ln.strip():
+                        continue
+                    try:
+                        yield json.loads(ln), o
+                    except json.JSONDecodeError:
+                        logger.debug("跳过不完整的清单记录: %s@%s", self.path, o)
+                pos = start
+
+    def offset_before(self, ts: datetime) -> int:
+        """二分查找第一条 t >= ts 的行起始偏移（之前的行都早于 ts）"""
+        try:
+            f = open(self.path, 'rb')
+        except FileNotFoundError:
+            return 0
+        with f:
+            f.seek(0, os.SEEK_END)
+            size = f.tell()
+
+            def line_start(p: int) -> int:
+                if p == 0:
+                    return 0
+                f.seek(p - 1)
+                f.readline()
+                return f.tell()
+
+            def not_before(q: int) -> bool:
+                f.seek(q)
+                try:
+                    return datetime.fromisoformat(json.loads(f.readline())['t']) >= ts
+                except (json.JSONDecodeError, KeyError, ValueError):
+                    return True
+
+            lo, hi = 0, size
+            while lo < hi:
+                mid = (lo + hi) // 2
+                q = line_start(mid)
+                if q >= size or not_before(q):
+                    hi = mid
+                else:
+                    lo = q + 1
+            return line_start(lo)
@@ -0,0 +1,135 @@
+from __future__ import annotations
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+import logging
+from ..utils import query_terms
+from .journal import JournalIndex
+
+logger = logging.getLogger(__name__)
+
+class SearchIndex(JournalIndex):
+    """
+    租户级倒排索引（本地存储）
+
+    持久化为 index/search_index.jsonl 追加日志，每行一条记录：
+    - {"op": "add", "id": ..., "path": "YYYY/MM/DD/<id>.json", "terms": [...]}
+    - {"op": "del", "id": ...}
+
+    内存中维护 词项 -> 笔记ID 的倒排表，save/delete/search 都是增量的。
+    """
+    FILENAME = 'search_index.jsonl'
+
+    def _clear(self):
+        self._postings: Dict[str, Set[str]] = {}
+        self._docs: Dict[str, Tuple[str, Tuple[str, ...]]] = {}
+        self._words: Set[str] = set()
+
+    def _size(self) -> int:
+        return len(self._docs)
+
+    def _apply(self, rec: dict):
+        note_id = rec.get('id')
+        if not note_id:
+            return
+        if note_id in self._docs:
+            self._unlink(note_id)
+            self._dead += 1
+        if rec.get('op') == 'add':
+            terms = tuple(rec.get('terms') or ())
+            self._docs[note_id] = (rec.get('path', ''), terms)
+            for t in terms:
+                self._postings.setdefault(t, set()).add(note_id)
+                if t.isascii():
+                    self._words.add(t)
+        else:
+            self._dead += 1
+
+    def _unlink(self, note_id: str):
+        _, terms = self._docs.pop(note_id)
+        for t in terms:
+            ids = self._postings.get(t)
+            if ids is None:
+                continue
+            ids.discard(note_id)
+            if not ids:
+                del self._postings[t]
+                self._words.discard(t)
+
+    def _live_records(self) -> List[dict]:
+        return [{"op": "add", "id": i, "path": p, "terms": list(t)} for i, (p, t) in self._docs.items()]
+
+    # ---- 写入 ----
+
+    def add(self, note_id: str, rel_path: str, terms: Iterable[str]):
+        """新增或覆盖一篇笔记的索引"""
+        self.add_many([(note_id, rel_path, terms)])
+
+    def add_many(self, entries: Iterable[Tuple[str, str, Iterable[str]]]):
+        """批量新增索引：(id, 相对路径, 词项)，一次追加写入"""
+        self._commit([{"op": "add", "id": i, "path": p, "terms": sorted(t)} for i, p, t in entries])
+
+    def remove(self, note_id: str):
+        """删除一篇笔记的索引"""
+        with self._lock:
+            self._refresh()
+            if note_id in self._docs:
+                self._commit([{"op": "del", "id": note_id}])
+
+    def rebuild(self, entries: Iterable[Tuple[str, str, Iterable[str]]]):
+        """用 (id, 相对路径, 词项) 全量重建索引文件"""
+        with self._lock:
+            records = [{"op": "add", "id": i, "path": p, "terms": sorted(t)} for i, p, t in entries]
+            self._rewrite(records)
+            logger.info(f"重建倒排索引: {self.path}, 笔记数: {len(records)}")
+
+    # ---- 查询 ----
+
+    def candidates(self, q: str) -> Optional[List[Tuple[str, str]]]:
+        """
+        返回可能命中查询的 (笔记ID, 相对路径)，按路径倒序（新笔记在前）
+
+        中文片段按二元组求交；英文片段在词表中做子串匹配后求并再求交。
+        候选集是命中结果的超集，调用方需读取笔记做最终校验。
+        查询中没有可索引的词项时返回 None，调用方应回退到全量扫描。
+        """
+        cjk, words = query_terms(q)
+        if not cjk and not words:
+            return None
+        with self._lock:
+            self._refresh()
+            result: Optional[Set[str]] = None
+            for t in sorted(cjk, key=lambda t: len(self._postings.get(t, ()))):
+                ids = self._postings.get(t, set())
+                result = set(ids) if result is None else result & ids
+                if not result:
+                    return []
+            for w in words:
+                ids = set(self._postings.get(w, ()))
+                for term in self._words:
+                    if w in term:
+                        ids |= self._postings[term]
+                result = ids if result is None else result & ids
+                if not result:
+                    return []
+            hits = [(i, self._docs[i][0]) for i in (result or ()) if i in self._docs]
+        hits.sort(key=lambda x: x[1], reverse=True)
+        return hits
+
+    def doc_freqs(self, terms: Iterable[str]) -> Tuple[int, Dict[str, int]]:
+        """
+        返回 (笔记总数, 各词项的文档频率)，供 BM25 计算 IDF
+
+        英文片段与 candidates 一致：在词表中做子串匹配，按命中笔记的并集计数。
+        """
+        with self._lock:
+            self._refresh()
+            df: Dict[str, int] = {}
+            for t in terms:
+                if not t.isascii():
+                    df[t] = len(self._postings.get(t, ()))
+                    continue
+                ids = set(self._postings.get(t, ()))
+                for term in self._words:
+                    if t in term:
+                        ids |= self._postings[term]
+                df[t] = len(ids)
+            return len(self._docs), df
@@ -0,0 +1,874 @@
+from __future__ import annotations
+from bisect import bisect_left, bisect_right
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Set, Tuple
+from datetime import datetime, timedelta, timezone
+import json
+import os
+import struct
+import threading
+import zlib
+import logging
+from ..models import Note, NoteIn, BatchItemResult, NoteBatchResult, NearDuplicateReport
+from ..utils import sanitize_filename, sanitize_tenant, index_terms, time_key, encode_cursor, decode_cursor
+from ..embedding import embedder, note_text
+from .base import AsyncStorageMixin, build_note, plan_batch, batch_summary
+from .search_index import SearchIndex
+from .markdown import render_markdown
+from .tenant_lock import TenantLock
+from .ranking import BM25Ranker, MAX_CANDIDATES, note_fields, rank_notes
+from .vector_index import VectorIndex, rank_similar
+from .near_dup import (NEAR_DUP_OFF, NearDupIndex, NearDuplicateError, duplicate_report, near_dup_mode,
+                       resolve_near_duplicate, screen_batch, simhash)
+
+logger = logging.getLogger(__name__)
+
+# 帧格式：<长度 u32><crc32 u32><JSON 负载>
+_FRAME = struct.Struct('<II')
+
+# (段号, 帧起始偏移, 帧总长度)
+Loc = Tuple[int, int, int]
+
+def _frame(rec: dict) -> bytes:
+    payload = json.dumps(rec, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+    return _FRAME.pack(len(payload), zlib.crc32(payload)) + payload
+
+_compactor: Optional[ThreadPoolExecutor] = None
+_compactor_lock = threading.Lock()
+
+class SegmentLockedError(RuntimeError):
+    """段存储目录被其他进程占用（段存储只支持单进程写入）"""
+
+# 等待其他进程释放目录锁的秒数上限：滚动重启时旧进程仍在退出
+SEGMENT_LOCK_TIMEOUT = 10.0
+
+def claim_data_dir(base_dir: str, timeout: float = SEGMENT_LOCK_TIMEOUT) -> TenantLock:
+    """
+    启动时独占段存储的数据目录（DATA_DIR/.segment.lock），进程退出时由系统释放
+
+    段日志在内存中维护偏移索引，不支持多个进程同时写同一目录；
+    多 worker 部署时后启动的进程在这里直接失败，而不是每个请求都返回 500。
+    """
+    lock = TenantLock.open(Path(base_dir) / '.segment.lock')
+    if not lock.acquire(timeout=timeout):
+        raise SegmentLockedError(
+            f"段存储只支持单进程，数据目录已被其他进程占用: {base_dir}（请使用单个 uvicorn worker）")
+    return lock
+
+def _compaction_executor() -> ThreadPoolExecutor:
+    """段压缩在单个后台线程中串行执行"""
+    global _compactor
+    with _compactor_lock:
+        if _compactor is None:
+            _compactor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='clipnotes-compact')
+        return _compactor
+
+class SegmentLog:
+    """
+    租户级只追加段日志
+
+    笔记以帧的形式追加到 segments/<段号>.seg，写满 max_bytes 后封存并开新段；
+    封存时把该段的偏移索引写到 <段号>.idx，启动时只需扫描活动段。
+    内存中维护 笔记ID -> (段号, 偏移, 长度) 的偏移索引、追加顺序和去重键。
+
+    - 删除：追加墓碑记录 {"op": "del"}，旧帧计入所在段的死字节
+    - 持久化：并发写入方共享一次 fsync（组提交），由先到者代表所有已写入的帧执行
+    - 压缩：封存段的死字节超过一半时，后台线程只保留存活帧重写该段（段号不变，顺序不变）
+
+    同一数据目录只能由一个进程写入（目录锁保证，打开时最多等待 SEGMENT_LOCK_TIMEOUT 秒），进程内按路径共享实例。
+    """
+    SUFFIX = '.seg'
+    COMPACT_RATIO = 0.5
+    DEDUP_WINDOW_MINUTES = 60
+
+    _instances: Dict[Path, 'SegmentLog'] = {}
+    _instances_lock = threading.Lock()
+
+    @classmethod
+    def open(cls, seg_dir: Path, max_bytes: int, fsync: bool) -> 'SegmentLog':
+        """获取（进程内共享的）段日志实例"""
+        path = seg_dir.resolve()
+        with cls._instances_lock:
+            inst = cls._instances.get(path)
+            if inst is None:
+                inst = cls._instances[path] = cls(path, max_bytes, fsync)
+            return inst
+
+    def __init__(self, seg_dir: Path, max_bytes: int, fsync: bool):
+        self.dir = seg_dir
+        self.dir.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max(1024, max_bytes)
+        self.fsync = fsync
+        self._lock = threading.RLock()
+        self._lock_file = self._acquire_dir_lock()
+
+        self._index: Dict[str, Loc] = {}
+        self._dedup: Dict[str, str] = {}
+        self._order: List[Tuple[str, str]] = []   # (时间, ID)，按时间排序
+        self._pos: Dict[str, int] = {}            # ID -> 在 _order 中的位置
+        self._order_version = 0                   # 位置整体变化（重建、插入到中间）时递增
+        self._sizes: Dict[int, int] = {}
+        self._dead: Dict[int, int] = {}
+        self._readers: Dict[int, object] = {}
+        self._compacting: Set[int] = set()
+        self._active_records: list = []
+        self._dedup_inserts = 0
+
+        # 组提交
+        self._sync_cond = threading.Condition()
+        self._written = 0
+        self._synced = 0
+        self._syncing = False
+
+        self._load()
+        self._active = max(self._sizes) if self._sizes else 1
+        self._writer = open(self._seg_path(self._active), 'ab', buffering=0)
+        self._sizes.setdefault(self._active, 0)
+        self._dead.setdefault(self._active, 0)
+        for seg in self._sealed():
+            self._maybe_schedule_compaction(seg)
+
+    # ---- 文件布局 ----
+
+    def _seg_path(self, seg: int) -> Path:
+        return self.dir / f"{seg:08d}{self.SUFFIX}"
+
+    def _idx_path(self, seg: int) -> Path:
+        return self.dir / f"{seg:08d}.idx"
+
+    def _sealed(self) -> List[int]:
+        return sorted(s for s in self._sizes if s != self._active)
+
+    def _acquire_dir_lock(self) -> TenantLock:
+        """持有目录锁直到进程退出；其他进程占用时等待其释放（如滚动重启），超时抛出 SegmentLockedError"""
+        lock = TenantLock.open(self.dir / 'LOCK')
+        if not lock.acquire(timeout=SEGMENT_LOCK_TIMEOUT):
+            raise SegmentLockedError(f"段存储目录已被其他进程占用: {self.dir}")
+        return lock
+
+    # ---- 加载与重放 ----
+
+    def _scan(self, seg: int) -> Iterator[Tuple[dict, int, int]]:
+        """顺序读取段内的帧，遇到不完整或校验失败的尾部即停止"""
+        path = self._seg_path(seg)
+        with open(path, 'rb') as f:
+            data = f.read()
+        off = 0
+        while off + _FRAME.size <= len(data):
+            length, crc = _FRAME.unpack_from(data, off)
+            end = off + _FRAME.size + length
+            payload = data[off + _FRAME.size:end]
+            if end > len(data) or zlib.crc32(payload) != crc:
+                logger.warning(f"段尾部不完整，截断: {path}@{off}")
+                break
+            yield json.loads(payload), off, end - off
+            off = end
+
+    def _load(self):
+        segs = sorted(int(p.stem) for p in self.dir.glob(f'*{self.SUFFIX}'))
+        for i, seg in enumerate(segs):
+            size = self._seg_path(seg).stat().st_size
+            self._sizes[seg] = size
+            self._dead[seg] = 0
+            records = self._load_idx(seg, size) if i < len(segs) - 1 else None
+            if records is None:
+                records = []
+                if i == len(segs) - 1:
+                    self._active_records = records
+                valid = 0
+                for rec, off, length in self._scan(seg):
+                    records.append(self._idx_record(rec, off, length))
+                    valid = off + length
+                if valid < size:
+                    # 活动段的尾部是崩溃时写了一半的帧，截掉后继续追加
+                    with open(self._seg_path(seg), 'r+b') as f:
+                        f.truncate(valid)
+                    self._sizes[seg] = valid
+            for r in records:
+                self._replay(seg, r)
+        self._rebuild_order()
+        logger.info(f"加载段存储: {self.dir}, 段数 {len(segs)}, 笔记数 {len(self._index)}")
+
+    @staticmethod
+    def _idx_record(rec: dict, off: int, length: int) -> list:
+        if rec.get('op') == 'put':
+            note = rec['note']
+            return ['p', note['id'], off, length, time_key(datetime.fromisoformat(note['saved_at'])), note.get('dedup_key')]
+        return ['d', rec.get('id'), off, length]
+
+    def _load_idx(self, seg: int, size: int) -> Optional[list]:
+        try:
+            data = json.loads(self._idx_path(seg).read_text(encoding='utf-8'))
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+        return data['records'] if data.get('size') == size else None
+
+    def _write_idx(self, seg: int, records: list, size: int):
+        tmp = self._idx_path(seg).with_suffix('.idx.tmp')
+        tmp.write_text(json.dumps({"size": size, "records": records}, ensure_ascii=False, separators=(',', ':')),
+                       encoding='utf-8')
+        os.replace(tmp, self._idx_path(seg))
+
+    def _replay(self, seg: int, r: list):
+        kind, note_id, off, length = r[0], r[1], r[2], r[3]
+        old = self._index.pop(note_id, None)
+        if old is not None:
+            self._dead[old[0]] = self._dead.get(old[0], 0) + old[2]
+        if kind == 'p':
+            self._index[note_id] = (seg, off, length)
+            self._order.append((r[4], note_id))
+            if r[5] and self._dedup_minute(r[5]) >= self._dedup_cutoff():
+                self._dedup[r[5]] = note_id
+
+    # dedup_key 形如 <hash>@YYYYmmddHHMM，只会与同一分钟内保存的内容重复，内存中只保留最近一段时间的键
+    @staticmethod
+    def _dedup_minute(key: str) -> str:
+        return key.rsplit('@', 1)[-1]
+
+    def _dedup_cutoff(self) -> str:
+        return (datetime.now(timezone.utc) - timedelta(minutes=self.DEDUP_WINDOW_MINUTES)).strftime('%Y%m%d%H%M')
+
+    def _prune_dedup(self):
+        cutoff = self._dedup_cutoff()
+        self._dedup = {k: v for k, v in self._dedup.items() if self._dedup_minute(k) >= cutoff}
+
+    def _rebuild_order(self):
+        """重建列表顺序：去掉已删除和被覆盖的条目，按 (时间, ID) 排序（旧数据可能不是按时间追加的）"""
+        seen: Dict[str, int] = {}
+        for i, (_, note_id) in enumerate(self._order):
+            seen[note_id] = i
+        self._order = sorted(e for i, e in enumerate(self._order) if e[1] in self._index and seen[e[1]] == i)
+        self._pos = {note_id: i for i, (_, note_id) in enumerate(self._order)}
+        self._order_version += 1
+
+    def _insert_order(self, entry: Tuple[str, str]):
+        """
+        在锁内登记一条笔记的列表位置
+
+        保存时间在进入写锁之前取得，并发写入的追加顺序可能比时间顺序稍晚；
+        这时插入到时间顺序的位置并顺移其后的条目（通常只有几条），保证 _order 始终有序。
+        """
+        order = self._order
+        if not order or entry >= order[-1]:
+            self._pos[entry[1]] = len(order)
+            order.append(entry)
+            return
+        i = bisect_right(order, entry)
+        order.insert(i, entry)
+        for j in range(i + 1, len(order)):
+            note_id = order[j][1]
+            if self._pos.get(note_id) == j - 1:
+                self._pos[note_id] = j
+        self._pos[entry[1]] = i
+        self._order_version += 1
+
+    # ---- 写入 ----
+
+    def _write_frames(self, recs: List[dict]) -> List[Loc]:
+        """在锁内追加记录，返回每帧的位置"""
+        if self._sizes[self._active] >= self.max_bytes:
+            self._roll()
+        frames = [_frame(r) for r in recs]
+        locs = []
+        off = self._sizes[self._active]
+        for rec, fr in zip(recs, frames):
+            locs.append((self._active, off, len(fr)))
+            self._active_records.append(self._idx_record(rec, off, len(fr)))
+            off += len(fr)
+        self._writer.write(b''.join(frames))
+        self._sizes[self._active] = off
+        self._written += 1
+        return locs
+
+    def _roll(self):
+        """封存活动段：落盘、写偏移索引，然后开新段"""
+        seg = self._active
+        # 旧段在切换前落盘，组提交只需 fsync 当前活动段
+        os.fsync(self._writer.fileno())
+        self._write_idx(seg, self._active_records, self._sizes[seg])
+        self._active_records = []
+        self._active = seg + 1
+        # 旧的写句柄不主动关闭：正在执行组提交的线程可能还持有它
+        self._writer = open(self._seg_path(self._active), 'ab', buffering=0)
+        self._sizes[self._active] = 0
+        self._dead[self._active] = 0
+        logger.info(f"封存段: {self._seg_path(seg)}, 大小 {self._sizes[seg]}")
+        self._maybe_schedule_compaction(seg)
+
+    def _wait_durable(self, ticket: int):
+        """组提交：等待 ticket 之前的写入落盘，没有进行中的 fsync 时由当前线程代表大家执行"""
+        if not self.fsync:
+            return
+        with self._sync_cond:
+            while self._synced < ticket:
+                if self._syncing:
+                    self._sync_cond.wait()
+                    continue
+                self._syncing = True
+                # 先读序号再读写句柄（不取 self._lock，避免与 _roll 交叉加锁）：
+                # 序号之前的写入要么在当前活动段，要么在切换前已落盘的旧段
+                target = self._written
+                writer = self._writer
+                self._sync_cond.release()
+                try:
+                    os.fsync(writer.fileno())
+                finally:
+                    self._sync_cond.acquire()
+                    self._syncing = False
+                    self._synced = max(self._synced, target)
+                    self._sync_cond.notify_all()
+
+    def put_many(self, notes: List[Note]) -> List[Optional[str]]:
+        """
+        追加笔记并等待落盘
+
+        查重与写入在同一把锁内完成，并发保存相同内容不会写出两份。
+
+        Returns:
+            与 notes 一一对应：已存在的重复笔记ID，写入成功为 None
+        """
+        with self._lock:
+            existing: List[Optional[str]] = []
+            fresh: List[Note] = []
+            for n in notes:
+                dup = self._dedup.get(n.dedup_key)
+                existing.append(dup)
+                if dup is None:
+                    fresh.append(n)
+                    self._dedup[n.dedup_key] = n.id
+            if not fresh:
+                return existing
+            try:
+                locs = self._write_frames([{"op": "put", "note": n.model_dump(mode='json')} for n in fresh])
+            except Exception:
+                for n in fresh:
+                    self._dedup.pop(n.dedup_key, None)
+                raise
+            self._dedup_inserts += len(fresh)
+            if self._dedup_inserts >= 1000:
+                self._dedup_inserts = 0
+                self._prune_dedup()
+            for n, loc in zip(fresh, locs):
+                old = self._index.get(n.id)
+                if old is not None:
+                    self._dead[old[0]] += old[2]
+                self._index[n.id] = loc
+                self._insert_order((time_key(n.saved_at), n.id))
+            ticket = self._written
+        self._wait_durable(ticket)
+        return existing
+
+    def delete(self, note_id: str) -> bool:
+        """追加墓碑并从偏移索引中移除"""
+        with self._lock:
+            loc = self._index.get(note_id)
+            if loc is None:
+                return False
+            self._write_frames([{"op": "del", "id": note_id}])
+            del self._index[note_id]
+            self._dead[loc[0]] += loc[2]
+            if len(self._order) > max(1000, 2 * len(self._index)):
+                self._rebuild_order()
+            ticket = self._written
+        self._wait_durable(ticket)
+        self._maybe_schedule_compaction(loc[0])
+        return True
+
+    # ---- 读取 ----
+
+    def _reader(self, seg: int):
+        f = self._readers.get(seg)
+        if f is None:
+            f = self._readers[seg] = open(self._seg_path(seg), 'rb')
+        return f
+
+    def _read_at(self, note_id: str) -> Optional[dict]:
+        with self._lock:
+            loc = self._index.get(note_id)
+            if loc is None:
+                return None
+            f = self._reader(loc[0])
+        # 持有文件对象的引用：即使该段随后被压缩替换，读到的仍是旧文件中的完整帧
+        data = os.pread(f.fileno(), loc[2], loc[1])
+        length, crc = _FRAME.unpack_from(data, 0)
+        payload = data[_FRAME.size:_FRAME.size + length]
+        if zlib.crc32(payload) != crc:
+            raise IOError(f"段数据校验失败: {self._seg_path(loc[0])}@{loc[1]}")
+        return json.loads(payload)['note']
+
+    def get(self, note_id: str) -> Optional[Note]:
+        data = self._read_at(note_id)
+        return Note.model_validate(data) if data is not None else None
+
+    def find_dedup(self, dedup_key: str) -> Optional[str]:
+        """去重窗口内与 dedup_key 相同的笔记ID"""
+        return self._dedup.get(dedup_key)
+
+    def __len__(self) -> int:
+        return len(self._index)
+
+    def stats(self) -> Dict[str, int]:
+        """存活笔记数、段数与段文件总字节数"""
+        with self._lock:
+            return {"notes": len(self._index), "segments": len(self._sizes),
+                    "segment_bytes": sum(self._sizes.values())}
+
+    def iter_backward(self, end: Optional[int] = None) -> Iterator[Tuple[int, str, str]]:
+        """从位置 end（不含）向前遍历存活笔记，产出 (位置, 时间, ID)；顺序重建或插入后从上一条之前继续"""
+        with self._lock:
+            version = self._order_version
+            pos = len(self._order) if end is None else min(end, len(self._order))
+            top = self._order[pos - 1] if pos > 0 else None
+        last: Optional[Tuple[str, str]] = None
+        while True:
+            with self._lock:
+                if version != self._order_version:
+                    version = self._order_version
+                    if last is not None:
+                        pos = bisect_left(self._order, last)
+                    elif top is not None:
+                        pos = bisect_right(self._order, top)
+                if pos <= 0:
+                    return
+                pos -= 1
+                t, note_id = self._order[pos]
+                alive = self._pos.get(note_id) == pos
+            last = (t, note_id)
+            if alive:
+                yield pos, t, note_id
+
+    def iter_forward(self, start: int = 0) -> Iterator[Tuple[int, str, str]]:
+        """从位置 start 起向后遍历存活笔记，产出 (位置, 时间, ID)；顺序重建或插入后从上一条之后继续"""
+        with self._lock:
+            version = self._order_version
+            pos = max(0, start)
+            prev = self._order[pos - 1] if 0 < pos <= len(self._order) else None
+        last: Optional[Tuple[str, str]] = None
+        while True:
+            with self._lock:
+                if version != self._order_version:
+                    version = self._order_version
+                    if last is not None:
+                        pos = bisect_right(self._order, last)
+                    elif prev is not None:
+                        pos = bisect_right(self._order, prev)
+                if pos >= len(self._order):
+                    return
+                t, note_id = self._order[pos]
+                alive = self._pos.get(note_id) == pos
+            last = (t, note_id)
+            if alive:
+                yield pos, t, note_id
+            pos += 1
+
+    def resolve_position(self, pos: Optional[int], note_id: Optional[str], t: Optional[str]) -> int:
+        """把游标还原为 _order 中的位置：优先按 ID，顺序被重建过则按时间二分"""
+        with self._lock:
+            if note_id in self._pos:
+                return self._pos[note_id]
+            if isinstance(pos, int) and 0 <= pos < len(self._order) and self._order[pos][1] == note_id:
+                return pos
+            return bisect_left(self._order, (t or '',))
+
+    def position_before(self, ts: datetime) -> int:
+        """第一条保存时间不早于 ts 的位置（_order 按时间排序）"""
+        with self._lock:
+            return bisect_left(self._order, (time_key(ts),))
+
+    def live_entries(self) -> List[Tuple[str, str]]:
+        """(ID, 时间)，按时间顺序"""
+        with self._lock:
+            return [(note_id, t) for t, note_id in self._order if self._index.get(note_id) is not None]
+
+    # ---- 压缩 ----
+
+    def _maybe_schedule_compaction(self, seg: int):
+        with self._lock:
+            if seg == self._active or seg in self._compacting:
+                return
+            size = self._sizes.get(seg, 0)
+            if size == 0 or self._dead.get(seg, 0) < size * self.COMPACT_RATIO:
+                return
+            self._compacting.add(seg)
+        _compaction_executor().submit(self._compact_safely, seg)
+
+    def _compact_safely(self, seg: int):
+        try:
+            self.compact(seg)
+        except Exception as e:
+            logger.error(f"段压缩失败: {self._seg_path(seg)}, 错误: {e}", exc_info=True)
+        finally:
+            with self._lock:
+                self._compacting.discard(seg)
+        # 压缩期间又有删除落在该段时，再检查一次
+        self._maybe_schedule_compaction(seg)
+
+    def compact(self, seg: int):
+        """重写封存段，只保留存活帧；更早的段都已不存在时，墓碑也一并丢弃"""
+        with self._lock:
+            if seg == self._active or seg not in self._sizes:
+                return
+            keep_tombstones = any(s < seg for s in self._sizes)
+        # 封存段只会被压缩线程修改，可以在锁外读取
+        kept: List[Tuple[bytes, list, Loc]] = []
+        for rec, off, length in self._scan(seg):
+            if rec.get('op') == 'put':
+                note_id = rec['note']['id']
+                with self._lock:
+                    if self._index.get(note_id) != (seg, off, length):
+                        continue
+            elif not keep_tombstones:
+                continue
+            kept.append((_frame(rec), self._idx_record(rec, off, length), (seg, off, length)))
+
+        path = self._seg_path(seg)
+        tmp = path.with_suffix('.seg.tmp')
+        records, moves, new_off = [], [], 0
+        with open(tmp, 'wb') as f:
+            for fr, r, old in kept:
+                r[2] = new_off
+                records.append(r)
+                if r[0] == 'p':
+                    moves.append((r[1], old, (seg, new_off, len(fr))))
+                f.write(fr)
+                new_off += len(fr)
+            f.flush()
+            os.fsync(f.fileno())
+
+        with self._lock:
+            before = self._sizes[seg]
+            if not records:
+                # 整段都是死数据：直接删除（段号不复用，新段号总是更大）
+                tmp.unlink()
+                path.unlink()
+                self._idx_path(seg).unlink(missing_ok=True)
+                del self._sizes[seg], self._dead[seg]
+                self._readers.pop(seg, None)
+                logger.info(f"删除空段: {path}, 回收 {before} 字节")
+                return
+            os.replace(tmp, path)
+            self._write_idx(seg, records, new_off)
+            for note_id, old, new in moves:
+                # 压缩期间被删除或覆盖的笔记保持不变（墓碑在更新的段里）
+                if self._index.get(note_id) == old:
+                    self._index[note_id] = new
+            dead = sum(new[2] for note_id, _, new in moves if self._index.get(note_id) != new)
+            self._sizes[seg] = new_off
+            self._dead[seg] = dead
+            self._readers.pop(seg, None)
+        logger.info(f"压缩段: {path}, {before} -> {new_off} 字节")
+
+class SegmentStorage(AsyncStorageMixin):
+    """
+    段存储后端：笔记追加到租户级段文件，不再每篇笔记两个小文件
+
+    目录布局：<data_dir>/<tenant>/segments/ 下的 <段号>.seg / <段号>.idx，
+    以及倒排索引 search_index.jsonl、向量索引 vector_index.jsonl、指纹索引 simhash_index.jsonl。Markdown 不落盘，读取时渲染。
+    """
+
+    def __init__(self, base_dir: str, tenant: str, max_segment_bytes: int = 64 * 1024 * 1024, fsync: bool = True):
+        self.base_dir = Path(base_dir).resolve()
+        self.tenant = sanitize_tenant(tenant)
+        try:
+            self.seg_dir = self.base_dir / self.tenant / 'segments'
+            self.log = SegmentLog.open(self.seg_dir, max_segment_bytes, fsync)
+            logger.info(f"初始化段存储: {self.seg_dir}")
+        except Exception as e:
+            logger.error(f"初始化段存储失败: {e}", exc_info=True)
+            raise
+
+    @staticmethod
+    def _haystack(data: dict) -> str:
+        """搜索文本：标题 + 正文 + 上下文"""
+        hay = data.get('title', '') + ' ' + data.get('content', '')
+        for m in (data.get('context_before') or []):
+            hay += ' ' + (m.get('text', '') if isinstance(m, dict) else '')
+        return hay
+
+    def _search_index(self) -> SearchIndex:
+        """获取倒排索引，首次使用时从段中的笔记重建；路径字段存放保存时间，用于按新旧排序"""
+        idx = SearchIndex.open(self.seg_dir)
+        if not idx.exists():
+            entries = []
+            for note_id, t in self.log.live_entries():
+                data = self.log._read_at(note_id)
+                if data is not None:
+                    entries.append((note_id, t, index_terms(self._haystack(data))))
+            idx.rebuild(entries)
+        return idx
+
+    def _vector_index(self) -> Optional[VectorIndex]:
+        """获取向量索引（未启用向量化时为 None），首次使用或维度变化时从段中的笔记重建"""
+        emb = embedder()
+        if emb is None:
+            return None
+        idx = VectorIndex.open(self.seg_dir)
+        if not idx.exists() or idx.dimension() != emb.dim:
+            def entries():
+                for note_id, _ in self.log.live_entries():
+                    data = self.log._read_at(note_id)
+                    if data is not None:
+                        yield note_id, emb.embed(note_text(data))
+            idx.rebuild(emb.dim, entries())
+        return idx
+
+    def _near_dup_index(self) -> Optional[NearDupIndex]:
+        """获取 SimHash 指纹索引（NEAR_DUP_MODE=off 时为 None），首次使用时从段中的笔记重建"""
+        if near_dup_mode() == NEAR_DUP_OFF:
+            return None
+        idx = NearDupIndex.open(self.seg_dir)
+        if not idx.exists():
+            def entries():
+                for note_id, _ in self.log.live_entries():
+                    data = self.log._read_at(note_id)
+                    if data is not None:
+                        yield note_id, simhash(data.get('content', '')), data.get('saved_at', '')
+            idx.rebuild(entries())
+        return idx
+
+    def _embedding_ref(self) -> Optional[dict]:
+        emb = embedder()
+        return emb.ref if emb is not None else None
+
+    def _check_dedup(self, note: Note) -> Optional[str]:
+        return self.log.find_dedup(note.dedup_key)
+
+    def _index_notes(self, search_index: SearchIndex, notes: List[Note]):
+        try:
+            search_index.add_many([
+                (n.id, time_key(n.saved_at), index_terms(self._haystack(n.model_dump()))) for n in notes
+            ])
+        except Exception as e:
+            logger.error(f"更新倒排索引失败: {e}", exc_info=True)
+            raise
+        vector_index = self._vector_index()
+        if vector_index is not None and notes:
+            try:
+                emb = embedder()
+                vector_index.add_many([(n.id, emb.embed(note_text(n.model_dump()))) for n in notes])
+            except Exception as e:
+                logger.error(f"更新向量索引失败: {e}", exc_info=True)
+                raise
+        near_dup_index = self._near_dup_index()
+        if near_dup_index is not None and notes:
+            try:
+                near_dup_index.add_many([(n.id, simhash(n.content), n.saved_at.isoformat()) for n in notes])
+            except Exception as e:
+                logger.error(f"更新指纹索引失败: {e}", exc_info=True)
+                raise
+
+    def save(self, note_in: NoteIn, now: datetime, suggested_id: Optional[str] = None) -> Note:
+        try:
+            note = build_note(note_in, now, self.tenant, suggested_id, embedding=self._embedding_ref())
+            search_index = self._search_index()
+            # 完全相同的内容仍按幂等返回已有笔记，之后才做近似重复检查
+            near_dup_index = self._near_dup_index()
+            if near_dup_index is not None and not self._check_dedup(note):
+                linked = resolve_near_duplicate(note, near_dup_index.find(simhash(note.content)))
+                if linked is not None:
+                    return linked
+            existing_id = self.log.put_many([note])[0]
+            if existing_id:
+                logger.info(f"检测到重复内容，返回已存在的笔记: {existing_id}")
+                return note.model_copy(update={"id": existing_id})
+            self._index_notes(search_index, [note])
+            logger.info(f"笔记保存成功: {note.id}, 标题: {note.title[:50]}")
+            return note
+        except NearDuplicateError:
+            raise
+        except Exception as e:
+            logger.error(f"保存笔记失败: {e}", exc_info=True)
+            raise
+
+    def save_many(self, note_ins: List[NoteIn], now: datetime) -> NoteBatchResult:
+        """批量保存：整批一次追加、一次 fsync"""
+        try:
+            results, fresh = plan_batch(note_ins, now, self.tenant, self._check_dedup, self._embedding_ref())
+            search_index = self._search_index()
+            near_dup_index = self._near_dup_index()
+            if near_dup_index is not None:
+                fresh = screen_batch(near_dup_index, results, fresh)
+            existing = self.log.put_many([n for _, n in fresh])
+            written: List[Note] = []
+            for (i, note), existing_id in zip(fresh, existing):
+                if existing_id:
+                    results[i] = BatchItemResult(index=i, status="duplicate", note=note.model_copy(update={"id": existing_id}))
+                else:
+                    written.append(note)
+            self._index_notes(search_index, written)
+            logger.info(f"批量保存完成: 共 {len(note_ins)} 条, 新增 {len(written)} 条")
+            return batch_summary(results)
+        except Exception as e:
+            logger.error(f"批量保存失败: {e}", exc_info=True)
+            raise
+
+    def list_recent(self, limit: int = 5) -> List[Note]:
+        return self.list_page(limit)[0]
+
+    def list_page(self, limit: int = 5, cursor: Optional[str] = None,
+                  before: Optional[datetime] = None) -> Tuple[List[Note], Optional[str]]:
+        """按保存顺序倒序分页列出笔记；游标记录上一页最后一条的位置、ID 和时间"""
+        items: List[Note] = []
+        try:
+            end = None
+            if cursor:
+                c = decode_cursor(cursor)
+                if 'i' not in c and 't' not in c:
+                    raise ValueError(f"invalid cursor: {cursor}")
+                end = self.log.resolve_position(c.get('p'), c.get('i'), c.get('t'))
+            elif before:
+                if before.tzinfo is None:
+                    before = before.replace(tzinfo=timezone.utc)
+                end = self.log.position_before(before)
+
+            last = None
+            for pos, t, note_id in self.log.iter_backward(end):
+                note = self.log.get(note_id)
+                if note is None:
+                    continue
+                items.append(note)
+                last = {"p": pos, "i": note_id, "t": t}
+                if len(items) >= limit:
+                    break
+            next_cursor = encode_cursor(last) if last and len(items) >= limit and last['p'] > 0 else None
+            logger.debug("列出最近笔记: %s 条", len(items))
+            return items, next_cursor
+        except ValueError:
+            raise
+        except Exception as e:
+            logger.error(f"列出笔记失败: {e}", exc_info=True)
+            raise
+
+    def iter_notes(self, since: Optional[datetime] = None) -> Iterator[Note]:
+        """按保存顺序遍历全部笔记（导出用），since 只返回保存时间不早于它的笔记"""
+        if since and since.tzinfo is None:
+            since = since.replace(tzinfo=timezone.utc)
+        start = self.log.position_before(since) if since else 0
+        for _, _, note_id in self.log.iter_forward(start):
+            note = self.log.get(note_id)
+            if note is not None and (since is None or note.saved_at >= since):
+                yield note
+
+    def search(self, q: str, limit: int = 10) -> List[Note]:
+        """搜索笔记：倒排索引取候选集，再读取候选笔记做子串校验"""
+        try:
+            candidates = self._search_index().candidates(q)
+            if candidates is None:
+                candidates = [(note_id, t) for _, t, note_id in self.log.iter_backward()]
+            items: List[Note] = []
+            for note_id, _ in candidates:
+                data = self.log._read_at(note_id)
+                if data is None:
+                    continue
+                if q.lower() in self._haystack(data).lower():
+                    items.append(Note.model_validate(data))
+                    if len(items) >= limit:
+                        break
+            logger.debug("搜索完成: 查询 '%s', 候选 %s 条, 找到 %s 条", q, len(candidates), len(items))
+            return items
+        except Exception as e:
+            logger.error(f"搜索失败: {e}", exc_info=True)
+            raise
+
+    def search_scored(self, q: str, limit: int = 10) -> List[Tuple[Note, float]]:
+        """
+        BM25 排序搜索：倒排索引取候选集（新笔记在前，最多 MAX_CANDIDATES 篇），
+        按偏移读取候选笔记统计词频并打分，堆选出前 limit 篇；IDF 使用倒排索引中的文档频率
+        """
+        try:
+            search_index = self._search_index()
+            candidates = search_index.candidates(q)
+            if candidates is None:
+                logger.debug("查询无可索引词项，回退全量扫描: '%s'", q)
+                hits = rank_notes(q, self.search(q, MAX_CANDIDATES), limit)
+                logger.debug("搜索完成: 查询 '%s', 返回 %s 条", q, len(hits))
+                return hits
+
+            ranker = BM25Ranker(q)
+            ranker.n_docs, ranker.df = search_index.doc_freqs(ranker.terms)
+
+            def docs():
+                for note_id, _ in candidates[:MAX_CANDIDATES]:
+                    note = self.log.get(note_id)
+                    if note is not None:
+                        yield note, note_fields(note)
+
+            hits = ranker.rank(docs(), limit)
+            logger.debug("搜索完成: 查询 '%s', 候选 %s 条, 返回 %s 条", q, len(candidates), len(hits))
+            return hits
+        except Exception as e:
+            logger.error(f"搜索失败: {e}", exc_info=True)
+            raise
+
+    def similar_scored(self, q: str, limit: int = 10, exclude: Optional[str] = None) -> List[Tuple[Note, float]]:
+        """向量检索：整块向量矩阵算余弦相似度取前 limit 篇"""
+        try:
+            vector_index = self._vector_index()
+            if vector_index is None:
+                raise NotImplementedError("向量检索未启用（EMBEDDING_MODE=none 或未安装 numpy）")
+            hits = rank_similar(vector_index, embedder().embed(q), limit, self.log.get, exclude)
+            logger.debug("向量检索完成: 返回 %s 条", len(hits))
+            return hits
+        except NotImplementedError:
+            raise
+        except Exception as e:
+            logger.error(f"向量检索失败: {e}", exc_info=True)
+            raise
+
+    def near_duplicates(self, limit: int = 100) -> NearDuplicateReport:
+        """近似重复聚类：只读指纹索引；索引未变化时复用上次结果"""
+        try:
+            near_dup_index = self._near_dup_index()
+            if near_dup_index is None:
+                raise NotImplementedError("近似重复检测未启用（NEAR_DUP_MODE=off 或未安装 numpy）")
+            report = duplicate_report(near_dup_index, limit)
+            logger.debug("近似重复聚类完成: %s 组", len(report.groups))
+            return report
+        except NotImplementedError:
+            raise
+        except Exception as e:
+            logger.error(f"近似重复聚类失败: {e}", exc_info=True)
+            raise
+
+    def get(self, note_id: str) -> Optional[Note]:
+        """按 ID 读取笔记（偏移索引单次读取）"""
+        try:
+            return self.log.get(sanitize_filename(note_id))
+        except Exception as e:
+            logger.error(f"读取笔记失败: {note_id}, 错误: {e}", exc_info=True)
+            raise
+
+    def get_markdown(self, note_id: str) -> Optional[str]:
+        note = self.get(note_id)
+        return render_markdown(note) if note is not None else None
+
+    def delete(self, note_id: str) -> bool:
+        """删除笔记：追加墓碑，段压缩时回收空间"""
+        note_id = sanitize_filename(note_id)
+        try:
+            found = self.log.delete(note_id)
+            if found:
+                self._search_index().remove(note_id)
+                vector_index = self._vector_index()
+                if vector_index is not None:
+                    vector_index.remove(note_id)
+                near_dup_index = self._near_dup_index()
+                if near_dup_index is not None:
+                    near_dup_index.remove(note_id)
+                logger.info(f"笔记删除成功: {note_id}")
+            else:
+                logger.warning(f"笔记未找到: {note_id}")
+            return found
+        except Exception as e:
+            logger.error(f"删除笔记失败: {note_id}, 错误: {e}", exc_info=True)
+            raise
+
+    def index_stats(self) -> Dict[str, int]:
+        """段日志的笔记数、段数与字节数，以及已加载的向量、指纹索引条目数"""
+        stats = self.log.stats()
+        for name, cls in (("vectors", VectorIndex), ("simhash", NearDupIndex)):
+            idx = cls.peek(self.seg_dir)
+            if idx is not None:
+                stats[name] = len(idx)
+        return stats
@@ -0,0 +1,420 @@
+from __future__ import annotations
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Set, Tuple
+from datetime import datetime, timezone
+import json
+import sqlite3
+import threading
+import logging
+from ..models import Note, NoteIn, BatchItemResult, NoteBatchResult
+from ..utils import sanitize_filename, sanitize_tenant, index_terms, query_terms, time_key, encode_cursor, decode_cursor
+from .base import AsyncStorageMixin, build_note, plan_batch, batch_summary
+from .markdown import render_markdown
+from .ranking import MAX_CANDIDATES, rank_notes
+
+logger = logging.getLogger(__name__)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS notes (
+    rowid INTEGER PRIMARY KEY,
+    tenant TEXT NOT NULL,
+    id TEXT NOT NULL,
+    saved_at TEXT NOT NULL,
+    dedup_key TEXT NOT NULL,
+    data TEXT NOT NULL
+);
+CREATE UNIQUE INDEX IF NOT EXISTS notes_tenant_id ON notes(tenant, id);
+CREATE UNIQUE INDEX IF NOT EXISTS notes_tenant_dedup ON notes(tenant, dedup_key);
+CREATE INDEX IF NOT EXISTS notes_tenant_saved_at ON notes(tenant, saved_at, rowid);
+CREATE VIRTUAL TABLE IF NOT EXISTS notes_fts USING fts5(terms, tokenize='unicode61');
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+"""
+
+def _fts_quote(term: str) -> str:
+    return '"' + term.replace('"', '""') + '"'
+
+class SQLiteDB:
+    """
+    SQLite 数据库（WAL 模式），进程内按文件路径共享
+
+    每个线程一个连接：WAL 下读不阻塞写，写入由 SQLite 串行化（busy_timeout 等待）。
+    """
+    _instances: Dict[Path, 'SQLiteDB'] = {}
+    _instances_lock = threading.Lock()
+
+    @classmethod
+    def open(cls, path: Path) -> 'SQLiteDB':
+        path = path.resolve()
+        with cls._instances_lock:
+            inst = cls._instances.get(path)
+            if inst is None:
+                inst = cls._instances[path] = cls(path)
+            return inst
+
+    def __init__(self, path: Path):
+        self.path = path
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._local = threading.local()
+        self.conn().executescript(_SCHEMA)
+        logger.info(f"打开 SQLite 数据库: {self.path}")
+
+    def conn(self) -> sqlite3.Connection:
+        c = getattr(self._local, 'conn', None)
+        if c is None:
+            c = sqlite3.connect(str(self.path), timeout=30, isolation_level=None)
+            c.execute('PRAGMA journal_mode=WAL')
+            c.execute('PRAGMA synchronous=NORMAL')
+            c.execute('PRAGMA busy_timeout=30000')
+            self._local.conn = c
+        return c
+
+class SQLiteStorage(AsyncStorageMixin):
+    """
+    SQLite 存储后端：笔记、去重和全文索引都在同一个数据库里
+
+    - 去重：(tenant, dedup_key) 唯一索引，插入冲突即为重复
+    - 列表：(tenant, saved_at, rowid) 索引，键集分页
+    - 搜索：FTS5 表存放 index_terms 生成的词项（中文单字/二元组 + jieba 分词 + 英文词），
+      unicode61 按空格切分，相当于预分词的中文分词器；命中后再做子串校验
+
+    db_path 为空时每个租户一个库（<base_dir>/<tenant>/notes.db），否则所有租户共用该文件。
+    """
+    EXPORT_BATCH = 200
+    IMPORT_BATCH = 500
+
+    def __init__(self, base_dir: str, tenant: str, db_path: Optional[str] = None):
+        self.base_dir = Path(base_dir).resolve()
+        self.tenant = sanitize_tenant(tenant)
+        try:
+            path = Path(db_path) if db_path else self.base_dir / self.tenant / 'notes.db'
+            self.db = SQLiteDB.open(path)
+            self._import_local_files()
+            self._reindex_tags()
+            logger.info(f"初始化 SQLite 存储: {self.db.path}, tenant={self.tenant}")
+        except Exception as e:
+            logger.error(f"初始化 SQLite 存储失败: {e}", exc_info=True)
+            raise
+
+    @staticmethod
+    def _haystack(data: dict) -> str:
+        """搜索文本：标题 + 标签 + 正文 + 上下文（与本地存储一致）"""
+        hay = data.get('title', '') + ' ' + ' '.join(data.get('tags') or []) + ' ' + data.get('content', '')
+        for m in (data.get('context_before') or []):
+            hay += ' ' + (m.get('text', '') if isinstance(m, dict) else '')
+        return hay
+
+    def _import_local_files(self):
+        """
+        首次使用时导入该租户已有的本地 JSON 笔记（LocalStorage 的目录布局）
+
+        在同一个事务中边读边按 IMPORT_BATCH 条插入，内存中只保留一批；其他进程已导入时直接返回。
+        """
+        conn = self.db.conn()
+        marker = f"imported:{self.tenant}"
+        if conn.execute("SELECT 1 FROM meta WHERE key = ?", (marker,)).fetchone():
+            return
+        tenant_dir = self.base_dir / self.tenant
+        total = inserted = 0
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            if conn.execute("SELECT 1 FROM meta WHERE key = ?", (marker,)).fetchone():
+                return
+            batch: List[Note] = []
+            for f in tenant_dir.glob('[0-9]*/*/*/*.json'):
+                try:
+                    batch.append(Note.model_validate_json(f.read_text(encoding='utf-8')))
+                except Exception as e:
+                    logger.warning(f"导入笔记失败: {f}, 错误: {e}")
+                    continue
+                if len(batch) >= self.IMPORT_BATCH:
+                    total, inserted = total + len(batch), inserted + sum(self._insert(conn, batch))
+                    batch = []
+            if batch:
+                total, inserted = total + len(batch), inserted + sum(self._insert(conn, batch))
+            conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)",
+                         (marker, datetime.now(timezone.utc).isoformat()))
+        if total:
+            logger.info(f"导入本地笔记到 SQLite: tenant={self.tenant}, 共 {total} 条, 新增 {inserted} 条")
+
+    def _reindex_tags(self):
+        """
+        早期版本的全文词项不含标签：为该租户已有笔记按批重新生成词项（一次性，同一事务内完成）
+        """
+        conn = self.db.conn()
+        marker = f"fts_tags:{self.tenant}"
+        if conn.execute("SELECT 1 FROM meta WHERE key = ?", (marker,)).fetchone():
+            return
+        total = 0
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            if conn.execute("SELECT 1 FROM meta WHERE key = ?", (marker,)).fetchone():
+                return
+            rows = conn.execute("SELECT rowid, data FROM notes WHERE tenant = ?", (self.tenant,))
+            while True:
+                batch = rows.fetchmany(self.IMPORT_BATCH)
+                if not batch:
+                    break
+                conn.executemany(
+                    "UPDATE notes_fts SET terms = ? WHERE rowid = ?",
+                    [(' '.join(sorted(index_terms(self._haystack(json.loads(data))))), rowid) for rowid, data in batch],
+                )
+                total += len(batch)
+            conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)",
+                         (marker, datetime.now(timezone.utc).isoformat()))
+        if total:
+            logger.info(f"重建 SQLite 全文词项（加入标签）: tenant={self.tenant}, 共 {total} 条")
+
+    def _insert(self, conn: sqlite3.Connection, notes: List[Note]) -> List[bool]:
+        """在当前事务中插入笔记和全文词项，返回每条是否插入（False 表示 dedup_key 冲突）"""
+        inserted = []
+        for n in notes:
+            cur = conn.execute(
+                "INSERT INTO notes (tenant, id, saved_at, dedup_key, data) VALUES (?, ?, ?, ?, ?) "
+                "ON CONFLICT DO NOTHING",
+                (self.tenant, n.id, time_key(n.saved_at), n.dedup_key, n.model_dump_json()),
+            )
+            if cur.rowcount == 0:
+                inserted.append(False)
+                continue
+            terms = ' '.join(sorted(index_terms(self._haystack(n.model_dump()))))
+            conn.execute("INSERT INTO notes_fts (rowid, terms) VALUES (?, ?)", (cur.lastrowid, terms))
+            inserted.append(True)
+        return inserted
+
+    def _check_dedup(self, note: Note) -> Optional[str]:
+        row = self.db.conn().execute(
+            "SELECT id FROM notes WHERE tenant = ? AND dedup_key = ?", (self.tenant, note.dedup_key)
+        ).fetchone()
+        return row[0] if row else None
+
+    def save(self, note_in: NoteIn, now: datetime, suggested_id: Optional[str] = None) -> Note:
+        try:
+            note = build_note(note_in, now, self.tenant, suggested_id)
+            conn = self.db.conn()
+            with conn:
+                conn.execute("BEGIN IMMEDIATE")
+                inserted = self._insert(conn, [note])[0]
+            if not inserted:
+                existing_id = self._check_dedup(note)
+                logger.info(f"检测到重复内容，返回已存在的笔记: {existing_id}")
+                return note.model_copy(update={"id": existing_id or note.id})
+            logger.info(f"笔记保存成功: {note.id}, 标题: {note.title[:50]}")
+            return note
+        except Exception as e:
+            logger.error(f"保存笔记失败: {e}", exc_info=True)
+            raise
+
+    def save_many(self, note_ins: List[NoteIn], now: datetime) -> NoteBatchResult:
+        """批量保存：整批在一个事务中插入"""
+        try:
+            results, fresh = plan_batch(note_ins, now, self.tenant, self._check_dedup)
+            conn = self.db.conn()
+            with conn:
+                conn.execute("BEGIN IMMEDIATE")
+                inserted = self._insert(conn, [n for _, n in fresh])
+            created = 0
+            for (i, note), ok in zip(fresh, inserted):
+                if ok:
+                    created += 1
+                else:
+                    existing_id = self._check_dedup(note) or note.id
+                    results[i] = BatchItemResult(index=i, status="duplicate", note=note.model_copy(update={"id": existing_id}))
+            logger.info(f"批量保存完成: 共 {len(note_ins)} 条, 新增 {created} 条")
+            return batch_summary(results)
+        except Exception as e:
+            logger.error(f"批量保存失败: {e}", exc_info=True)
+            raise
+
+    def list_recent(self, limit: int = 5) -> List[Note]:
+        return self.list_page(limit)[0]
+
+    def list_page(self, limit: int = 5, cursor: Optional[str] = None,
+                  before: Optional[datetime] = None) -> Tuple[List[Note], Optional[str]]:
+        """按 saved_at 倒序键集分页；游标记录上一页最后一条的 (saved_at, rowid)"""
+        try:
+            sql = "SELECT rowid, saved_at, data FROM notes WHERE tenant = ?"
+            params: list = [self.tenant]
+            if cursor:
+                c = decode_cursor(cursor)
+                if not isinstance(c.get('t'), str) or not isinstance(c.get('r'), int):
+                    raise ValueError(f"invalid cursor: {cursor}")
+                sql += " AND (saved_at, rowid) < (?, ?)"
+                params += [c['t'], c['r']]
+            elif before:
+                if before.tzinfo is None:
+                    before = before.replace(tzinfo=timezone.utc)
+                sql += " AND saved_at < ?"
+                params.append(time_key(before))
+            sql += " ORDER BY saved_at DESC, rowid DESC LIMIT ?"
+            params.append(limit)
+            rows = self.db.conn().execute(sql, params).fetchall()
+            items = [Note.model_validate_json(data) for _, _, data in rows]
+            next_cursor = encode_cursor({"t": rows[-1][1], "r": rows[-1][0]}) if len(rows) >= limit else None
+            logger.debug("列出最近笔记: %s 条", len(items))
+            return items, next_cursor
+        except ValueError:
+            raise
+        except Exception as e:
+            logger.error(f"列出笔记失败: {e}", exc_info=True)
+            raise
+
+    def iter_notes(self, since: Optional[datetime] = None) -> Iterator[Note]:
+        """
+        按保存时间顺序遍历全部笔记（导出用）
+
+        按 (saved_at, rowid) 键集分批查询：每批都在当前线程的连接上执行，
+        生成器可以在不同线程间交替推进。
+        """
+        t, rowid = '', 0
+        if since:
+            if since.tzinfo is None:
+                since = since.replace(tzinfo=timezone.utc)
+            t = time_key(since)
+        while True:
+            rows = self.db.conn().execute(
+                "SELECT rowid, saved_at, data FROM notes WHERE tenant = ? AND (saved_at > ? OR (saved_at = ? AND rowid > ?)) "
+                "ORDER BY saved_at, rowid LIMIT ?",
+                (self.tenant, t, t, rowid, self.EXPORT_BATCH),
+            ).fetchall()
+            for rowid, t, data in rows:
+                yield Note.model_validate_json(data)
+            if len(rows) < self.EXPORT_BATCH:
+                return
+
+    def _match_expr(self, q: str) -> Optional[str]:
+        """查询串转 FTS5 表达式：中文二元组精确匹配，英文片段按前缀匹配，全部 AND"""
+        cjk, words = query_terms(q)
+        parts = [_fts_quote(t) for t in sorted(cjk)] + [_fts_quote(w) + '*' for w in words]
+        return ' AND '.join(parts) if parts else None
+
+    def search(self, q: str, limit: int = 10) -> List[Note]:
+        """
+        搜索笔记：FTS5 取候选（新笔记在前），子串校验
+
+        英文片段可能是词中间的一段（"ython" 之于 "python"），FTS 前缀匹配不到：查询含英文片段
+        （或没有可索引词项）且本页未满时，再用 _substring_matches 补充并合并结果，与本地存储、段存储一致。
+        """
+        try:
+            conn = self.db.conn()
+            needle = q.lower()
+            items: List[Note] = []
+            seen = set()
+            expr = self._match_expr(q)
+            if expr is not None:
+                rows = conn.execute(
+                    "SELECT n.rowid, n.data FROM notes_fts f JOIN notes n ON n.rowid = f.rowid "
+                    "WHERE notes_fts MATCH ? AND n.tenant = ? ORDER BY n.saved_at DESC, n.rowid DESC",
+                    (expr, self.tenant),
+                )
+                for rowid, data in rows:
+                    d = json.loads(data)
+                    seen.add(rowid)
+                    if needle in self._haystack(d).lower():
+                        items.append(Note.model_validate(d))
+                        if len(items) >= limit:
+                            return items
+            if expr is None or query_terms(q)[1]:
+                items += self._substring_matches(conn, q, seen, limit - len(items))
+            logger.debug("搜索完成: 查询 '%s', 找到 %s 条", q, len(items))
+            return items
+        except Exception as e:
+            logger.error(f"搜索失败: {e}", exc_info=True)
+            raise
+
+    def _substring_matches(self, conn: sqlite3.Connection, q: str, seen: Set[int], limit: int) -> List[Note]:
+        """
+        LIKE 子串匹配标题、标签、正文和上下文（新笔记在前），跳过 seen 中 FTS 已取到的行
+
+        只取这几个字段而不是整列 JSON，不会匹配到键名；仍需扫描该租户的全部笔记。
+        """
+        pattern = '%' + q.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+        rows = conn.execute(
+            "SELECT rowid, data FROM notes WHERE tenant = ? "
+            "AND (COALESCE(json_extract(data, '$.title'), '') || ' ' || COALESCE(json_extract(data, '$.tags'), '') "
+            "|| ' ' || COALESCE(json_extract(data, '$.content'), '') "
+            "|| ' ' || COALESCE(json_extract(data, '$.context_before'), '')) LIKE ? ESCAPE '\\' "
+            "ORDER BY saved_at DESC, rowid DESC",
+            (self.tenant, pattern),
+        )
+        needle = q.lower()
+        items: List[Note] = []
+        for rowid, data in rows:
+            if rowid in seen:
+                continue
+            d = json.loads(data)
+            if needle in self._haystack(d).lower():
+                items.append(Note.model_validate(d))
+                if len(items) >= limit:
+                    break
+        return items
+
+    def search_scored(self, q: str, limit: int = 10) -> List[Tuple[Note, float]]:
+        """
+        BM25 排序搜索：FTS5 按 bm25() 取最相关的 MAX_CANDIDATES 篇候选（LIMIT 在排序之后），
+        子串校验后用与其他后端一致的 BM25F（标题、标签加权）打分取前 limit 篇
+        """
+        try:
+            expr = self._match_expr(q)
+            if expr is None:
+                return rank_notes(q, self.search(q, MAX_CANDIDATES), limit)
+            needle = q.lower()
+            conn = self.db.conn()
+            rows = conn.execute(
+                "SELECT n.rowid, n.data FROM notes_fts f JOIN notes n ON n.rowid = f.rowid "
+                "WHERE notes_fts MATCH ? AND n.tenant = ? ORDER BY bm25(notes_fts), n.saved_at DESC LIMIT ?",
+                (expr, self.tenant, MAX_CANDIDATES),
+            ).fetchall()
+            notes = []
+            seen = set()
+            for rowid, data in rows:
+                seen.add(rowid)
+                d = json.loads(data)
+                if needle in self._haystack(d).lower():
+                    notes.append(Note.model_validate(d))
+            if query_terms(q)[1] and len(notes) < MAX_CANDIDATES:
+                # 英文片段可能是词中间的一段，FTS 前缀匹配不到：按子串补充候选
+                notes += self._substring_matches(conn, q, seen, MAX_CANDIDATES - len(notes))
+            hits = rank_notes(q, notes, limit)
+            logger.debug("搜索完成: 查询 '%s', 候选 %s 条, 返回 %s 条", q, len(rows), len(hits))
+            return hits
+        except Exception as e:
+            logger.error(f"搜索失败: {e}", exc_info=True)
+            raise
+
+    def get(self, note_id: str) -> Optional[Note]:
+        """按 ID 读取笔记"""
+        note_id = sanitize_filename(note_id)
+        try:
+            row = self.db.conn().execute(
+                "SELECT data FROM notes WHERE tenant = ? AND id = ?", (self.tenant, note_id)
+            ).fetchone()
+            return Note.model_validate_json(row[0]) if row else None
+        except Exception as e:
+            logger.error(f"读取笔记失败: {note_id}, 错误: {e}", exc_info=True)
+            raise
+
+    def get_markdown(self, note_id: str) -> Optional[str]:
+        note = self.get(note_id)
+        return render_markdown(note) if note is not None else None
+
+    def delete(self, note_id: str) -> bool:
+        """删除笔记及其全文词项"""
+        note_id = sanitize_filename(note_id)
+        try:
+            conn = self.db.conn()
+            with conn:
+                conn.execute("BEGIN IMMEDIATE")
+                row = conn.execute(
+                    "SELECT rowid FROM notes WHERE tenant = ? AND id = ?", (self.tenant, note_id)
+                ).fetchone()
+                if row:
+                    conn.execute("DELETE FROM notes_fts WHERE rowid = ?", (row[0],))
+                    conn.execute("DELETE FROM notes WHERE rowid = ?", (row[0],))
+            if row:
+                logger.info(f"笔记删除成功: {note_id}")
+            else:
+                logger.warning(f"笔记未找到: {note_id}")
+            return row is not None
+        except Exception as e:
+            logger.error(f"删除笔记失败: {note_id}, 错误: {e}", exc_info=True)
+            raise
@@ -0,0 +1,120 @@
+from __future__ import annotations
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from pathlib import Path
+from typing import AsyncIterator, Dict, Optional
+import asyncio
+import os
+import threading
+import time
+import logging
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+# 异步路径等待 flock 的专用线程：不占用存储 I/O 线程池，持锁的协程在临界区内仍能使用线程池
+LOCK_WAIT_THREADS = 8
+_lock_executor: Optional[ThreadPoolExecutor] = None
+_lock_executor_lock = threading.Lock()
+
+def lock_executor() -> ThreadPoolExecutor:
+    global _lock_executor
+    with _lock_executor_lock:
+        if _lock_executor is None:
+            _lock_executor = ThreadPoolExecutor(max_workers=LOCK_WAIT_THREADS, thread_name_prefix='clipnotes-lock')
+        return _lock_executor
+
+class TenantLock:
+    """
+    租户级写锁（本地存储）：进程内互斥锁 + 跨进程 flock 咨询锁
+
+    保存、删除等"读-改-写"索引的操作在锁内进行，多个 uvicorn worker
+    或共享数据目录的多个实例不会互相覆盖索引、也不会重复追加清单。
+    锁不与线程绑定，异步路径可以在一个线程获取、在另一个线程释放。
+
+    异步路径先在事件循环上排队（asyncio.Lock，同一租户同时只有一个协程等待进程锁），
+    再到专用线程中取进程锁和 flock；存储 I/O 线程池中的线程不会阻塞在本锁上，
+    否则等待者占满线程池后，持锁者的 run_io 调用永远拿不到线程。
+    """
+
+    _instances: Dict[Path, 'TenantLock'] = {}
+    _instances_lock = threading.Lock()
+
+    @classmethod
+    def open(cls, path: Path) -> 'TenantLock':
+        """获取（进程内共享的）锁实例"""
+        path = path.resolve()
+        with cls._instances_lock:
+            inst = cls._instances.get(path)
+            if inst is None:
+                inst = cls._instances[path] = cls(path)
+            return inst
+
+    def __init__(self, path: Path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._fd: Optional[int] = None
+        self._alock: Optional[asyncio.Lock] = None
+
+    def acquire(self, blocking: bool = True, timeout: Optional[float] = None) -> bool:
+        """获取锁；blocking=False 时锁被占用立即返回 False，timeout 为最多等待的秒数（轮询 flock）"""
+        if blocking and timeout is not None:
+            deadline = time.monotonic() + timeout
+            while not self.acquire(blocking=False):
+                if time.monotonic() >= deadline:
+                    return False
+                time.sleep(0.05)
+            return True
+        if not self._lock.acquire(blocking):
+            return False
+        if fcntl is None:
+            return True
+        try:
+            if self._fd is None:
+                self.path.parent.mkdir(parents=True, exist_ok=True)
+                self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+            fcntl.flock(self._fd, fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+            return True
+        except BlockingIOError:
+            self._lock.release()
+            return False
+        except Exception as e:
+            self._lock.release()
+            logger.error(f"获取租户锁失败: {self.path}, 错误: {e}", exc_info=True)
+            raise
+
+    def release(self):
+        try:
+            if fcntl is not None and self._fd is not None:
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+        finally:
+            self._lock.release()
+
+    def __enter__(self) -> 'TenantLock':
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+    @asynccontextmanager
+    async def ahold(self) -> AsyncIterator['TenantLock']:
+        """异步路径持锁：在事件循环上排队，只在专用线程中等待进程锁和 flock"""
+        if self._alock is None:
+            self._alock = asyncio.Lock()
+        async with self._alock:
+            fut = asyncio.get_running_loop().run_in_executor(lock_executor(), self.acquire)
+            try:
+                await asyncio.shield(fut)
+            except asyncio.CancelledError:
+                # 取消时线程仍可能拿到锁，拿到后立即释放
+                fut.add_done_callback(lambda f: f.cancelled() or f.exception() or self.release())
+                raise
+            try:
+                yield self
+            finally:
+                self.release()
@@ -0,0 +1,185 @@
+from __future__ import annotations
+from pathlib import Path
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+import os
+import uuid
+import logging
+from ..models import Note
+from .journal import JournalIndex
+
+try:
+    import numpy as np
+except ImportError:  # 未安装 numpy 时不会启用向量化，也不会打开本索引
+    np = None
+
+logger = logging.getLogger(__name__)
+
+class VectorIndex(JournalIndex):
+    """
+    租户级向量索引：连续的 float32 矩阵（内存映射）+ 行号日志
+
+    - 矩阵文件 index/vectors-<代号>.f32：每行一篇笔记的归一化向量，按行号写入
+    - 行号日志 index/vector_index.jsonl：
+      {"op": "matrix", "file": "vectors-<代号>.f32", "dim": 256}（首行）
+      {"op": "add", "id": ..., "row": N}
+      {"op": "del", "id": ...}
+
+    查询对整块矩阵做一次矩阵-向量乘法，argpartition 取 top-k，不读取笔记文件。
+    先写向量再追加日志，其他进程看到日志记录时对应的行已经在磁盘上；
+    压缩时把存活行写入新一代矩阵文件再重写日志，旧文件的内存映射在替换后仍然有效。
+    """
+    FILENAME = 'vector_index.jsonl'
+    CHUNK_ROWS = 1024
+
+    def _clear(self):
+        self.file: Optional[str] = None
+        self.dim = 0
+        self._rows: Dict[str, int] = {}
+        self._ids: List[Optional[str]] = []
+        self._matrix = None
+        self._alive = None  # 存活行掩码（缓存，记录变化时失效）
+
+    def _size(self) -> int:
+        return len(self._rows)
+
+    def _apply(self, rec: dict):
+        op = rec.get('op')
+        if op == 'matrix':
+            self.file, self.dim = rec.get('file'), int(rec.get('dim') or 0)
+            self._matrix = None
+            return
+        note_id = rec.get('id')
+        if not note_id:
+            return
+        old = self._rows.pop(note_id, None)
+        if old is not None:
+            self._ids[old] = None
+            self._dead += 1
+        if op == 'add':
+            row = int(rec['row'])
+            if row >= len(self._ids):
+                self._ids.extend([None] * (row + 1 - len(self._ids)))
+            self._ids[row] = note_id
+            self._rows[note_id] = row
+        else:
+            self._dead += 1
+        self._alive = None
+
+    def _matrix_path(self) -> Path:
+        return self.path.parent / self.file
+
+    def _view(self):
+        """当前矩阵的只读内存映射（覆盖全部已分配的行），文件增长后重新映射"""
+        n = len(self._ids)
+        if n == 0 or not self.file:
+            return None
+        if self._matrix is None or self._matrix.shape[0] < n:
+            path = self._matrix_path()
+            rows = path.stat().st_size // (self.dim * 4)
+            self._matrix = np.memmap(path, dtype=np.float32, mode='r', shape=(rows, self.dim))
+        return self._matrix[:n]
+
+    # ---- 查询 ----
+
+    def dimension(self) -> int:
+        with self._lock:
+            self._refresh()
+            return self.dim
+
+    def top_k(self, query: 'np.ndarray', k: int, exclude: Optional[str] = None) -> List[Tuple[str, float]]:
+        """余弦相似度最高的 k 篇笔记 [(id, 相似度)]，按相似度降序"""
+        with self._lock:
+            self._refresh()
+            try:
+                matrix = self._view()
+            except FileNotFoundError:
+                # 其他进程刚压缩替换了矩阵文件，重新读取日志
+                self._reset()
+                self._refresh()
+                matrix = self._view()
+            if matrix is None or k <= 0:
+                return []
+            if self._alive is None:
+                self._alive = np.fromiter((i is not None for i in self._ids), dtype=bool, count=len(self._ids))
+            scores = matrix @ query.astype(np.float32, copy=False)
+            scores[~self._alive] = -np.inf
+            if exclude is not None and exclude in self._rows:
+                scores[self._rows[exclude]] = -np.inf
+            k = min(k, len(scores))
+            top = np.argpartition(-scores, k - 1)[:k]
+            top = top[np.argsort(-scores[top], kind='stable')]
+            return [(self._ids[i], float(scores[i])) for i in top if np.isfinite(scores[i])]
+
+    # ---- 写入 ----
+
+    def add_many(self, entries: Sequence[Tuple[str, 'np.ndarray']]):
+        """批量写入向量：(id, 向量)；已存在的 ID 改写到新行"""
+        if not entries:
+            return
+        with self._lock:
+            self._refresh()
+            start = len(self._ids)
+            data = np.ascontiguousarray(np.stack([v for _, v in entries]), dtype=np.float32)
+            with open(self._matrix_path(), 'r+b') as f:
+                f.seek(start * self.dim * 4)
+                f.write(data.tobytes())
+            self._commit([{"op": "add", "id": note_id, "row": start + k} for k, (note_id, _) in enumerate(entries)])
+
+    def remove(self, note_id: str):
+        with self._lock:
+            self._refresh()
+            if note_id in self._rows:
+                self._commit([{"op": "del", "id": note_id}])
+
+    def rebuild(self, dim: int, entries: Iterable[Tuple[str, 'np.ndarray']]):
+        """用 (id, 向量) 全量重建索引（写入新一代矩阵文件）"""
+        with self._lock:
+            count = self._write_generation(dim, entries)
+            logger.info(f"重建向量索引: {self.path}, 笔记数: {count}, 维度: {dim}")
+
+    def _write_generation(self, dim: int, entries: Iterable[Tuple[str, 'np.ndarray']]) -> int:
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        old = self._matrix_path() if self.file else None
+        name = f"vectors-{uuid.uuid4().hex[:12]}.f32"
+        records = [{"op": "matrix", "file": name, "dim": dim}]
+        with open(self.path.parent / name, 'wb') as f:
+            for chunk in _chunks(entries, self.CHUNK_ROWS):
+                data = np.ascontiguousarray(np.stack([v for _, v in chunk]), dtype=np.float32)
+                f.write(data.tobytes())
+                start = len(records) - 1
+                records.extend([{"op": "add", "id": note_id, "row": start + k} for k, (note_id, _) in enumerate(chunk)])
+        self._rewrite(records)
+        if old is not None and old.name != name:
+            try:
+                os.unlink(old)
+            except FileNotFoundError:
+                pass
+        return len(records) - 1
+
+    def _maybe_compact(self):
+        if self._dead < self.COMPACT_MIN_DEAD or self._dead < self._size():
+            return
+        matrix = self._view()
+        live = sorted(self._rows.items(), key=lambda kv: kv[1])
+        count = self._write_generation(self.dim, ((note_id, matrix[row]) for note_id, row in live))
+        logger.info(f"压缩向量索引: {self.path}, 保留 {count} 条")
+
+def rank_similar(index: VectorIndex, query: 'np.ndarray', limit: int, load: Callable[[str], Optional[Note]],
+                 exclude: Optional[str] = None) -> List[Tuple[Note, float]]:
+    """按向量相似度取前 limit 篇笔记 [(笔记, 相似度)]；load 按 ID 读取笔记（已删除的返回 None）"""
+    hits: List[Tuple[Note, float]] = []
+    for note_id, score in index.top_k(query, limit + (exclude is not None), exclude=exclude):
+        note = load(note_id)
+        if note is not None:
+            hits.append((note, score))
+    return hits[:limit]
+
+def _chunks(entries: Iterable, size: int) -> Iterator[list]:
+    chunk = []
+    for entry in entries:
+        chunk.append(entry)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
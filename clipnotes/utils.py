@@ -1,10 +1,30 @@
-import re, hashlib, base64
-from datetime import datetime
+import re, hashlib, base64, json, os
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
+from typing import List, Optional, Set, Tuple
+import multiprocessing
+import threading
+import time
+import jieba
 import jieba.analyse as ja
 import logging
+from .metrics import KEYWORD_CACHE, KEYWORD_LATENCY
 
 logger = logging.getLogger(__name__)
 
+# 内容（批量时为总字数）达到该值才交给进程池，较短的内容直接在当前进程处理（进程间传输不划算）
+KEYWORD_POOL_MIN_CHARS = 20000
+# 进程池提取的超时时间（秒），超时后只对内容前 KEYWORD_POOL_MIN_CHARS 字在本进程提取
+KEYWORD_TIMEOUT = 10.0
+# 关键词缓存条数（按内容哈希），重试或重复保存时直接复用
+KEYWORD_CACHE_SIZE = 2048
+
+_keyword_pool: Optional[ProcessPoolExecutor] = None
+_keyword_pool_lock = threading.Lock()
+_keyword_cache: "OrderedDict[Tuple[str, int], List[str]]" = OrderedDict()
+_keyword_cache_lock = threading.Lock()
+
 def sanitize_filename(name: str, max_length: int = 100) -> str:
     """
     清理文件名/ID，防止路径注入攻击
@@ -115,8 +135,153 @@ def dedup_key(content: str, ts: datetime) -> str:
     minute = ts.strftime('%Y%m%d%H%M')
     return f"{b22}@{minute}"
 
-def extract_keywords(text: str, topk: int = 5):
-    """提取关键词，带错误处理和日志"""
+def configure_keywords(pool_min_chars: int, timeout: float, cache_size: int):
+    """设置关键词提取参数（进程池阈值、超时、缓存条数）"""
+    global KEYWORD_POOL_MIN_CHARS, KEYWORD_TIMEOUT, KEYWORD_CACHE_SIZE
+    KEYWORD_POOL_MIN_CHARS = max(1, pool_min_chars)
+    KEYWORD_TIMEOUT = max(0.1, timeout)
+    KEYWORD_CACHE_SIZE = max(0, cache_size)
+
+def warm_up_keywords():
+    """预加载 jieba 词典和 IDF 表，避免首个请求承担数秒的加载时间"""
+    start = time.perf_counter()
+    jieba.initialize()
+    ja.extract_tags("预热关键词提取", topK=1)
+    logger.info(f"jieba 预热完成: {time.perf_counter() - start:.2f}s")
+
+def _warm_worker():
+    # 进程池子进程的初始化函数：每个子进程各自加载一次词典
+    jieba.setLogLevel(logging.WARNING)
+    jieba.initialize()
+    ja.extract_tags("预热关键词提取", topK=1)
+
+def _keyword_workers() -> int:
+    return min(4, os.cpu_count() or 1)
+
+def keyword_pool() -> ProcessPoolExecutor:
+    """关键词提取进程池（jieba TF-IDF 是 CPU 密集型，线程无法绕开 GIL）"""
+    global _keyword_pool
+    with _keyword_pool_lock:
+        if _keyword_pool is None:
+            workers = _keyword_workers()
+            _keyword_pool = ProcessPoolExecutor(
+                max_workers=workers, mp_context=multiprocessing.get_context('spawn'), initializer=_warm_worker
+            )
+            logger.info(f"创建关键词提取进程池: workers={workers}")
+        return _keyword_pool
+
+def start_keyword_pool():
+    """提前拉起全部子进程并完成预热（不等待），大内容的首次提取不必再等子进程启动"""
+    pool = keyword_pool()
+    for _ in range(_keyword_workers()):
+        pool.submit(int)
+
+def shutdown_keyword_pool():
+    global _keyword_pool
+    with _keyword_pool_lock:
+        if _keyword_pool is not None:
+            _keyword_pool.shutdown(wait=False, cancel_futures=True)
+            _keyword_pool = None
+
+def _cache_key(text: str, topk: int) -> Tuple[str, int]:
+    return hashlib.sha256(text.encode('utf-8')).hexdigest(), topk
+
+def _cache_get(key: Tuple[str, int]) -> Optional[List[str]]:
+    with _keyword_cache_lock:
+        kws = _keyword_cache.get(key)
+        if kws is not None:
+            _keyword_cache.move_to_end(key)
+            KEYWORD_CACHE.inc('hit')
+            return list(kws)
+    KEYWORD_CACHE.inc('miss')
+    return None
+
+def _cache_put(key: Tuple[str, int], kws: List[str]):
+    if KEYWORD_CACHE_SIZE <= 0:
+        return
+    with _keyword_cache_lock:
+        _keyword_cache[key] = list(kws)
+        _keyword_cache.move_to_end(key)
+        while len(_keyword_cache) > KEYWORD_CACHE_SIZE:
+            _keyword_cache.popitem(last=False)
+
+def _extract_fallback(text: str, topk: int) -> List[str]:
+    # 进程池不可用或超时：只处理内容前部，保证在本进程内的耗时有上限
+    return _extract_tags(text[:KEYWORD_POOL_MIN_CHARS], topk)
+
+def extract_keywords(text: str, topk: int = 5) -> List[str]:
+    """
+    提取关键词，带缓存和错误处理
+
+    结果按内容哈希缓存；长内容交给进程池处理，超时或失败时回退为只提取内容前部。
+    """
+    key = _cache_key(text, topk)
+    cached = _cache_get(key)
+    if cached is not None:
+        return cached
+    start = time.perf_counter()
+    if len(text) < KEYWORD_POOL_MIN_CHARS:
+        kws = _extract_tags(text, topk)
+        path = 'inline'
+    else:
+        try:
+            kws = keyword_pool().submit(_extract_tags, text, topk).result(timeout=KEYWORD_TIMEOUT)
+            path = 'pool'
+        except Exception as e:
+            logger.warning(f"进程池关键词提取失败，回退为提取前 {KEYWORD_POOL_MIN_CHARS} 字: {e!r}")
+            kws = _extract_fallback(text, topk)
+            path = 'fallback'
+    KEYWORD_LATENCY.observe(time.perf_counter() - start, path)
+    _cache_put(key, kws)
+    return kws
+
+def extract_keywords_many(texts: List[str], topk: int = 5) -> List[List[str]]:
+    """批量提取关键词：先查缓存，未命中的内容较多时在进程池中并行处理，失败时回退"""
+    keys = [_cache_key(t, topk) for t in texts]
+    results: List[Optional[List[str]]] = [_cache_get(k) for k in keys]
+    misses = [i for i, r in enumerate(results) if r is None]
+    todo = [texts[i] for i in misses]
+    if len(todo) < 2 or sum(len(t) for t in todo) < KEYWORD_POOL_MIN_CHARS:
+        extracted = [extract_keywords(t, topk) for t in todo]
+    else:
+        start = time.perf_counter()
+        try:
+            extracted = list(keyword_pool().map(_extract_tags, todo, [topk] * len(todo), timeout=KEYWORD_TIMEOUT))
+            path = 'pool_batch'
+        except Exception as e:
+            logger.warning(f"并行关键词提取失败，回退为逐条提取前 {KEYWORD_POOL_MIN_CHARS} 字: {e!r}")
+            extracted = [_extract_fallback(t, topk) for t in todo]
+            path = 'fallback'
+        KEYWORD_LATENCY.observe(time.perf_counter() - start, path)
+    for i, kws in zip(misses, extracted):
+        _cache_put(keys[i], kws)
+        results[i] = kws
+    return results
+
+def time_key(ts: datetime) -> str:
+    """定长的 UTC 时间串，字典序即时间序（isoformat 在微秒为 0 时会省略小数部分，不能直接比较）"""
+    if ts.tzinfo is not None:
+        ts = ts.astimezone(timezone.utc)
+    return ts.strftime('%Y-%m-%dT%H:%M:%S.%f')
+
+def encode_cursor(data: dict) -> str:
+    """把分页位置编码为不透明游标"""
+    raw = json.dumps(data, separators=(',', ':'), ensure_ascii=False).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+def decode_cursor(cursor: str) -> dict:
+    """解析分页游标，格式错误时抛出 ValueError"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        data = json.loads(raw.decode('utf-8'))
+    except Exception as e:
+        raise ValueError(f"invalid cursor: {cursor}") from e
+    if not isinstance(data, dict):
+        raise ValueError(f"invalid cursor: {cursor}")
+    return data
+
+def _extract_tags(text: str, topk: int = 5) -> List[str]:
+    """jieba TF-IDF 提取关键词（在当前进程执行，也是进程池中的任务函数）"""
     try:
         kws = ja.extract_tags(text, topK=topk, withWeight=False, allowPOS=())
         return [k for k in kws if len(k.strip()) > 1]
@@ -124,6 +289,44 @@ def extract_keywords(text: str, topk: int = 5):
         logger.warning(f"关键词提取失败: {e}", exc_info=True)
         return []
 
+_CJK_RUN = re.compile(r'[\u4e00-\u9fff]+')
+_WORD = re.compile(r'[0-9a-z]+')
+
+def index_terms(text: str) -> Set[str]:
+    """
+    生成倒排索引词项
+
+    包含三类词项：
+    1. 英文/数字词（小写）
+    2. 中文单字与相邻二元组（保证子串式中文查询可命中）
+    3. jieba 分词结果（长度 > 1）
+    """
+    text = (text or '').lower()
+    terms = set(_WORD.findall(text))
+    for run in _CJK_RUN.findall(text):
+        terms.update(run)
+        terms.update(run[i:i + 2] for i in range(len(run) - 1))
+        if len(run) > 2:
+            terms.update(w for w in jieba.cut(run) if len(w) > 1)
+    return terms
+
+def query_terms(q: str) -> Tuple[Set[str], List[str]]:
+    """
+    拆分查询串，用于倒排索引候选集筛选
+
+    Returns:
+        (中文词项, 英文/数字片段)。中文片段拆成二元组（单字则保留单字），
+        英文片段可能只是某个词的一部分，需要在词表中做子串匹配。
+    """
+    q = (q or '').lower()
+    cjk: Set[str] = set()
+    for run in _CJK_RUN.findall(q):
+        if len(run) == 1:
+            cjk.add(run)
+        else:
+            cjk.update(run[i:i + 2] for i in range(len(run) - 1))
+    return cjk, _WORD.findall(q)
+
 def generate_ai_title(content: str) -> str:
     """
     使用 AI 生成笔记标题（未来功能）